@@ -1,20 +1,220 @@
-from flask import Flask, jsonify, request, make_response, abort
+from flask import Flask, jsonify, request, make_response, abort, Response, stream_with_context, current_app
 from flask_restful import Api, Resource
-from config import Config
-from flask_migrate import Migrate
-from models import db, Student, Profile, Instructor, Course, Enrollment
+from config import get_config
+from models import db, chunked, enable_sqlite_pragmas, Student, Profile, Instructor, Course, Enrollment, WaitlistEntry, CourseReport, InstructorReport
 from flask_cors import CORS
+from cache import cache, conditional
+from changes import feed, changes_cli, LogTruncated
+from compression import compression
+from grades import grade_queue, QueueFull
+from replicas import replicas, replicas_cli
+from metrics import metrics, serializing, count_rows
+from reports import reports_cli
+from schedules import schedules_cli
+from search import search, search_cli, KINDS as SEARCH_KINDS
+import seats
+from seats import seats_cli
+from serializers import row_serializers, course_rows, student_rows, instructor_rows, enrollment_rows, profile_rows, waitlist_rows, FastJSONProvider
 from datetime import datetime
+import click
+from sqlalchemy import insert
+from sqlalchemy.orm import configure_mappers
+from sqlalchemy.exc import IntegrityError
+import json
+import math
+
+api = Api()
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+STREAM_BATCH_SIZE = 1000
+NDJSON_MIMETYPE = 'application/x-ndjson'
+MAX_BULK_ITEMS = 50000
+CHANGES_PAGE_SIZE = 1000
+MAX_CHANGES_PAGE_SIZE = 10000
+
+# Tables each resource's GET payload is built from, used for caching and ETags
+COURSE_TABLES = ('courses', 'instructors', 'enrollments')
+# Enrollment, course and instructor changes reach students through the
+# student_schedules read model, which schedules.py rewrites as they happen
+STUDENT_TABLES = ('students', 'profiles', 'student_schedules')
+STUDENT_COUNT_TABLES = ('students',)
+INSTRUCTOR_TABLES = ('instructors', 'courses')
+ENROLLMENT_TABLES = ('enrollments', 'courses', 'instructors')
+PROFILE_TABLES = ('profiles',)
+COURSE_REPORT_TABLES = ('course_reports',)
+INSTRUCTOR_REPORT_TABLES = ('instructor_reports',)
+SEARCH_TABLES = ('students', 'courses', 'instructors')
+WAITLIST_TABLES = ('courses', 'waitlist_entries')
+
+
+# Integer query argument, default when absent. A value that isn't an
+# integer is a 400 rather than ignored, which for ?limit= or ?after=
+# would silently return the whole collection.
+def int_arg(name, default=None):
+    value = request.args.get(name)
+    if value is None:
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        abort(400, description=f"{name} must be an integer")
+
+
+# Number query argument, default when absent; like int_arg, a value that
+# isn't a finite number is a 400
+def float_arg(name, default=None):
+    value = request.args.get(name)
+    if value is None:
+        return default
+    try:
+        number = float(value)
+    except ValueError:
+        number = None
+    if number is None or not math.isfinite(number):
+        abort(400, description=f"{name} must be a number")
+    return number
+
+
+# Parses ?limit=&after=&fields= for a collection endpoint. Returns a
+# function fetching one page as (items, next_cursor), the cursor and limit.
+def collection_query(model):
+    after = int_arg('after')
+    limit = int_arg('limit')
+    fields = request.args.get('fields')
+
+    if limit is None and after is not None:
+        limit = DEFAULT_PAGE_SIZE
+    if limit is not None:
+        limit = max(1, min(limit, MAX_PAGE_SIZE))
+
+    if fields:
+        names = [f.strip() for f in fields.split(',') if f.strip()]
+        unknown = set(names) - set(model.projectable_fields())
+        if unknown:
+            abort(400, description=f"Unknown fields: {', '.join(sorted(unknown))}")
+
+        statement = model.projection(names)
+
+        def page(after, limit):
+            rows, next_cursor = model.keyset_page(statement, after, limit)
+            count_rows(len(rows))
+            with serializing():
+                return [dict(row._mapping) for row in rows], next_cursor
+
+        return page, after, limit
+
+    return row_serializers[model].page, after, limit
+
+
+# Reads a collection honouring ?limit=&after= (keyset on id) and ?fields=
+# (column projection). Returns the serialized items and the next cursor.
+def fetch_collection(model):
+    page, after, limit = collection_query(model)
+    return page(after, limit)
+
+
+# Whether the client asked for newline-delimited JSON instead of one array
+def wants_stream():
+    if request.args.get('stream') == '1':
+        return True
+    return request.accept_mimetypes.best_match(['application/json', NDJSON_MIMETYPE]) == NDJSON_MIMETYPE
+
+
+# Streams a collection as NDJSON, reading it in keyset batches of
+# STREAM_BATCH_SIZE rows so memory stays flat however large it is. Each
+# batch is a query of its own, not one result read with yield_per, so no
+# cursor stays open while the client reads. Each batch goes out as one
+# chunk, which compression flushes as a whole.
+def stream_collection(model):
+    page, after, limit = collection_query(model)
+
+    def generate():
+        cursor, remaining = after, limit
+        while remaining is None or remaining > 0:
+            size = STREAM_BATCH_SIZE if remaining is None else min(STREAM_BATCH_SIZE, remaining)
+            items, cursor = page(cursor, size)
+            if items:
+                yield ''.join(current_app.json.dumps(item) + '\n' for item in items)
+
+            if remaining is not None:
+                remaining -= len(items)
+            if cursor is None:
+                break
+
+    return Response(stream_with_context(generate()), mimetype=NDJSON_MIMETYPE)
+
+
+# Builds a collection response, exposing the next cursor as a header so
+# the body stays a plain list
+def collection_response(items, next_cursor):
+    response = make_response(items, 200)
+    if next_cursor is not None:
+        response.headers['X-Next-Cursor'] = str(next_cursor)
+    return response
+
+
+# Validates a PATCH body: an object whose keys are all columns the model
+# allows updating. Returns the values to set.
+def patch_values(model, data):
+    if not isinstance(data, dict) or not data:
+        abort(400, description='Expected a JSON object of fields to update')
 
-app = Flask(__name__)
-# CORS(app)
-CORS(app, resources={r"/*": {"origins": "*"}}, supports_credentials=True)
-app.config.from_object(Config)
-migrate = Migrate(app, db)
+    unknown = set(data) - set(model.updatable_fields())
+    if unknown:
+        abort(400, description=f"Unknown fields: {', '.join(sorted(unknown))}")
+
+    invalid = invalid_value(model, data)
+    if invalid:
+        abort(400, description=invalid)
+    return data
 
-db.init_app(app)
 
-api = Api(app)
+# Checks values against the model's columns before they are written: null
+# only where the column allows it, otherwise the column's Python type
+# (JSON booleans are not integers). Returns a message for the first bad
+# value, or None.
+def invalid_value(model, values):
+    for key, value in values.items():
+        column = model.__table__.c[key]
+        if value is None:
+            if not column.nullable:
+                return f'{key} cannot be null'
+            continue
+
+        expected = column.type.python_type
+        if not isinstance(value, expected) or (isinstance(value, bool) and expected is not bool):
+            return f'{key} must be of type {expected.__name__}'
+    return None
+
+
+# Row ids in request bodies are integers; JSON booleans are not ids
+def valid_id(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+# Course capacities are counts of seats, or null for no limit
+def valid_capacity(value):
+    return value is None or (isinstance(value, int) and not isinstance(value, bool) and value >= 0)
+
+
+# Applies a PATCH to one row with a single UPDATE ... RETURNING, without
+# loading the row first, and responds with its columns as updated
+def patch_row(model, id, not_found):
+    values = patch_values(model, request.get_json())
+
+    try:
+        row = model.update_by_id(id, values)
+    except IntegrityError:
+        db.session.rollback()
+        abort(409, description='Update conflicts with existing data')
+
+    if row is None:
+        db.session.rollback()
+        abort(404, description=not_found)
+
+    db.session.commit()
+    return make_response(dict(row._mapping), 200)
 
 
 class Home(Resource):
@@ -28,11 +228,16 @@ api.add_resource(Home, '/')
 
 class Courses(Resource):
     # Api to return all the courses present
+    @conditional(*COURSE_TABLES)
+    @cache.cached(*COURSE_TABLES)
     def get(self):
-        courses = [c.to_dict() for c in Course.query.all()]
+        if wants_stream():
+            return stream_collection(Course)
+
+        courses, next_cursor = fetch_collection(Course)
 
         if courses:
-            response = make_response(courses, 200)
+            response = collection_response(courses, next_cursor)
             return response
         else:
             abort(404, description="Could not fetch the courses")
@@ -42,28 +247,42 @@ class Courses(Resource):
 
         new_course = Course(
             title=data.get('title'),
-            instructor_id=data.get('instructor_id')
+            instructor_id=data.get('instructor_id'),
+            capacity=data.get('capacity')
         )
+
+        if not valid_capacity(new_course.capacity):
+            abort(400, description='capacity must be a non-negative integer or null')
+
+        if new_course.instructor_id is not None and not db.session.get(Instructor, new_course.instructor_id):
+            abort(404, description='Invalid instructor_id')
+
         db.session.add(new_course)
         db.session.commit()
 
-        new_course_dict = new_course.to_dict()
+        new_course_dict = course_rows.one(new_course.id)
         response = make_response(new_course_dict, 201)
 
         return response
-    
+
+    # Deletes the courses listed in the body, with their enrollments
+    def delete(self):
+        return bulk_delete(Course, 'courses')
+
 
 api.add_resource(Courses, '/course')
 
 class CourseByID(Resource):
     # Hanldes the fetching of a course
+    @conditional(*COURSE_TABLES)
+    @cache.cached(*COURSE_TABLES)
     def get(self, id):
-        course_dict = Course.query.filter_by(id=id).first()
+        course_dict = course_rows.one(id)
 
         if not course_dict:
             abort(404, description='Course cannot be found')
         
-        response = make_response(course_dict.to_dict(), 200)
+        response = make_response(course_dict, 200)
         return response
 
     # Handles the updating of a course     
@@ -75,21 +294,31 @@ class CourseByID(Resource):
 
         data = request.get_json()
 
+        read_only = set(data) & set(Course.read_only_fields)
+        if read_only:
+            abort(400, description=f"Read-only fields: {', '.join(sorted(read_only))}")
+        if not valid_capacity(data.get('capacity')):
+            abort(400, description='capacity must be a non-negative integer or null')
+
         for attr, value in data.items():
             setattr(course, attr, value)
 
         db.session.commit()
-        response = make_response(course.to_dict(), 200)
+        response = make_response(course_rows.one(id), 200)
         return response
 
+    # Updates only the given fields of a course
+    def patch(self, id):
+        data = request.get_json()
+        if isinstance(data, dict) and not valid_capacity(data.get('capacity')):
+            abort(400, description='capacity must be a non-negative integer or null')
+        return patch_row(Course, id, 'Course not found')
+
     # Handles the deletion of a course
     def delete(self, id):
-        course = Course.query.filter_by(id=id).first()
-
-        if not course:
+        if not Course.delete_by_ids([id]):
             abort(404, description='Course not found')
 
-        db.session.delete(course)
         db.session.commit()
 
         response = {"message": "Course deleted successfully"}
@@ -99,13 +328,34 @@ class CourseByID(Resource):
 api.add_resource(CourseByID, '/course/<int:id>')
 
 
+class CourseWaitlist(Resource):
+    # Students waiting for a seat in the course, next in line first
+    @conditional(*WAITLIST_TABLES)
+    @cache.cached(*WAITLIST_TABLES)
+    def get(self, id):
+        if not db.session.get(Course, id):
+            abort(404, description='Course cannot be found')
+
+        entries = waitlist_rows.build(db.session.execute(waitlist_rows.children_of(WaitlistEntry.course_id, [id])).all())
+        for position, entry in enumerate(entries, 1):
+            entry["position"] = position
+        return make_response(entries, 200)
+
+api.add_resource(CourseWaitlist, '/course/<int:id>/waitlist')
+
+
 class Students(Resource):
     # handling the fetching of students from the database
+    @conditional(*STUDENT_TABLES)
+    @cache.cached(*STUDENT_TABLES)
     def get(self):
-        student_list_dict = [s.to_dict() for s in Student.query.all()]
+        if wants_stream():
+            return stream_collection(Student)
+
+        student_list_dict, next_cursor = fetch_collection(Student)
 
         if student_list_dict:
-            response = make_response(student_list_dict, 200)
+            response = collection_response(student_list_dict, next_cursor)
             return response
         
         else:
@@ -123,17 +373,79 @@ class Students(Resource):
         db.session.add(new_student)
         db.session.commit()
 
-        return make_response(new_student.to_dict(), 201)
-    
+        return make_response(student_rows.one(new_student.id), 201)
+
+    # Updates many students at once. Each item holds an id and the fields to
+    # change. Ids are checked with IN queries, and items setting the same
+    # fields are applied as one executemany UPDATE, all in one transaction.
+    # Returns a result for each submitted item.
+    def patch(self):
+        items = bulk_items('students')
+
+        if len(items) > MAX_BULK_ITEMS:
+            abort(413, description=f'At most {MAX_BULK_ITEMS} students per request')
+
+        ids = {item.get('id') for item in items if isinstance(item, dict) and valid_id(item.get('id'))}
+        known_students = set()
+        for chunk in chunked(ids):
+            known_students.update(db.session.scalars(db.select(Student.id).where(Student.id.in_(chunk))))
+
+        fields = set(Student.updatable_fields())
+        results = []
+        groups = {}
+        for index, item in enumerate(items):
+            item = item if isinstance(item, dict) else {}
+            student_id = item.get('id')
+            values = {key: value for key, value in item.items() if key != 'id'}
+            unknown = set(values) - fields
+            invalid = None if unknown else invalid_value(Student, values)
+            result = {"index": index, "id": student_id}
+
+            if not valid_id(student_id) or not values:
+                result.update(status=400, message='id and at least one field to update are required')
+            elif unknown:
+                result.update(status=400, message=f"Unknown fields: {', '.join(sorted(unknown))}")
+            elif invalid:
+                result.update(status=400, message=invalid)
+            elif student_id not in known_students:
+                result.update(status=404, message='Student not found')
+            else:
+                groups.setdefault(tuple(sorted(item)), []).append(item)
+                result.update(status=200)
+
+            results.append(result)
+
+        try:
+            for rows in groups.values():
+                Student.update_many(rows)
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            abort(409, description='Some of these updates conflict with existing data, nothing was updated')
+
+        updated = sum(len(rows) for rows in groups.values())
+        response_body = {
+            "updated": updated,
+            "failed": len(results) - updated,
+            "results": results,
+        }
+        return make_response(response_body, 200)
+
+    # Deletes the students listed in the body, with their profiles and enrollments
+    def delete(self):
+        return bulk_delete(Student, 'students')
+
 api.add_resource(Students, '/student')
 
 class StudentByID(Resource):
     # Fetching a specific student
+    @conditional(*STUDENT_TABLES)
+    @cache.cached(*STUDENT_TABLES)
     def get(self, id):
-        student_dict = Student.query.filter_by(id=id).first()
+        student_dict = student_rows.one(id)
 
         if student_dict:
-            response = make_response(student_dict.to_dict(), 200)
+            response = make_response(student_dict, 200)
             return response
         else:
             error_response = {"message": "Error fetching student"}
@@ -154,15 +466,20 @@ class StudentByID(Resource):
 
         db.session.commit()
 
-        response = make_response(student.to_dict(), 200)
+        response = make_response(student_rows.one(id), 200)
         return response
 
+    def patch(self, id):
+        return patch_row(Student, id, 'Student not found')
+
 
 api.add_resource(StudentByID, '/student/<int:id>')
 
 
 class StudentsCount(Resource):
     # Api to return the total number of students
+    @conditional(*STUDENT_COUNT_TABLES)
+    @cache.cached(*STUDENT_COUNT_TABLES)
     def get(self):
         students_list = Student.query.count()
 
@@ -181,11 +498,16 @@ class StudentsCount(Resource):
 api.add_resource(StudentsCount, '/student_count')
 
 class Instructors(Resource):
+    @conditional(*INSTRUCTOR_TABLES)
+    @cache.cached(*INSTRUCTOR_TABLES)
     def get(self):
-        instructors_list_dict = [i.to_dict() for i in Instructor.query.all()]
+        if wants_stream():
+            return stream_collection(Instructor)
+
+        instructors_list_dict, next_cursor = fetch_collection(Instructor)
 
         if instructors_list_dict:
-            response = make_response(instructors_list_dict, 200)
+            response = collection_response(instructors_list_dict, next_cursor)
             return response
         
         else:
@@ -200,17 +522,24 @@ class Instructors(Resource):
         db.session.add(new_instructor)
         db.session.commit()
 
-        response = make_response(new_instructor.to_dict(), 201)
+        response = make_response(instructor_rows.one(new_instructor.id), 201)
         return response
 
+    # Deletes the instructors listed in the body, with their courses and
+    # the courses' enrollments
+    def delete(self):
+        return bulk_delete(Instructor, 'instructors')
+
 api.add_resource(Instructors, '/instructor')
 
 class InstructorsByID(Resource):
+    @conditional(*INSTRUCTOR_TABLES)
+    @cache.cached(*INSTRUCTOR_TABLES)
     def get(self, id):
-        instructor_dict = Instructor.query.filter_by(id=id).first()
+        instructor_dict = instructor_rows.one(id)
 
         if instructor_dict:
-            response = make_response(instructor_dict.to_dict(), 200)
+            response = make_response(instructor_dict, 200)
             return response
         else:
             error_response = {"message": "Error fetching instructor"}
@@ -219,12 +548,9 @@ class InstructorsByID(Resource):
         
     
     def delete(self, id):
-        instructor = Instructor.query.filter_by(id=id).first()
-
-        if not instructor:
+        if not Instructor.delete_by_ids([id]):
             abort(404, description="Instructor not found")
 
-        db.session.delete(instructor)
         db.session.commit()
 
         response = make_response({"message": "Instructor deleted successfully"}, 200)
@@ -243,9 +569,12 @@ class InstructorsByID(Resource):
         
         db.session.commit()
 
-        response = make_response(instructor.to_dict(), 200)
+        response = make_response(instructor_rows.one(id), 200)
         return response
 
+    def patch(self, id):
+        return patch_row(Instructor, id, 'Could not find instructor')
+
 api.add_resource(InstructorsByID, '/instructor/<int:id>')
 
 class Enrollments(Resource):
@@ -255,63 +584,249 @@ class Enrollments(Resource):
         if not data.get("student_id") or not data.get('course_id'):
             abort(400, description='student_id and course_id are required')
 
-        # Prevent double enrollment
-        existing = Enrollment.query.filter_by(student_id=data['student_id'], course_id=data['course_id']).first()
-        if existing:
+        student_id = data.get('student_id')
+        course_id = data.get('course_id')
+        new_enrollment = {
+            "grade": data.get('grade', 'N/A'),
+            "course_id": course_id,
+            "student_id": student_id,
+            "date_enrolled": datetime.utcnow(),
+        }
+
+        student, course = db.session.execute(db.select(
+            db.select(Student.id).where(Student.id == student_id).scalar_subquery(),
+            db.select(Course.id).where(Course.id == course_id).scalar_subquery(),
+        )).one()
+
+        if student is None or course is None:
+            abort(404, description='Invalid student_id or course_id')
+
+        # The seat is taken with a conditional UPDATE of the course's
+        # seats_taken, so concurrent requests can't overbook it. Double
+        # enrollment is prevented by the unique (student_id, course_id)
+        # constraint, which also rolls the seat back.
+        try:
+            if seats.take_seat(db.session, course_id):
+                enrollment_id = seats.add_enrollment(db.session, new_enrollment)
+                db.session.commit()
+                return make_response(enrollment_rows.one(enrollment_id), 201)
+        except IntegrityError:
+            db.session.rollback()
             abort(409, description="Student is already enrolled in this course")
 
-        grade = data.get('grade', 'N/A')
-        new_enrollment = Enrollment(
-            grade=grade,
-            course_id=data.get('course_id'),
-            student_id=data.get('student_id'),
-            date_enrolled=datetime.utcnow()
+        # The course is full: students not already in it join its waitlist
+        enrolled = db.session.scalar(
+            db.select(Enrollment.id).where(Enrollment.student_id == student_id, Enrollment.course_id == course_id)
         )
+        if enrolled is not None:
+            db.session.rollback()
+            abort(409, description="Student is already enrolled in this course")
 
-        student = Student.query.get(data.get('student_id'))
-        course = Course.query.get(data.get('course_id'))
-
-        if not student or not course:
-            abort(404, description='Invalid student_id or course_id')
-
-        db.session.add(new_enrollment)
-        db.session.commit()
-
-        response = make_response(new_enrollment.to_dict(), 201)
-        return response
+        try:
+            position = seats.join_waitlist(db.session, student_id, course_id)
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            abort(409, description="Student is already on the waitlist for this course")
+
+        response_body = {
+            "status": "waitlisted",
+            "student_id": student_id,
+            "course_id": course_id,
+            "position": position,
+        }
+        return make_response(response_body, 202)
     
+    @conditional(*ENROLLMENT_TABLES)
+    @cache.cached(*ENROLLMENT_TABLES)
     def get(self):
-        all_enrollments = [e.to_dict() for e in Enrollment.query.all()]
+        if wants_stream():
+            return stream_collection(Enrollment)
+
+        all_enrollments, next_cursor = fetch_collection(Enrollment)
 
         if not all_enrollments:
             abort(404, description="Could not fetch enrollments from the database")
         
-        return make_response(all_enrollments, 200)
+        return collection_response(all_enrollments, next_cursor)
+
+    # Deletes the enrollments listed in the body
+    def delete(self):
+        return bulk_delete(Enrollment, 'enrollments')
 
 api.add_resource(Enrollments, '/enrollment')
 
 
+# Reads a list of objects from a JSON array or an NDJSON request body
+def bulk_items(noun='enrollments'):
+    if request.mimetype == NDJSON_MIMETYPE:
+        try:
+            return [json.loads(line) for line in request.get_data(as_text=True).splitlines() if line.strip()]
+        except ValueError:
+            abort(400, description='Request body is not valid NDJSON')
+
+    data = request.get_json()
+    if not isinstance(data, list):
+        abort(400, description=f'Expected a JSON array of {noun}')
+    return data
+
+
+# Deletes the rows whose ids are listed in the request body, with one
+# DELETE per chunk of ids; the database cascades to child rows. Reports
+# how many were deleted and which ids did not exist.
+def bulk_delete(model, noun):
+    expected = f'{model.__name__.lower()} ids'
+    ids = bulk_items(expected)
+
+    if len(ids) > MAX_BULK_ITEMS:
+        abort(413, description=f'At most {MAX_BULK_ITEMS} {noun} per request')
+    if not all(isinstance(id, int) and not isinstance(id, bool) for id in ids):
+        abort(400, description=f'Expected a JSON array of {expected}')
+
+    ids = list(dict.fromkeys(ids))
+    deleted = set(model.delete_by_ids(ids))
+    if deleted:
+        db.session.commit()
+    else:
+        db.session.rollback()
+
+    response_body = {
+        "deleted": len(deleted),
+        "not_found": [id for id in ids if id not in deleted],
+    }
+    return make_response(response_body, 200)
+
+
+class EnrollmentsBulk(Resource):
+    # Enrolls many students at once. Ids and existing pairs are validated
+    # with a handful of IN queries and every valid row is inserted in one
+    # transaction. Each course admits items in order while it has seats;
+    # the rest join its waitlist. Returns a result for each submitted item.
+    def post(self):
+        items = bulk_items()
+
+        if len(items) > MAX_BULK_ITEMS:
+            abort(413, description=f'At most {MAX_BULK_ITEMS} enrollments per request')
+
+        student_ids = set()
+        course_ids = set()
+        for item in items:
+            if isinstance(item, dict) and valid_id(item.get('student_id')) and valid_id(item.get('course_id')):
+                student_ids.add(item['student_id'])
+                course_ids.add(item['course_id'])
+
+        known_students = set()
+        for ids in chunked(student_ids):
+            known_students.update(db.session.scalars(db.select(Student.id).where(Student.id.in_(ids))))
+
+        known_courses = set()
+        for ids in chunked(course_ids):
+            known_courses.update(db.session.scalars(db.select(Course.id).where(Course.id.in_(ids))))
+
+        taken = set()
+        for ids in chunked(known_students):
+            taken.update(
+                db.session.execute(
+                    db.select(Enrollment.student_id, Enrollment.course_id).where(Enrollment.student_id.in_(ids))
+                ).tuples()
+            )
+
+        date_enrolled = datetime.utcnow()
+        results = []
+        requested = {}
+        for index, item in enumerate(items):
+            item = item if isinstance(item, dict) else {}
+            student_id = item.get('student_id')
+            course_id = item.get('course_id')
+            result = {"index": index, "student_id": student_id, "course_id": course_id}
+
+            if not student_id or not course_id:
+                result.update(status=400, message='student_id and course_id are required')
+            elif not valid_id(student_id) or not valid_id(course_id):
+                result.update(status=400, message='student_id and course_id must be integers')
+            elif student_id not in known_students or course_id not in known_courses:
+                result.update(status=404, message='Invalid student_id or course_id')
+            elif (student_id, course_id) in taken:
+                result.update(status=409, message='Student is already enrolled in this course')
+            else:
+                taken.add((student_id, course_id))
+                requested.setdefault(course_id, []).append((result, {
+                    "student_id": student_id,
+                    "course_id": course_id,
+                    "grade": item.get('grade', 'N/A'),
+                    "date_enrolled": date_enrolled,
+                }))
+
+            results.append(result)
+
+        try:
+            granted = seats.take_seats(db.session, {course_id: len(rows) for course_id, rows in requested.items()})
+            new_rows = []
+            full = []
+            for course_id, rows in requested.items():
+                for result, row in rows[:granted[course_id]]:
+                    result.update(status=201)
+                    new_rows.append(row)
+                full.extend(rows[granted[course_id]:])
+
+            waiting = set()
+            for ids in chunked({row["student_id"] for _, row in full}):
+                waiting.update(
+                    db.session.execute(
+                        db.select(WaitlistEntry.student_id, WaitlistEntry.course_id).where(WaitlistEntry.student_id.in_(ids))
+                    ).tuples()
+                )
+
+            waitlisted = []
+            for result, row in full:
+                if (row["student_id"], row["course_id"]) in waiting:
+                    result.update(status=409, message='Student is already on the waitlist for this course')
+                else:
+                    result.update(status=202, message='Course is full, added to the waitlist')
+                    waitlisted.append({"student_id": row["student_id"], "course_id": row["course_id"], "date_added": date_enrolled})
+
+            seats.add_enrollments(db.session, new_rows)
+            if waitlisted:
+                db.session.execute(insert(WaitlistEntry.__table__), waitlisted)
+            db.session.commit()
+        except IntegrityError:
+            # Another request enrolled one of these pairs after the checks above
+            db.session.rollback()
+            abort(409, description='Some of these enrollments were created concurrently, retry the batch')
+
+        response_body = {
+            "created": len(new_rows),
+            "waitlisted": len(waitlisted),
+            "failed": len(results) - len(new_rows) - len(waitlisted),
+            "results": results,
+        }
+        return make_response(response_body, 200)
+
+api.add_resource(EnrollmentsBulk, '/enrollment/bulk')
+
+
 class EnrollmentByID(Resource):
+    @conditional(*ENROLLMENT_TABLES)
+    @cache.cached(*ENROLLMENT_TABLES)
     def get(self, id):
-        enrollment = Enrollment.query.filter_by(id=id).first()
+        enrollment = enrollment_rows.one(id)
 
         if not enrollment:
             error_response = {"message": "Could not find enrollment"}
             response = make_response(error_response, 404)
             return response
         
-        response = make_response(enrollment.to_dict(), 200)
+        response = make_response(enrollment, 200)
         return response
 
+    # The freed seat goes to the course's oldest waitlist entry when the
+    # transaction commits (see seats.py)
     def delete(self, id):
-        enrollment = Enrollment.query.filter_by(id=id).first()
-        
-        if not enrollment:
+        if not Enrollment.delete_by_ids([id]):
             error_response = {"message": "Could not find enrollment"}
             response = make_response(error_response, 404)
             return response
 
-        db.session.delete(enrollment)
         db.session.commit()
 
         response = {"message": "Deleted successfully"}
@@ -319,14 +834,69 @@ class EnrollmentByID(Resource):
 
 api.add_resource(EnrollmentByID, '/enrollment/<int:id>')
 
+
+class EnrollmentGrades(Resource):
+    # Queues grade updates for the write-behind worker in grades.py and
+    # answers 202 before they are written. Takes a JSON array, or NDJSON,
+    # of {"id": enrollment id, "grade": "A"}; the last item for an
+    # enrollment wins. Unknown ids are reported back rather than queued.
+    def post(self):
+        items = bulk_items('grade updates')
+
+        limit = min(MAX_BULK_ITEMS, grade_queue.max_size)
+        if len(items) > limit:
+            abort(413, description=f'At most {limit} grade updates per request')
+
+        grades = {}
+        for item in items:
+            if (
+                not isinstance(item, dict)
+                or not isinstance(item.get('id'), int) or isinstance(item.get('id'), bool)
+                or not isinstance(item.get('grade'), str)
+            ):
+                abort(400, description='Expected grade updates like {"id": 1, "grade": "A"}')
+            grades[item['id']] = item['grade']
+
+        known = set()
+        for ids in chunked(grades):
+            known.update(db.session.scalars(db.select(Enrollment.id).where(Enrollment.id.in_(ids))))
+        # Don't hold a transaction open while waiting for room in the queue
+        db.session.rollback()
+
+        queued = {id: grade for id, grade in grades.items() if id in known}
+        try:
+            grade_queue.put(queued)
+        except QueueFull as error:
+            response = make_response({"message": f"Grade queue is full: {error}"}, 503)
+            response.headers['Retry-After'] = '1'
+            return response
+
+        response_body = {
+            "queued": len(queued),
+            "not_found": [id for id in grades if id not in known],
+        }
+        return make_response(response_body, 202)
+
+api.add_resource(EnrollmentGrades, '/enrollment/grades')
+
+
+class GradeQueueStats(Resource):
+    # Depth of the grade queue, its counters and recent flush latencies
+    def get(self):
+        return make_response(grade_queue.stats(), 200)
+
+api.add_resource(GradeQueueStats, '/enrollment/grades/queue')
+
 class ProfileByID(Resource):
+    @conditional(*PROFILE_TABLES)
+    @cache.cached(*PROFILE_TABLES)
     def get(self, id):
-        profile = Profile.query.filter_by(id=id).first()
+        profile = profile_rows.one(id)
 
         if not profile:
             abort(404, description='Could not find profile')
     
-        response = make_response(profile.to_dict(), 200)
+        response = make_response(profile, 200)
         return response
     
     def put(self, id):
@@ -342,11 +912,183 @@ class ProfileByID(Resource):
         
         db.session.commit()
 
-        response = make_response(profile.to_dict(), 200)
+        response = make_response(profile_rows.one(id), 200)
         return response
 
+    def patch(self, id):
+        return patch_row(Profile, id, 'Profile not found')
+
 api.add_resource(ProfileByID, '/profile/<int:id>')
 
 
+class CourseReports(Resource):
+    # Enrollments and grade distribution per course, read from the
+    # course_reports summary table
+    @conditional(*COURSE_REPORT_TABLES)
+    @cache.cached(*COURSE_REPORT_TABLES)
+    def get(self):
+        if wants_stream():
+            return stream_collection(CourseReport)
+
+        reports, next_cursor = fetch_collection(CourseReport)
+
+        if reports:
+            return collection_response(reports, next_cursor)
+        else:
+            abort(404, description="Could not fetch the course reports")
+
+api.add_resource(CourseReports, '/reports/courses')
+
+
+class InstructorReports(Resource):
+    # Courses, enrollments, students and grade distribution per instructor,
+    # read from the instructor_reports summary table
+    @conditional(*INSTRUCTOR_REPORT_TABLES)
+    @cache.cached(*INSTRUCTOR_REPORT_TABLES)
+    def get(self):
+        if wants_stream():
+            return stream_collection(InstructorReport)
+
+        reports, next_cursor = fetch_collection(InstructorReport)
+
+        if reports:
+            return collection_response(reports, next_cursor)
+        else:
+            abort(404, description="Could not fetch the instructor reports")
+
+api.add_resource(InstructorReports, '/reports/instructors')
+
+
+class Search(Resource):
+    # Students by name or email, courses by title and instructors by name,
+    # best matches first. ?q= is one or more words, each matched as a
+    # prefix; ?type= limits the kinds (comma separated). Pages with
+    # ?limit=&after=, where the X-Next-Cursor is a position in the ranking.
+    @conditional(*SEARCH_TABLES)
+    @cache.cached(*SEARCH_TABLES)
+    def get(self):
+        q = request.args.get('q', '')
+        if not q.strip():
+            abort(400, description="Missing search query q")
+
+        kinds = [kind.strip() for kind in request.args.get('type', '').split(',') if kind.strip()] or list(SEARCH_KINDS)
+        unknown = set(kinds) - set(SEARCH_KINDS)
+        if unknown:
+            abort(400, description=f"Unknown types: {', '.join(sorted(unknown))}")
+
+        limit = max(1, min(int_arg('limit', DEFAULT_PAGE_SIZE), MAX_PAGE_SIZE))
+        after = max(0, int_arg('after', 0))
+        items, next_cursor = search(db.session.connection(), q, kinds, limit, after)
+        count_rows(len(items))
+        return collection_response(items, next_cursor)
+
+api.add_resource(Search, '/search')
+
+
+class Changes(Resource):
+    # Entries of the change log after ?since=<seq>, oldest first, at most
+    # ?limit= of them. With ?wait=<seconds> and nothing new yet, waits up to
+    # that long (at most CHANGES_MAX_WAIT) for the next commit. X-Next-Cursor
+    # is the since of the next call. 410 when entries after since have
+    # expired, and the tables have to be downloaded again.
+    def get(self):
+        since = int_arg('since')
+        if since is None or since < 0:
+            abort(400, description="since must be a change seq, or 0 for the start of the log")
+
+        limit = max(1, min(int_arg('limit', CHANGES_PAGE_SIZE), MAX_CHANGES_PAGE_SIZE))
+        wait = max(0.0, min(float_arg('wait', 0), current_app.config.get('CHANGES_MAX_WAIT', 25)))
+        try:
+            entries = feed.wait(db.session, since, limit, wait)
+        except LogTruncated as error:
+            abort(410, description=str(error))
+
+        count_rows(len(entries))
+        response = make_response(entries, 200)
+        response.headers['X-Next-Cursor'] = str(entries[-1]["seq"] if entries else since)
+        return response
+
+api.add_resource(Changes, '/changes')
+
+
+class CacheStats(Resource):
+    # Hit/miss counters of the response cache
+    def get(self):
+        return make_response(cache.stats(), 200)
+
+api.add_resource(CacheStats, '/cache/stats')
+
+
+class Metrics(Resource):
+    # Per-endpoint latency, SQL and serialization histograms
+    def get(self):
+        return metrics.render()
+
+api.add_resource(Metrics, '/metrics')
+
+
+# Registers the flask commands. Flask-Migrate (with Alembic and Mako) and
+# the seeder (with Faker) are imported here, so serving workers never load
+# them.
+def init_cli(app):
+    from flask_migrate import Migrate
+    from seed import seed_command
+
+    Migrate(app, db)
+    app.cli.add_command(seed_command)
+    app.cli.add_command(reports_cli)
+    app.cli.add_command(schedules_cli)
+    app.cli.add_command(search_cli)
+    app.cli.add_command(seats_cli)
+    app.cli.add_command(replicas_cli)
+    app.cli.add_command(changes_cli)
+
+
+# Builds the application. config is a config class or profile name;
+# by default the profile comes from the APP_ENV environment variable.
+# The commands are registered when the flask command loads the app, or
+# with cli=True, e.g. for app.test_cli_runner().
+def create_app(config=None, cli=None):
+    if config is None or isinstance(config, str):
+        config = get_config(config)
+
+    app = Flask(__name__)
+    app.config.from_object(config)
+    app.json = FastJSONProvider(app)
+    # CORS(app)
+    CORS(app, resources={r"/*": {"origins": "*"}}, supports_credentials=True)
+
+    # Adds the replica binds, so it goes before db.init_app
+    replicas.init_app(app)
+    db.init_app(app)
+    # Once per process rather than on the first query of every worker;
+    # with gunicorn's preload_app, once in the master before it forks
+    configure_mappers()
+    cache.init_app(app)
+    grade_queue.init_app(app)
+    api.init_app(app)
+    # The flask command loads the app inside its click context
+    if cli is None:
+        cli = click.get_current_context(silent=True) is not None
+    if cli:
+        init_cli(app)
+
+    with app.app_context():
+        if db.engine.dialect.name == 'sqlite':
+            enable_sqlite_pragmas(db.engine, app.config.get('SQLITE_PRAGMAS', {}))
+        metrics.init_app(app, db.engine, *replicas.engines(app.config.get('SQLITE_PRAGMAS', {})))
+
+    # Registered after metrics so its after_request runs first and the
+    # compression time shows in the serialize timing
+    compression.init_app(app)
+
+    return app
+
+
+metrics.add_source(cache.metric_lines)
+metrics.add_source(grade_queue.metric_lines)
+metrics.add_source(replicas.metric_lines)
+
+
 if __name__ == '__main__':
-    app.run(port=5555, debug=True)
\ No newline at end of file
+    create_app().run(port=5555, debug=True)
@@ -0,0 +1,12 @@
+# ASGI entry point: the async read endpoints under /async, and every other
+# route served by the Flask app from a thread pool of WEB_THREADS threads.
+#     uvicorn asgi:app --host 0.0.0.0 --port 8000
+import os
+
+from a2wsgi import WSGIMiddleware
+
+from app import create_app
+from async_api import AsyncAPI
+
+flask_app = create_app()
+app = AsyncAPI(flask_app, fallback=WSGIMiddleware(flask_app, workers=int(os.environ.get('WEB_THREADS', 8))))
@@ -0,0 +1,176 @@
+import re
+from urllib.parse import parse_qs
+
+from sqlalchemy import select, func
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+
+from app import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from models import db, enable_sqlite_pragmas, Student
+from serializers import course_rows, student_rows, enrollment_rows, dumps_bytes
+
+# asyncio drivers used in place of the synchronous ones
+ASYNC_DRIVERS = {
+    'sqlite': 'sqlite+aiosqlite',
+    'sqlite+pysqlite': 'sqlite+aiosqlite',
+    'postgresql': 'postgresql+asyncpg',
+    'postgresql+psycopg2': 'postgresql+asyncpg',
+}
+
+
+class NotFound(Exception):
+    status = 404
+
+    def __init__(self, message):
+        self.message = message
+
+
+class BadRequest(Exception):
+    status = 400
+
+    def __init__(self, message):
+        self.message = message
+
+
+def async_database_url(url):
+    url = make_url(url)
+    if url.drivername in ASYNC_DRIVERS:
+        url = url.set(drivername=ASYNC_DRIVERS[url.drivername])
+    return url
+
+
+# Same ?limit=&after= rules as the synchronous collection endpoints
+def page_args(query):
+    def int_arg(name):
+        if name not in query:
+            return None
+        try:
+            return int(query[name][0])
+        except ValueError:
+            raise BadRequest(f"{name} must be an integer")
+
+    after = int_arg('after')
+    limit = int_arg('limit')
+    if limit is None and after is not None:
+        limit = DEFAULT_PAGE_SIZE
+    if limit is not None:
+        limit = max(1, min(limit, MAX_PAGE_SIZE))
+    return after, limit
+
+
+class AsyncAPI:
+    # ASGI application serving the read endpoints Courses, CourseByID,
+    # Students, StudentByID, Enrollments and StudentsCount under prefix,
+    # using SQLAlchemy's asyncio engine so a request waiting on the database
+    # does not hold a thread. It shares the models and row serializers with
+    # the Flask app and reads the same database. Requests outside the
+    # prefix go to fallback, typically the Flask app wrapped in WsgiToAsgi.
+    def __init__(self, flask_app, fallback=None, prefix='/async'):
+        with flask_app.app_context():
+            url = flask_app.config.get('ASYNC_DATABASE_URL') or async_database_url(db.engine.url)
+
+        self.engine = create_async_engine(url, **flask_app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {}))
+        if self.engine.dialect.name == 'sqlite':
+            enable_sqlite_pragmas(self.engine.sync_engine, flask_app.config.get('SQLITE_PRAGMAS', {}))
+        self.sessions = async_sessionmaker(self.engine, expire_on_commit=False)
+
+        self.fallback = fallback
+        self.prefix = prefix
+        self.routes = [
+            (re.compile(r'/course'), self.courses),
+            (re.compile(r'/course/(?P<id>\d+)'), self.course_by_id),
+            (re.compile(r'/student'), self.students),
+            (re.compile(r'/student/(?P<id>\d+)'), self.student_by_id),
+            (re.compile(r'/student_count'), self.students_count),
+            (re.compile(r'/enrollment'), self.enrollments),
+        ]
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self.lifespan(receive, send)
+
+        path = scope.get('path', '')
+        if scope['type'] != 'http' or not path.startswith(self.prefix + '/'):
+            if self.fallback is None:
+                return await self.respond(scope, send, 404, {"message": "Not found"})
+            return await self.fallback(scope, receive, send)
+
+        path = path[len(self.prefix):]
+        for pattern, handler in self.routes:
+            match = pattern.fullmatch(path)
+            if match:
+                break
+        else:
+            return await self.respond(scope, send, 404, {"message": "Not found"})
+
+        if scope['method'] not in ('GET', 'HEAD'):
+            return await self.respond(scope, send, 405, {"message": "The method is not allowed for the requested URL."})
+
+        query = parse_qs(scope.get('query_string', b'').decode())
+        try:
+            async with self.sessions() as session:
+                body, headers = await handler(session, query, **{k: int(v) for k, v in match.groupdict().items()})
+        except (NotFound, BadRequest) as error:
+            return await self.respond(scope, send, error.status, {"message": error.message})
+
+        await self.respond(scope, send, 200, body, headers)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.engine.dispose()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    # Responses to HEAD keep the headers of the GET, Content-Length
+    # included, without the body, as Flask sends them
+    async def respond(self, scope, send, status, payload, headers=()):
+        body = dumps_bytes(payload)
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [
+                (b'content-type', b'application/json'),
+                (b'content-length', str(len(body)).encode()),
+                *headers,
+            ],
+        })
+        await send({'type': 'http.response.body', 'body': b'' if scope.get('method') == 'HEAD' else body})
+
+    async def collection(self, serializer, session, query, message):
+        items, next_cursor = await serializer.page_async(session, *page_args(query))
+        if not items:
+            raise NotFound(message)
+
+        headers = [(b'x-next-cursor', str(next_cursor).encode())] if next_cursor is not None else []
+        return items, headers
+
+    async def item(self, serializer, session, id, message):
+        item = await serializer.one_async(session, id)
+        if item is None:
+            raise NotFound(message)
+        return item, []
+
+    async def courses(self, session, query):
+        return await self.collection(course_rows, session, query, "Could not fetch the courses")
+
+    async def course_by_id(self, session, query, id):
+        return await self.item(course_rows, session, id, "Course cannot be found")
+
+    async def students(self, session, query):
+        return await self.collection(student_rows, session, query, "Error fetching students")
+
+    async def student_by_id(self, session, query, id):
+        return await self.item(student_rows, session, id, "Error fetching student")
+
+    async def enrollments(self, session, query):
+        return await self.collection(enrollment_rows, session, query, "Could not fetch enrollments from the database")
+
+    async def students_count(self, session, query):
+        count = await session.scalar(select(func.count(Student.id)))
+        if not count:
+            raise NotFound("Error fetching item")
+        return {"count": count}, []
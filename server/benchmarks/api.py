@@ -0,0 +1,352 @@
+# Benchmarks every GET route registered with api.add_resource, and the
+# POST, PATCH and DELETE routes that write single rows, at several data
+# scales, through the Flask test client and through a multi-threaded
+# HTTP load generator against a local server. Results (p50/p95/p99
+# latency, throughput and SQL statements per request) are written as JSON
+# so runs from different commits can be compared with --compare.
+#
+# Run from the server directory:
+#     python -m benchmarks.api --scales 1000,10000 --output bench.json
+#     python -m benchmarks.api --scales 1000 --compare bench.json
+import argparse
+import http.client
+import itertools
+import json
+import logging
+import os
+import platform
+import random
+import subprocess
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import event
+from urllib.parse import urlsplit
+from werkzeug.serving import make_server
+
+from app import create_app, cache
+from config import ProductionConfig
+from grades import grade_queue
+from models import db, Course, Student
+from seed import seed, GRADES
+
+DATABASE_PATH = os.path.join(tempfile.gettempdir(), 'course-enrollment-bench.db')
+
+# Makes the emails of students the benchmark creates unique
+serial = itertools.count(1)
+
+
+# Production profile pointed at a scratch database, so benchmarks never
+# touch the configured one
+class BenchmarkConfig(ProductionConfig):
+    SQLALCHEMY_DATABASE_URI = f'sqlite:///{DATABASE_PATH}'
+
+
+class StatementCounter:
+    # Counts SQL statements sent to the engine
+    def __init__(self, engine):
+        self.count = 0
+        self.lock = threading.Lock()
+        event.listen(engine, 'before_cursor_execute', self._increment)
+
+    def _increment(self, *args):
+        with self.lock:
+            self.count += 1
+
+
+def percentile(sorted_values, fraction):
+    index = min(len(sorted_values) - 1, max(0, round(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def summarize(latencies, elapsed, statements, errors):
+    latencies = sorted(latencies)
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+        "throughput_rps": round(len(latencies) / elapsed, 1) if elapsed else None,
+        "sql_per_request": round(statements / len(latencies), 2),
+    }
+
+
+# Requests are (method, url, JSON body) tuples. Responses other than 2xx
+# count as errors.
+def send_test_client(client, request):
+    method, url, body = request
+    response = client.open(url, method=method, json=body)
+    response.get_data()
+    return response.status_code
+
+
+def send_http(connection, request):
+    method, url, body = request
+    if body is None:
+        connection.request(method, url)
+    else:
+        connection.request(method, url, json.dumps(body), {'Content-Type': 'application/json'})
+    response = connection.getresponse()
+    response.read()
+    return response
+
+
+# Ids of existing rows for routes taking <int:id>
+def seeded_ids(counts):
+    return {
+        'course': counts['courses'],
+        'student': counts['students'],
+        'instructor': counts['instructors'],
+        'enrollment': counts['enrollments'],
+        'profile': counts['profiles'],
+    }
+
+
+# One or more GET requests per GET route, filling <int:id> with random
+# existing ids and giving /search and /changes the arguments they require
+def get_requests(flask_app, counts, rng, samples):
+    ids = seeded_ids(counts)
+    names = db.session.scalars(db.select(Student.name).where(Student.id.in_(rng.randint(1, ids['student']) for _ in range(samples))))
+    titles = db.session.scalars(db.select(Course.title).where(Course.id.in_(rng.randint(1, ids['course']) for _ in range(samples))))
+    query_strings = {
+        '/search': [f'q={text.split()[0]}' for text in [*names, *titles]],
+        '/changes': ['since=0'],
+    }
+
+    routes = {}
+    for rule in flask_app.url_map.iter_rules():
+        if rule.endpoint == 'static' or 'GET' not in rule.methods:
+            continue
+
+        if 'id' in rule.arguments:
+            table = rule.rule.strip('/').split('/')[0]
+            urls = [rule.rule.replace('<int:id>', str(rng.randint(1, ids[table]))) for _ in range(samples)]
+        elif rule.rule in query_strings:
+            urls = [f'{rule.rule}?{query}' for query in query_strings[rule.rule]]
+        else:
+            urls = [rule.rule]
+        routes[rule.rule] = [('GET', url, None) for url in urls]
+    return routes
+
+
+# Creates rows through the API and returns their ids
+def create_rows(client, url, bodies):
+    ids = []
+    for body in bodies:
+        response = client.post(url, json=body)
+        assert response.status_code == 201, (url, response.status_code, response.get_json())
+        ids.append(response.get_json()["id"])
+    return ids
+
+
+# Enrollment bodies for count distinct (student, course) pairs, on new
+# courses without a capacity, so none is refused or waitlisted
+def new_enrollments(client, counts, count):
+    students = counts['students']
+    courses = create_rows(client, '/course', [{"title": f"Benchmark course {n}", "instructor_id": 1}
+                                              for n in range(-(-count // students))])
+    return [{"student_id": n % students + 1, "course_id": courses[n // students]} for n in range(count)]
+
+
+# count requests per write route. Updates go to random seeded rows; deletes
+# remove rows created for them here, so they never reach the seeded data
+# the other routes read. Built again for every run, as the deletes use up
+# their rows.
+def write_requests(flask_app, counts, rng, count):
+    client = flask_app.test_client()
+    ids = seeded_ids(counts)
+
+    def pick(table):
+        return rng.randint(1, ids[table])
+
+    deleted_instructors = create_rows(client, '/instructor', [{"name": f"Benchmark instructor {n}"} for n in range(count)])
+    deleted_courses = create_rows(client, '/course', [{"title": f"Benchmark course {n}", "instructor_id": 1} for n in range(count)])
+    deleted_enrollments = create_rows(client, '/enrollment', new_enrollments(client, counts, count))
+
+    return {
+        'POST /student': [('POST', '/student', {"name": f"Benchmark student {n}", "email": f"bench{next(serial)}@example.com"})
+                          for n in range(count)],
+        'PATCH /student/<int:id>': [('PATCH', f'/student/{pick("student")}', {"name": f"Renamed student {n}"}) for n in range(count)],
+        'PATCH /profile/<int:id>': [('PATCH', f'/profile/{pick("profile")}', {"age": rng.randint(18, 60)}) for _ in range(count)],
+        'POST /instructor': [('POST', '/instructor', {"name": f"Benchmark instructor {n}"}) for n in range(count)],
+        'PATCH /instructor/<int:id>': [('PATCH', f'/instructor/{pick("instructor")}', {"name": f"Renamed instructor {n}"})
+                                       for n in range(count)],
+        'DELETE /instructor/<int:id>': [('DELETE', f'/instructor/{id}', None) for id in deleted_instructors],
+        'POST /course': [('POST', '/course', {"title": f"Benchmark course {n}", "instructor_id": pick('instructor')})
+                         for n in range(count)],
+        'PATCH /course/<int:id>': [('PATCH', f'/course/{pick("course")}', {"title": f"Renamed course {n}"}) for n in range(count)],
+        'DELETE /course/<int:id>': [('DELETE', f'/course/{id}', None) for id in deleted_courses],
+        'POST /enrollment': [('POST', '/enrollment', body) for body in new_enrollments(client, counts, count)],
+        'DELETE /enrollment/<int:id>': [('DELETE', f'/enrollment/{id}', None) for id in deleted_enrollments],
+        'POST /enrollment/grades': [('POST', '/enrollment/grades', [{"id": pick('enrollment'), "grade": rng.choice(GRADES)}])
+                                    for _ in range(count)],
+    }
+
+
+def run_test_client(flask_app, counter, calls, requests):
+    client = flask_app.test_client()
+    latencies = []
+    errors = 0
+    statements_before = counter.count
+
+    started = time.perf_counter()
+    for n in range(requests):
+        start = time.perf_counter()
+        status = send_test_client(client, calls[n % len(calls)])
+        latencies.append(time.perf_counter() - start)
+        errors += not 200 <= status < 300
+    elapsed = time.perf_counter() - started
+
+    # Grade updates are written behind the response; count their statements
+    grade_queue.join()
+    return summarize(latencies, elapsed, counter.count - statements_before, errors)
+
+
+def run_http(host, port, counter, calls, requests, threads):
+    latencies = []
+    errors = 0
+    lock = threading.Lock()
+    statements_before = counter.count
+
+    def worker(indices):
+        nonlocal errors
+        connection = http.client.HTTPConnection(host, port, timeout=60)
+        local_latencies = []
+        local_errors = 0
+        for n in indices:
+            start = time.perf_counter()
+            response = send_http(connection, calls[n % len(calls)])
+            local_latencies.append(time.perf_counter() - start)
+            local_errors += not 200 <= response.status < 300
+            if response.will_close:
+                connection.close()
+                connection = http.client.HTTPConnection(host, port, timeout=60)
+        connection.close()
+        with lock:
+            latencies.extend(local_latencies)
+            errors += local_errors
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        list(pool.map(worker, [range(t, requests, threads) for t in range(threads)]))
+    elapsed = time.perf_counter() - started
+
+    grade_queue.join()
+    return summarize(latencies, elapsed, counter.count - statements_before, errors)
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(current, baseline_path):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+
+    print(f"\ncompared with {baseline.get('commit')} ({baseline_path}), p95 latency")
+    for scale, modes in current["scales"].items():
+        for mode, routes in modes.items():
+            for route, result in routes.items():
+                before = baseline["scales"].get(scale, {}).get(mode, {}).get(route)
+                if not before:
+                    continue
+                change = (result["p95_ms"] - before["p95_ms"]) / before["p95_ms"] * 100 if before["p95_ms"] else 0
+                print(f"  {scale:>7} {mode:<11} {route:<28} {before['p95_ms']:9.2f} -> {result['p95_ms']:9.2f} ms  {change:+6.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='API benchmark and load test')
+    parser.add_argument('--scales', default='1000,10000,100000', help='comma separated student counts')
+    parser.add_argument('--requests', type=int, default=200, help='requests per route and mode')
+    parser.add_argument('--threads', type=int, default=8, help='concurrent HTTP clients')
+    parser.add_argument('--routes', help='only run routes containing this text')
+    parser.add_argument('--with-cache', action='store_true', help='keep the response cache enabled')
+    parser.add_argument('--skip-http', action='store_true')
+    parser.add_argument('--skip-writes', action='store_true', help='only run the GET routes')
+    parser.add_argument('--target', help='run the HTTP load against this server (e.g. http://127.0.0.1:8000) '
+                                          'instead of a local threaded one; it must use DATABASE_URL=sqlite:///' + DATABASE_PATH)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help='write results to this JSON file')
+    parser.add_argument('--compare', help='print the p95 change against an earlier results file')
+    args = parser.parse_args()
+
+    flask_app = create_app(BenchmarkConfig)
+    if not args.with_cache:
+        cache.backend.max_entries = 0
+
+    results = {
+        "commit": git_commit(),
+        "timestamp": time.strftime('%Y-%m-%dT%H:%M:%S'),
+        "python": platform.python_version(),
+        "requests_per_route": args.requests,
+        "threads": args.threads,
+        "cache": args.with_cache,
+        "scales": {},
+    }
+
+    with flask_app.app_context():
+        counter = StatementCounter(db.engine)
+
+        for scale in [int(s) for s in args.scales.split(',')]:
+            started = time.perf_counter()
+            counts = seed(scale, args.seed, reset=True)
+            db.session.remove()
+            print(f"seeded {scale} students in {time.perf_counter() - started:.1f}s: {counts}")
+
+            rng = random.Random(args.seed)
+            routes = get_requests(flask_app, counts, rng, samples=50)
+
+            def selected(routes):
+                return {name: calls for name, calls in routes.items() if not args.routes or args.routes in name}
+
+            def run_writes():
+                return {} if args.skip_writes else selected(write_requests(flask_app, counts, rng, args.requests))
+
+            scale_results = results["scales"][str(scale)] = {"test_client": {}, "http": {}}
+            for name, calls in {**selected(routes), **run_writes()}.items():
+                result = run_test_client(flask_app, counter, calls, args.requests)
+                scale_results["test_client"][name] = result
+                print(f"  test client {name:<28} p50 {result['p50_ms']:8.2f} ms  p95 {result['p95_ms']:8.2f} ms  "
+                      f"p99 {result['p99_ms']:8.2f} ms  {result['throughput_rps']:8.1f} req/s  {result['sql_per_request']} sql/req  "
+                      f"{result['errors']} errors")
+
+            if args.skip_http:
+                continue
+
+            if args.target:
+                target = urlsplit(args.target)
+                host, port, server = target.hostname, target.port or 80, None
+            else:
+                logging.getLogger('werkzeug').setLevel(logging.ERROR)
+                server = make_server('127.0.0.1', 0, flask_app, threaded=True)
+                threading.Thread(target=server.serve_forever, daemon=True).start()
+                host, port = '127.0.0.1', server.server_port
+
+            try:
+                for name, calls in {**selected(routes), **run_writes()}.items():
+                    result = run_http(host, port, counter, calls, args.requests, args.threads)
+                    scale_results["http"][name] = result
+                    print(f"  http        {name:<28} p50 {result['p50_ms']:8.2f} ms  p95 {result['p95_ms']:8.2f} ms  "
+                          f"p99 {result['p99_ms']:8.2f} ms  {result['throughput_rps']:8.1f} req/s  {result['sql_per_request']} sql/req  "
+                          f"{result['errors']} errors")
+            finally:
+                if server is not None:
+                    server.shutdown()
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"results written to {args.output}")
+
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+# Incremental sync benchmark: what a downstream consumer pays to catch up
+# after a burst of writes, by downloading GET /student, /course and
+# /enrollment in full against reading GET /changes since its last seq. The
+# writes are grade and name updates concentrated on a few rows, as at term
+# end, so the log is also measured before and after `flask changes compact`
+# folds each row's entries into one.
+#
+# Run from the server directory:
+#     python -m benchmarks.changes --scales 1000,10000,100000 --writes 1000
+import argparse
+import random
+import time
+
+from sqlalchemy import select, func
+
+from app import create_app, cache
+from benchmarks.api import BenchmarkConfig
+from changes import compact, changes as change_log
+from grades import grade_queue
+from models import db, Student, Enrollment
+from seed import seed
+
+FULL_DOWNLOAD = ('/student?stream=1', '/course?stream=1', '/enrollment?stream=1')
+
+
+def full_download(client):
+    started = time.perf_counter()
+    size = 0
+    for url in FULL_DOWNLOAD:
+        response = client.get(url)
+        assert response.status_code == 200, url
+        size += len(response.get_data())
+    return time.perf_counter() - started, size
+
+
+# Reads the log from since to its end, page by page as a consumer would
+def incremental(client, since):
+    started = time.perf_counter()
+    size = entries = 0
+    while True:
+        response = client.get(f'/changes?since={since}')
+        assert response.status_code == 200, response.get_data(as_text=True)
+        size += len(response.get_data())
+        entries += len(response.json)
+        if not response.json:
+            return time.perf_counter() - started, size, entries
+        since = int(response.headers['X-Next-Cursor'])
+
+
+# Three in four writes are grades, posted ten at a time, the rest renames
+def write(client, rng, writes, hot_enrollments, hot_students):
+    grades = []
+    for n in range(writes):
+        if n % 4:
+            grades.append({"id": rng.choice(hot_enrollments), "grade": rng.choice('ABCDF')})
+        else:
+            assert client.patch(f'/student/{rng.choice(hot_students)}', json={"name": f"Renamed {n}"}).status_code == 200
+        if len(grades) == 10:
+            assert client.post('/enrollment/grades', json=grades).status_code == 202
+            grades = []
+    if grades:
+        assert client.post('/enrollment/grades', json=grades).status_code == 202
+    grade_queue.join()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Change log sync benchmark')
+    parser.add_argument('--scales', default='1000,10000', help='comma separated student counts')
+    parser.add_argument('--writes', type=int, default=1000, help='updates between two syncs')
+    parser.add_argument('--hot-rows', type=int, default=200, help='rows the updates are spread over')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    flask_app = create_app(BenchmarkConfig)
+    cache.backend.max_entries = 0
+    client = flask_app.test_client()
+
+    for scale in [int(scale) for scale in args.scales.split(',')]:
+        rng = random.Random(args.seed)
+        with flask_app.app_context():
+            seed(scale, args.seed, reset=True)
+            db.session.remove()
+            since = db.session.scalar(select(func.max(change_log.c.seq)))
+            hot_enrollments = rng.sample(db.session.scalars(select(Enrollment.id)).all(), args.hot_rows)
+            hot_students = rng.sample(db.session.scalars(select(Student.id)).all(), args.hot_rows // 4)
+            db.session.remove()
+
+            write(client, rng, args.writes, hot_enrollments, hot_students)
+            full_seconds, full_size = full_download(client)
+            log_seconds, log_size, entries = incremental(client, since)
+
+            started = time.perf_counter()
+            compact(db.session, db.session.scalar(select(func.max(change_log.c.seq))))
+            db.session.commit()
+            compact_seconds = time.perf_counter() - started
+            compacted_seconds, compacted_size, compacted_entries = incremental(client, since)
+
+        print(f"{scale:>7} students, {args.writes} writes: full download {full_seconds * 1000:8.1f} ms {full_size / 1e6:7.2f} MB  |  "
+              f"changes {log_seconds * 1000:7.1f} ms {log_size / 1e3:7.1f} kB {entries} entries  |  "
+              f"compacted in {compact_seconds * 1000:.1f} ms: {compacted_seconds * 1000:6.1f} ms {compacted_size / 1e3:6.1f} kB {compacted_entries} entries")
+    grade_queue.shutdown()
+
+
+if __name__ == '__main__':
+    main()
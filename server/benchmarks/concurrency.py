@@ -0,0 +1,125 @@
+# Concurrency benchmark for the async read path. Seeds the benchmark
+# database, starts uvicorn serving asgi:app in a subprocess and holds many
+# keep-alive connections open at once, comparing each route served by the
+# Flask app (from the WSGI thread pool) with its /async counterpart.
+#
+# Run from the server directory:
+#     python -m benchmarks.concurrency --scale 10000 --connections 500
+import argparse
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import time
+
+from benchmarks.api import BenchmarkConfig, DATABASE_PATH, percentile
+from app import create_app
+from models import db
+from seed import seed
+
+ROUTES = ['/course', '/course/1', '/student?limit=50', '/student/1', '/enrollment?limit=50', '/student_count']
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_server(port, workers):
+    # The response cache is off so both paths do the same database work
+    env = dict(os.environ, APP_ENV='production', DATABASE_URL=f'sqlite:///{DATABASE_PATH}', CACHE_MAX_ENTRIES='0')
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', 'asgi:app', '--port', str(port), '--workers', str(workers),
+         '--log-level', 'warning', '--no-access-log'],
+        env=env,
+    )
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return server
+        except OSError:
+            time.sleep(0.2)
+    server.kill()
+    raise RuntimeError('uvicorn did not start')
+
+
+async def read_response(reader):
+    headers = await reader.readuntil(b'\r\n\r\n')
+    status = int(headers.split(b' ', 2)[1])
+    length = 0
+    for line in headers.split(b'\r\n'):
+        if line.lower().startswith(b'content-length:'):
+            length = int(line.split(b':', 1)[1])
+    await reader.readexactly(length)
+    return status
+
+
+# Opens connections sockets and has each send requests back to back until
+# the total is reached
+async def load(port, path, connections, requests):
+    latencies = []
+    errors = 0
+    remaining = requests
+    request = f'GET {path} HTTP/1.1\r\nHost: 127.0.0.1\r\n\r\n'.encode()
+
+    async def client():
+        nonlocal remaining, errors
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        try:
+            while remaining > 0:
+                remaining -= 1
+                start = time.perf_counter()
+                writer.write(request)
+                status = await read_response(reader)
+                latencies.append(time.perf_counter() - start)
+                errors += status >= 500
+        except (ConnectionError, asyncio.IncompleteReadError):
+            errors += 1
+        finally:
+            writer.close()
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(connections)))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 1),
+        "throughput_rps": round(len(latencies) / elapsed, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Sync vs async read path under many concurrent connections')
+    parser.add_argument('--scale', type=int, default=10000, help='students to seed')
+    parser.add_argument('--connections', type=int, default=500)
+    parser.add_argument('--requests', type=int, default=5000, help='requests per route and path')
+    parser.add_argument('--workers', type=int, default=1, help='uvicorn worker processes')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    with create_app(BenchmarkConfig).app_context():
+        print(f"seeded: {seed(args.scale, args.seed, reset=True)}")
+        db.session.remove()
+
+    port = free_port()
+    server = start_server(port, args.workers)
+    try:
+        for route in ROUTES:
+            for prefix in ('', '/async'):
+                result = asyncio.run(load(port, prefix + route, args.connections, args.requests))
+                print(f"  {prefix + route:<28} p50 {result['p50_ms']:8.1f} ms  p99 {result['p99_ms']:8.1f} ms  "
+                      f"{result['throughput_rps']:8.1f} req/s  {result['errors']} errors")
+    finally:
+        server.terminate()
+        server.wait()
+
+
+if __name__ == '__main__':
+    main()
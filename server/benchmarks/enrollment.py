@@ -0,0 +1,212 @@
+# Enrollment stress test: many HTTP clients enroll students into a few
+# capacity-limited courses at once through a local multi-threaded server,
+# then enrolled students drop out while others keep enrolling. Afterwards
+# every course must hold at most its capacity, seats_taken must equal its
+# enrollment count, a course may only have a waitlist while it is full,
+# and waitlisted students must have been promoted oldest first. Reports
+# admissions per second and exits with status 1 on any violation.
+#
+# Run from the server directory:
+#     python -m benchmarks.enrollment --students 2000 --courses 4 --capacity 100 --threads 16
+import argparse
+import http.client
+import json
+import logging
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import select, func
+from werkzeug.serving import make_server
+
+from app import create_app, cache
+from benchmarks.api import BenchmarkConfig, percentile
+from models import db, Course, Enrollment, WaitlistEntry
+from seed import seed
+
+
+# Sends the requests from several threads, each on its own keep-alive
+# connection. Returns the (status, seconds from the start until it
+# completed) of each request in order, the elapsed time and the sorted
+# latencies.
+def send(port, requests, threads):
+    responses = [None] * len(requests)
+    latencies = []
+    lock = threading.Lock()
+    started = time.perf_counter()
+
+    def worker(indices):
+        connection = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+        local_latencies = []
+        for n in indices:
+            method, url, body = requests[n]
+            start = time.perf_counter()
+            connection.request(method, url, body=json.dumps(body) if body is not None else None,
+                               headers={'Content-Type': 'application/json'})
+            response = connection.getresponse()
+            response.read()
+            finished = time.perf_counter()
+            local_latencies.append(finished - start)
+            responses[n] = (response.status, finished - started)
+            if response.will_close:
+                connection.close()
+                connection = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+        connection.close()
+        with lock:
+            latencies.extend(local_latencies)
+
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        list(pool.map(worker, [range(t, len(requests), threads) for t in range(threads)]))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return responses, elapsed, latencies
+
+
+# Admissions per second count the time until the last student was
+# admitted, as the courses are full after that
+def summarize(label, responses, elapsed, latencies):
+    statuses = Counter(status for status, _ in responses)
+    admitted = statuses.get(201, 0)
+    admitting = max((finished for status, finished in responses if status == 201), default=0)
+    result = {
+        "requests": len(responses),
+        "statuses": {str(status): count for status, count in sorted(statuses.items())},
+        "admissions_per_s": round(admitted / admitting, 1) if admitted else 0.0,
+        "requests_per_s": round(len(responses) / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+    }
+    print(f"{label:<10} {result['requests']:6} requests in {elapsed:6.2f}s  {result['requests_per_s']:8.1f} req/s  "
+          f"{result['admissions_per_s']:8.1f} admissions/s  p50 {result['p50_ms']:7.2f} ms  p99 {result['p99_ms']:7.2f} ms  "
+          f"statuses {result['statuses']}")
+    return result
+
+
+# Seat and waitlist invariants of the given courses. Returns the violations.
+def violations(course_ids):
+    db.session.remove()
+    problems = []
+    enrolled = dict(db.session.execute(
+        select(Enrollment.course_id, func.count(Enrollment.id)).where(Enrollment.course_id.in_(course_ids)).group_by(Enrollment.course_id)
+    ).all())
+    waiting = dict(db.session.execute(
+        select(WaitlistEntry.course_id, func.count(WaitlistEntry.id)).where(WaitlistEntry.course_id.in_(course_ids)).group_by(WaitlistEntry.course_id)
+    ).all())
+
+    for id, capacity, seats_taken in db.session.execute(select(Course.id, Course.capacity, Course.seats_taken).where(Course.id.in_(course_ids))):
+        count = enrolled.get(id, 0)
+        if count > capacity:
+            problems.append(f"course {id} is overbooked: {count} enrollments for {capacity} seats")
+        if seats_taken != count:
+            problems.append(f"course {id} has seats_taken {seats_taken} but {count} enrollments")
+        if waiting.get(id) and count < capacity:
+            problems.append(f"course {id} has {waiting[id]} waitlisted students and {capacity - count} free seats")
+    return problems
+
+
+def waitlists(course_ids):
+    db.session.remove()
+    lists = {id: [] for id in course_ids}
+    for course_id, student_id in db.session.execute(
+        select(WaitlistEntry.course_id, WaitlistEntry.student_id).where(WaitlistEntry.course_id.in_(course_ids)).order_by(WaitlistEntry.id)
+    ):
+        lists[course_id].append(student_id)
+    return lists
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Concurrent enrollment stress test')
+    parser.add_argument('--students', type=int, default=2000, help='students to seed')
+    parser.add_argument('--courses', type=int, default=4, help='capacity-limited courses to fill')
+    parser.add_argument('--capacity', type=int, default=100, help='seats per course')
+    parser.add_argument('--requests', type=int, default=2000, help='enrollment requests in the admission phase')
+    parser.add_argument('--drops', type=int, default=200, help='enrollments deleted in the churn phase')
+    parser.add_argument('--threads', type=int, default=16, help='concurrent HTTP clients')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help='write results to this JSON file')
+    args = parser.parse_args()
+
+    flask_app = create_app(BenchmarkConfig)
+    cache.backend.max_entries = 0
+    rng = random.Random(args.seed)
+
+    with flask_app.app_context():
+        seed(args.students, args.seed, reset=True)
+        db.session.remove()
+
+        client = flask_app.test_client()
+        course_ids = [
+            client.post('/course', json={"title": f"Stress test {n}", "capacity": args.capacity}).json["id"]
+            for n in range(args.courses)
+        ]
+
+        logging.getLogger('werkzeug').setLevel(logging.ERROR)
+        server = make_server('127.0.0.1', 0, flask_app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        results = {"students": args.students, "courses": args.courses, "capacity": args.capacity, "threads": args.threads}
+
+        try:
+            # Admission: far more requests than seats, with repeats
+            requests = [
+                ('POST', '/enrollment', {"student_id": rng.randint(1, args.students), "course_id": rng.choice(course_ids)})
+                for _ in range(args.requests)
+            ]
+            responses, elapsed, latencies = send(server.server_port, requests, args.threads)
+            results["admission"] = summarize("admission", responses, elapsed, latencies)
+            server_errors = sum(status >= 500 for status, _ in responses)
+            problems = violations(course_ids)
+
+            admitted = sum(status == 201 for status, _ in responses)
+            if admitted != db.session.scalar(select(func.count(Enrollment.id)).where(Enrollment.course_id.in_(course_ids))):
+                problems.append(f"{admitted} requests were admitted but the enrollment count differs")
+
+            # Churn: enrolled students drop out while new requests arrive
+            before = waitlists(course_ids)
+            enrollment_ids = db.session.scalars(select(Enrollment.id).where(Enrollment.course_id.in_(course_ids))).all()
+            requests = [('DELETE', f'/enrollment/{id}', None) for id in rng.sample(enrollment_ids, min(args.drops, len(enrollment_ids)))]
+            requests += [
+                ('POST', '/enrollment', {"student_id": rng.randint(1, args.students), "course_id": rng.choice(course_ids)})
+                for _ in range(len(requests))
+            ]
+            rng.shuffle(requests)
+            responses, elapsed, latencies = send(server.server_port, requests, args.threads)
+            results["churn"] = summarize("churn", responses, elapsed, latencies)
+            problems += violations(course_ids)
+
+            # Students still waiting from before the churn must be the
+            # youngest part of the earlier waitlist
+            after = waitlists(course_ids)
+            promoted = 0
+            for id in course_ids:
+                remaining = [student for student in after[id] if student in set(before[id])]
+                promoted += len(before[id]) - len(remaining)
+                if remaining != before[id][len(before[id]) - len(remaining):]:
+                    problems.append(f"course {id} promoted waitlisted students out of order")
+            results["churn"]["promoted"] = promoted
+            print(f"{'':<10} {promoted} waitlisted students promoted")
+
+            server_errors += sum(status >= 500 for status, _ in responses)
+            if server_errors:
+                problems.append(f"{server_errors} requests failed with a server error")
+        finally:
+            server.shutdown()
+
+    results["violations"] = problems
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"results written to {args.output}")
+
+    for problem in problems:
+        print(f"VIOLATION: {problem}")
+    if problems:
+        sys.exit(1)
+    print("no overbooking: every course is within capacity and its waitlist was promoted in order")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+# Grade ingestion benchmark: the same stream of grade updates written one
+# row and one transaction at a time, against POST /enrollment/grades and
+# its write-behind queue. Some updates repeat an enrollment, as
+# corrections do at term end. Reports updates per second until every grade
+# is in the database, and for the queue the request latency and how many
+# updates it coalesced.
+#
+# Run from the server directory:
+#     python -m benchmarks.grades --students 2000 --updates 5000
+import argparse
+import random
+import time
+
+from sqlalchemy import select
+
+from app import create_app, cache
+from benchmarks.api import BenchmarkConfig, percentile
+from grades import grade_queue
+from models import db, chunked, Enrollment
+from seed import seed
+
+GRADES = ('A', 'B', 'C', 'D', 'F')
+
+
+def per_row(updates):
+    started = time.perf_counter()
+    for id, grade in updates:
+        Enrollment.update_by_id(id, {"grade": grade})
+        db.session.commit()
+    db.session.remove()
+    return time.perf_counter() - started
+
+
+def queued(flask_app, updates, request_size):
+    client = flask_app.test_client()
+    latencies = []
+    started = time.perf_counter()
+    for start in range(0, len(updates), request_size):
+        body = [{"id": id, "grade": grade} for id, grade in updates[start:start + request_size]]
+        request_started = time.perf_counter()
+        response = client.post('/enrollment/grades', json=body)
+        latencies.append(time.perf_counter() - request_started)
+        assert response.status_code == 202, response.get_data(as_text=True)
+    grade_queue.join()
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return elapsed, latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Grade ingestion benchmark')
+    parser.add_argument('--students', type=int, default=2000, help='students to seed')
+    parser.add_argument('--updates', type=int, default=5000, help='grade updates to write')
+    parser.add_argument('--repeats', type=float, default=0.2, help='fraction of updates that correct an earlier one')
+    parser.add_argument('--request-size', type=int, default=50, help='grade updates per POST')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    flask_app = create_app(BenchmarkConfig)
+    cache.backend.max_entries = 0
+    rng = random.Random(args.seed)
+
+    with flask_app.app_context():
+        seed(args.students, args.seed, reset=True)
+        db.session.remove()
+        ids = db.session.scalars(select(Enrollment.id)).all()
+        db.session.remove()
+
+        updates = []
+        for _ in range(args.updates):
+            if updates and rng.random() < args.repeats:
+                id = rng.choice(updates)[0]
+            else:
+                id = rng.choice(ids)
+            updates.append((id, rng.choice(GRADES)))
+        expected = dict(updates)
+
+        elapsed = per_row(updates)
+        print(f"per row  {len(updates)} updates in {elapsed:6.2f}s  {len(updates) / elapsed:8.1f} updates/s")
+
+        # Reset so the queued run writes real changes too
+        Enrollment.update_many([{"id": id, "grade": "N/A"} for id in expected])
+        db.session.commit()
+        db.session.remove()
+
+        elapsed, latencies = queued(flask_app, updates, args.request_size)
+        stats = grade_queue.stats()
+        print(f"queued   {len(updates)} updates in {elapsed:6.2f}s  {len(updates) / elapsed:8.1f} updates/s  "
+              f"POST p50 {percentile(latencies, 0.50) * 1000:.2f} ms  p99 {percentile(latencies, 0.99) * 1000:.2f} ms  "
+              f"{stats['batches']} batches, {stats['coalesced']} coalesced, flush p50 {stats['flush_ms']['p50']} ms")
+
+        written = {}
+        for chunk in chunked(expected):
+            written.update(db.session.execute(select(Enrollment.id, Enrollment.grade).where(Enrollment.id.in_(chunk))).tuples().all())
+        missing = sum(written.get(id) != grade for id, grade in expected.items())
+        if missing:
+            print(f"{missing} enrollments don't have their last grade")
+        grade_queue.shutdown()
+
+
+if __name__ == '__main__':
+    main()
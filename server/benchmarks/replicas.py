@@ -0,0 +1,132 @@
+# Read replica benchmark: the same GET load against a local multi-threaded
+# server with 0, 1 and 2 SQLite replicas, each a file copy of the primary
+# made with `flask replicas sync`'s backup. Optionally a writer thread keeps
+# updating courses on the primary meanwhile. Reports reads per second,
+# latency and where the reads went. The response cache is off so every
+# read reaches a database.
+#
+# Run from the server directory:
+#     python -m benchmarks.replicas --students 10000 --requests 2000 --threads 8 --writer
+import argparse
+import http.client
+import json
+import logging
+import random
+import threading
+
+from sqlalchemy import select
+from werkzeug.serving import make_server
+
+from app import create_app, cache
+from benchmarks.api import BenchmarkConfig, DATABASE_PATH, percentile
+from benchmarks.enrollment import send
+from models import db, Course
+from replicas import replicas, copy_sqlite
+from seed import seed
+
+
+def replica_paths(count):
+    return [f'{DATABASE_PATH}.replica{n}' for n in range(count)]
+
+
+# Updates course titles on the primary until stopped, appending each
+# response status to writes
+def write_courses(port, course_ids, stop, writes):
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+    rng = random.Random(7)
+    while not stop.is_set():
+        id = rng.choice(course_ids)
+        connection.request('PATCH', f'/course/{id}', body=json.dumps({"title": f"Course {id} rev {rng.random():.6f}"}),
+                           headers={'Content-Type': 'application/json'})
+        response = connection.getresponse()
+        response.read()
+        writes.append(response.status)
+    connection.close()
+
+
+def run(count, requests, threads, writer):
+    class Config(BenchmarkConfig):
+        SQLALCHEMY_REPLICA_URLS = [f'sqlite:///{path}' for path in replica_paths(count)]
+
+    flask_app = create_app(Config)
+    cache.backend.max_entries = 0
+    before = replicas.stats()["reads"]
+
+    with flask_app.app_context():
+        course_ids = db.session.scalars(select(Course.id)).all()
+        db.session.remove()
+        server = make_server('127.0.0.1', 0, flask_app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        stop = threading.Event()
+        writes = []
+        if writer:
+            writing = threading.Thread(target=write_courses, args=(server.server_port, course_ids, stop, writes))
+            writing.start()
+        try:
+            responses, elapsed, latencies = send(server.server_port, requests, threads)
+        finally:
+            stop.set()
+            if writer:
+                writing.join()
+            server.shutdown()
+            for engine in db.engines.values():
+                engine.dispose()
+
+    after = replicas.stats()["reads"]
+    # Without replicas there is no routing and nothing is counted
+    targets = {target: after.get(target, 0) - before.get(target, 0) for target in after} if count else {"primary": len(responses)}
+    failed = sum(status != 200 for status, _ in responses)
+    result = {
+        "replicas": count,
+        "reads_per_s": round(len(responses) / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+        "targets": {target: reads for target, reads in sorted(targets.items()) if reads},
+        "writes_per_s": round(len(writes) / elapsed, 1),
+        "failed": failed,
+    }
+    print(f"{count} replicas  {result['reads_per_s']:8.1f} reads/s  p50 {result['p50_ms']:7.2f} ms  p99 {result['p99_ms']:7.2f} ms  "
+          f"{result['writes_per_s']:6.1f} writes/s  reads {result['targets']}" + (f"  {failed} failed" if failed else ""))
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Read replica benchmark')
+    parser.add_argument('--students', type=int, default=10000, help='students to seed')
+    parser.add_argument('--replicas', default='0,1,2', help='comma separated replica counts to compare')
+    parser.add_argument('--requests', type=int, default=2000, help='GET requests per run')
+    parser.add_argument('--threads', type=int, default=8, help='concurrent HTTP clients')
+    parser.add_argument('--writer', action='store_true', help='update courses on the primary during each run')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help='write results to this JSON file')
+    args = parser.parse_args()
+    counts = [int(count) for count in args.replicas.split(',')]
+
+    flask_app = create_app(BenchmarkConfig)
+    with flask_app.app_context():
+        seed(args.students, args.seed, reset=True)
+        course_ids = db.session.scalars(select(Course.id)).all()
+        db.session.remove()
+        db.engine.dispose()
+    for path in replica_paths(max(counts)):
+        copy_sqlite(DATABASE_PATH, path)
+
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    # The writer's PATCHes trip the N+1 warning
+    logging.getLogger('metrics').setLevel(logging.ERROR)
+    rng = random.Random(args.seed)
+    requests = []
+    for _ in range(args.requests):
+        route = rng.choice(('student', 'profile', 'course'))
+        id = rng.choice(course_ids) if route == 'course' else rng.randint(1, args.students)
+        requests.append(('GET', f'/{route}/{id}', None))
+
+    results = [run(count, requests, args.threads, args.writer) for count in counts]
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({"students": args.students, "threads": args.threads, "writer": args.writer, "runs": results}, f, indent=2)
+        print(f"results written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
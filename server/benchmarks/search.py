@@ -0,0 +1,90 @@
+# Search benchmark: latency of /search queries answered from the FTS5
+# index against the same queries as LIKE '%term%' scans, at several data
+# scales. Queries are drawn from the seeded data: name prefixes of two to
+# five letters, full first and last names, two-word names and course title
+# words.
+#
+# Run from the server directory:
+#     python -m benchmarks.search --scales 10000,100000 --output search.json
+import argparse
+import json
+import random
+import time
+
+from benchmarks.api import BenchmarkConfig, percentile
+from app import create_app
+from models import db, Student, Course
+from search import search, like_search, terms
+from seed import seed
+from sqlalchemy import select, func
+
+
+def sample_queries(rng, count):
+    names = db.session.scalars(select(Student.name).order_by(func.random()).limit(count)).all()
+    titles = db.session.scalars(select(Course.title).order_by(func.random()).limit(count)).all()
+
+    queries = []
+    for n in range(count):
+        first, last = names[n % len(names)].split()[:2]
+        word = rng.choice(terms(titles[n % len(titles)]))
+        queries.append(rng.choice([
+            first[:rng.randint(2, 5)],
+            last,
+            f"{first} {last[:3]}",
+            word,
+        ]))
+    return queries
+
+
+def run(function, queries, limit):
+    connection = db.session.connection()
+    latencies = []
+    matches = 0
+    for q in queries:
+        start = time.perf_counter()
+        items, _ = function(connection, q, limit=limit)
+        latencies.append(time.perf_counter() - start)
+        matches += len(items)
+
+    latencies.sort()
+    return {
+        "queries": len(latencies),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+        "mean_results": round(matches / len(latencies), 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Full-text search benchmark')
+    parser.add_argument('--scales', default='1000,10000,100000', help='comma separated student counts')
+    parser.add_argument('--queries', type=int, default=200, help='queries per scale')
+    parser.add_argument('--limit', type=int, default=50, help='results per query')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help='write results to this JSON file')
+    args = parser.parse_args()
+
+    flask_app = create_app(BenchmarkConfig)
+    results = {"limit": args.limit, "scales": {}}
+    with flask_app.app_context():
+        for scale in [int(s) for s in args.scales.split(',')]:
+            seed(scale, args.seed, reset=True)
+            db.session.remove()
+            queries = sample_queries(random.Random(args.seed), args.queries)
+
+            scale_results = results["scales"][str(scale)] = {}
+            for name, function in (("fts5", search), ("like", like_search)):
+                result = scale_results[name] = run(function, queries, args.limit)
+                print(f"{scale:>7} {name:<5} p50 {result['p50_ms']:9.2f} ms  p95 {result['p95_ms']:9.2f} ms  "
+                      f"p99 {result['p99_ms']:9.2f} ms  {result['mean_results']:6.1f} results/query")
+            db.session.remove()
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"results written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,174 @@
+# Compares the ORM + to_dict() serialization path with the row serializers
+# in serializers.py, the stdlib JSON provider with FastJSONProvider, and the
+# bytes on the wire and encode time of the student and enrollment lists as
+# JSON and MessagePack, uncompressed, gzipped and brotli compressed.
+#
+# Run from the server directory:
+#     python -m benchmarks.serialization --students 10000
+import argparse
+import random
+import time
+from datetime import datetime
+
+from flask import Flask
+from flask.json.provider import DefaultJSONProvider
+from sqlalchemy import insert
+from sqlalchemy.orm import joinedload, selectinload
+
+from models import db, Student, Profile, Instructor, Course, Enrollment
+from compression import GzipEncoder, BrotliEncoder, brotli
+from serializers import student_rows, enrollment_rows, FastJSONProvider, orjson, msgpack, dumps_msgpack
+
+
+def create_app():
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+    db.init_app(app)
+    return app
+
+
+def seed(students, courses=200, instructors=20, enrollments_per_student=3):
+    rng = random.Random(42)
+    now = datetime(2024, 1, 8, 9, 30)
+
+    db.session.execute(insert(Instructor.__table__), [
+        {"id": i, "name": f"Instructor {i}"} for i in range(1, instructors + 1)
+    ])
+    db.session.execute(insert(Course.__table__), [
+        {"id": i, "title": f"Course {i}", "instructor_id": rng.randint(1, instructors)} for i in range(1, courses + 1)
+    ])
+    db.session.execute(insert(Student.__table__), [
+        {"id": i, "name": f"Student {i}", "email": f"student{i}@example.com"} for i in range(1, students + 1)
+    ])
+    db.session.execute(insert(Profile.__table__), [
+        {"age": rng.randint(18, 40), "bio": "Bio", "student_id": i} for i in range(1, students + 1)
+    ])
+    db.session.execute(insert(Enrollment.__table__), [
+        {"student_id": i, "course_id": course_id, "grade": "N/A", "date_enrolled": now}
+        for i in range(1, students + 1)
+        for course_id in rng.sample(range(1, courses + 1), enrollments_per_student)
+    ])
+    db.session.commit()
+
+
+# The hand-written Student.to_dict() the row serializers replaced
+def legacy_student_dict(student):
+    return {
+        "id": student.id,
+        "name": student.name,
+        "email": student.email,
+        "profile": {
+            "age": student.profile.age,
+            "bio": student.profile.bio,
+            "student_id": student.profile.student_id,
+        },
+        "enrollments": [
+            {
+                "id": e.id,
+                "student_id": e.student_id,
+                "course_id": e.course_id,
+                "date_enrolled": e.date_enrolled,
+                "grade": e.grade,
+                "course": {
+                    "id": e.course.id,
+                    "title": e.course.title,
+                    "instructor_id": e.course.instructor_id,
+                    "instructor": {
+                        "id": e.course.instructor.id,
+                        "name": e.course.instructor.name,
+                    },
+                },
+            }
+            for e in student.enrollments
+        ],
+    }
+
+
+def orm_path():
+    students = Student.query.options(
+        joinedload(Student.profile),
+        selectinload(Student.enrollments).joinedload(Enrollment.course).joinedload(Course.instructor),
+    ).order_by(Student.id).all()
+    return [legacy_student_dict(s) for s in students]
+
+
+def row_path():
+    items, _ = student_rows.page()
+    return items
+
+
+# Best wall-clock time of repeat runs; the session is reset between runs
+# so the ORM path cannot reuse objects from the identity map
+def best_of(function, repeat):
+    timings = []
+    result = None
+    for _ in range(repeat):
+        db.session.remove()
+        start = time.perf_counter()
+        result = function()
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+
+# Encoders of a payload as sent to clients: (name, function returning bytes)
+def wire_encodings(fast):
+    encodings = [("json", lambda obj: fast.dumps(obj).encode())]
+    if msgpack is not None:
+        encodings.append(("msgpack", dumps_msgpack))
+
+    compressed = []
+    for name, encode in encodings:
+        compressed.append((f"{name}+gzip", lambda obj, encode=encode: compress(GzipEncoder(6), encode(obj))))
+        if brotli is not None:
+            compressed.append((f"{name}+br", lambda obj, encode=encode: compress(BrotliEncoder(4), encode(obj))))
+    return encodings + compressed
+
+
+def compress(encoder, data):
+    return encoder.process(data) + encoder.finish()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serialization micro-benchmark')
+    parser.add_argument('--students', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    app = create_app()
+    with app.app_context():
+        db.create_all()
+        seed(args.students)
+
+        orm_time, orm_items = best_of(orm_path, args.repeat)
+        row_time, row_items = best_of(row_path, args.repeat)
+        # Relationship collections have no defined order; the row serializers sort children by id
+        for item in orm_items:
+            item["enrollments"].sort(key=lambda e: e["id"])
+        assert orm_items == row_items, "row serializers must produce the same payload"
+
+        stdlib = DefaultJSONProvider(app)
+        fast = FastJSONProvider(app)
+        stdlib_time, _ = best_of(lambda: stdlib.dumps(row_items), args.repeat)
+        fast_time, _ = best_of(lambda: fast.dumps(row_items), args.repeat)
+
+        enrollment_items, _ = enrollment_rows.page()
+        wire = []
+        for name, encode in wire_encodings(fast):
+            for payload, items in (("students", row_items), ("enrollments", enrollment_items)):
+                encode_time, body = best_of(lambda: encode(items), args.repeat)
+                wire.append((payload, name, len(body), encode_time))
+
+    print(f"{args.students} students, best of {args.repeat}")
+    print(f"  build dicts  ORM + to_dict     {orm_time * 1000:9.1f} ms")
+    print(f"  build dicts  row serializers   {row_time * 1000:9.1f} ms  ({orm_time / row_time:.1f}x)")
+    print(f"  encode JSON  stdlib            {stdlib_time * 1000:9.1f} ms")
+    print(f"  encode JSON  {'orjson' if orjson else 'stdlib fallback':<17}{fast_time * 1000:9.1f} ms  ({stdlib_time / fast_time:.1f}x)")
+
+    json_sizes = {payload: size for payload, name, size, _ in wire if name == "json"}
+    print("  wire format                     bytes             encode")
+    for payload, name, size, encode_time in sorted(wire):
+        print(f"  {payload:<12} {name:<14} {size:>12,} {size / json_sizes[payload]:6.1%} {encode_time * 1000:9.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
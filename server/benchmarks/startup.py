@@ -0,0 +1,143 @@
+# Startup benchmark and regression check: how long a new serving worker
+# takes to import wsgi (the app modules and create_app) and answer its
+# first request, started cold as a fresh interpreter and forked from a
+# master that already imported the app, as gunicorn's preload_app does.
+# Also runs `python -X importtime -c "import wsgi"` and reports the
+# packages that take the longest to import.
+#
+# Exits with status 1 when the cold start's median exceeds --budget-ms, or
+# when importing wsgi loads a module only the flask command needs
+# (Flask-Migrate, Alembic, Faker, the seeder).
+#
+# Run from the server directory:
+#     python -m benchmarks.startup --runs 10 --budget-ms 1000
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from collections import Counter
+
+from app import create_app
+from benchmarks.api import BenchmarkConfig, DATABASE_PATH
+from models import db
+from seed import seed
+
+CLI_ONLY_MODULES = ('flask_migrate', 'alembic', 'mako', 'faker', 'seed')
+
+# Run in a fresh interpreter. Prints the timings of a cold start, or with
+# "fork" imports the app once and prints those of forked workers.
+WORKER = '''
+import json, os, sys, time
+from werkzeug.test import Client
+started = time.perf_counter()
+import wsgi
+imported = time.perf_counter()
+
+
+def first_request():
+    started = time.perf_counter()
+    response = Client(wsgi.app).get('/student/1')
+    assert response.status_code == 200, response.status_code
+    return time.perf_counter() - started
+
+
+if sys.argv[1] == 'cold':
+    print(json.dumps({"import_s": imported - started, "first_request_s": first_request(),
+                      "cli_modules": [name for name in sys.argv[2:] if name in sys.modules]}))
+else:
+    for _ in range(int(sys.argv[2])):
+        read, write = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.write(write, str(first_request()).encode())
+            os._exit(0)
+        os.close(write)
+        with os.fdopen(read) as pipe:
+            print(json.dumps({"first_request_s": float(pipe.read())}))
+        os.waitpid(pid, 0)
+'''
+
+
+def worker_env():
+    return {**os.environ, 'APP_ENV': 'production', 'DATABASE_URL': f'sqlite:///{DATABASE_PATH}'}
+
+
+def cold_starts(runs):
+    results = []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, '-c', WORKER, 'cold', *CLI_ONLY_MODULES],
+                                env=worker_env(), check=True, capture_output=True, text=True).stdout
+        results.append(json.loads(output))
+    return results
+
+
+def forked_starts(runs):
+    output = subprocess.run([sys.executable, '-c', WORKER, 'fork', str(runs)],
+                            env=worker_env(), check=True, capture_output=True, text=True).stdout
+    return [json.loads(line) for line in output.splitlines()]
+
+
+# Self import time per top-level package, in seconds, from -X importtime
+def import_times():
+    stderr = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import wsgi'],
+                            env=worker_env(), check=True, capture_output=True, text=True).stderr
+    packages = Counter()
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, _, name = line[len('import time:'):].split('|')
+        packages[name.strip().split('.')[0]] += int(self_us) / 1e6
+    return packages
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Worker startup benchmark')
+    parser.add_argument('--runs', type=int, default=10, help='worker starts to time, cold and forked each')
+    parser.add_argument('--budget-ms', type=float, default=1000, help='fail when a cold start takes longer than this')
+    parser.add_argument('--top', type=int, default=15, help='packages to list from -X importtime')
+    parser.add_argument('--output', help='write results to this JSON file')
+    args = parser.parse_args()
+
+    flask_app = create_app(BenchmarkConfig)
+    with flask_app.app_context():
+        seed(100, 42, reset=True)
+        db.session.remove()
+        db.engine.dispose()
+
+    cold = cold_starts(args.runs)
+    forked = forked_starts(args.runs)
+    packages = import_times()
+
+    import_ms = statistics.median(run["import_s"] for run in cold) * 1000
+    cold_ms = statistics.median(run["import_s"] + run["first_request_s"] for run in cold) * 1000
+    cold_request_ms = statistics.median(run["first_request_s"] for run in cold) * 1000
+    forked_request_ms = statistics.median(run["first_request_s"] for run in forked) * 1000
+    cli_modules = sorted({name for run in cold for name in run["cli_modules"]})
+
+    print(f"cold start   import wsgi {import_ms:7.1f} ms  first request {cold_request_ms:6.1f} ms  total {cold_ms:7.1f} ms (median of {args.runs})")
+    print(f"forked       first request {forked_request_ms:6.1f} ms")
+    print(f"-X importtime, {sum(packages.values()) * 1000:.1f} ms in all:")
+    for name, seconds in packages.most_common(args.top):
+        print(f"  {seconds * 1000:7.1f} ms  {name}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({"import_ms": import_ms, "cold_ms": cold_ms, "cold_first_request_ms": cold_request_ms,
+                       "forked_first_request_ms": forked_request_ms, "cli_modules": cli_modules,
+                       "import_times_ms": {name: round(seconds * 1000, 1) for name, seconds in packages.most_common()}}, f, indent=2)
+        print(f"results written to {args.output}")
+
+    failures = []
+    if cli_modules:
+        failures.append(f"importing wsgi loaded {', '.join(cli_modules)}, which only the flask command needs")
+    if cold_ms > args.budget_ms:
+        failures.append(f"a cold start took {cold_ms:.1f} ms, over the {args.budget_ms:.0f} ms budget")
+    for failure in failures:
+        print(failure)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
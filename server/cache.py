@@ -0,0 +1,254 @@
+import pickle
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from functools import wraps
+
+from flask import request, Response
+
+from models import on_commit, TableVersion
+
+
+class CacheBackend:
+    # Storage used by ResponseCache. Keys passed to get/set already embed
+    # the database's version of the tables the entry depends on, so a write
+    # committed by any process makes the old entries unreachable. discard()
+    # only frees their room early.
+    def discard(self, tags):
+        pass
+
+    def get(self, key):
+        raise NotImplementedError
+
+    def set(self, key, value, tags):
+        raise NotImplementedError
+
+    def size(self):
+        return None
+
+
+class LRUCache(CacheBackend):
+    # In-process cache bounded by entry count and age. Entries made stale
+    # by this process's own commits are dropped right away instead of
+    # waiting for eviction; those of other processes' age out.
+    def __init__(self, max_entries=1024, ttl=60):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.tagged = {}
+        self.lock = threading.Lock()
+
+    def discard(self, tags):
+        with self.lock:
+            for tag in tags:
+                for key in list(self.tagged.get(tag, ())):
+                    self._remove(key)
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+
+            expires_at, _, value = entry
+            if expires_at < time.monotonic():
+                self._remove(key)
+                return None
+
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, tags):
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+
+            self.entries[key] = (time.monotonic() + self.ttl, tags, value)
+            for tag in tags:
+                self.tagged.setdefault(tag, set()).add(key)
+
+            while len(self.entries) > self.max_entries:
+                self._remove(next(iter(self.entries)))
+
+    def size(self):
+        return len(self.entries)
+
+    def _remove(self, key):
+        _, tags, _ = self.entries.pop(key)
+        for tag in tags:
+            keys = self.tagged.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.tagged[tag]
+
+
+class SharedCache(CacheBackend):
+    # Cache kept in a key-value store shared by every worker, so a page one
+    # worker rendered serves the others. The client only needs get(key) and
+    # set(key, value, ex=seconds), which a redis.Redis instance provides;
+    # LocalClient stands in for it. Unreachable entries expire after ttl.
+    def __init__(self, client, ttl=60, prefix='response-cache:'):
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def get(self, key):
+        value = self.client.get(self.prefix + repr(key))
+        return pickle.loads(value) if value is not None else None
+
+    def set(self, key, value, tags):
+        self.client.set(self.prefix + repr(key), pickle.dumps(value), ex=self.ttl)
+
+
+class LocalClient:
+    # Minimal in-memory replacement for a shared key-value store
+    def __init__(self):
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            value, expires_at = self.values.get(key, (None, None))
+            if expires_at is not None and expires_at < time.monotonic():
+                del self.values[key]
+                return None
+            return value
+
+    def set(self, key, value, ex=None):
+        with self.lock:
+            self.values[key] = (value, time.monotonic() + ex if ex else None)
+
+
+# Latest version of tables in the database the request reads from, read
+# once per request: conditional() builds the ETag from it and the response
+# cache keys entries on it, so both change with a write committed by any
+# worker process.
+def table_version(tables):
+    versions = request.environ.setdefault('table_versions', {})
+    if tables not in versions:
+        versions[tables] = TableVersion.latest(tables)
+    return versions[tables]
+
+
+# Answers If-None-Match with 304 Not Modified when none of the tables a
+# payload is built from changed since the client's copy, without running
+# the resource. Weak ETags come from the latest version of those tables,
+# read before the resource runs so they never claim fresher data than sent.
+def conditional(*tables):
+    def decorator(method):
+        @wraps(method)
+        def wrapper(*args, **kwargs):
+            accept = zlib.crc32(request.headers.get('Accept', '').encode())
+            etag = f'{table_version(tables)}-{accept:x}'
+
+            if request.if_none_match.contains_weak(etag):
+                response = Response(status=304)
+                response.set_etag(etag, weak=True)
+                return response
+
+            response = method(*args, **kwargs)
+            if isinstance(response, Response) and response.status_code == 200:
+                response.set_etag(etag, weak=True)
+            return response
+
+        return wrapper
+
+    return decorator
+
+
+# Headers that are recomputed when a cached response is rebuilt
+SKIPPED_HEADERS = {'Content-Length', 'Set-Cookie'}
+
+
+class ResponseCache:
+    # Caches successful GET responses of Resource methods, keyed on the
+    # request path, query string and Accept header, and the database's
+    # version of the tables the method names as its payload's sources, so
+    # a write to any of them by any process invalidates the entry.
+    def __init__(self, backend=None):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.listening = False
+        self.lock = threading.Lock()
+
+    def init_app(self, app):
+        if self.backend is None and app.config.get('CACHE_REDIS_URL'):
+            import redis
+            self.backend = SharedCache(
+                redis.Redis.from_url(app.config['CACHE_REDIS_URL']),
+                ttl=app.config.get('CACHE_TTL', 60),
+            )
+        if self.backend is None:
+            self.backend = LRUCache(
+                max_entries=app.config.get('CACHE_MAX_ENTRIES', 1024),
+                ttl=app.config.get('CACHE_TTL', 60),
+            )
+        if not self.listening:
+            on_commit(self.invalidate)
+            self.listening = True
+
+    def invalidate(self, tables):
+        self.backend.discard(sorted(tables))
+        with self.lock:
+            self.invalidations += 1
+
+    def cached(self, *tables):
+        def decorator(method):
+            @wraps(method)
+            def wrapper(*args, **kwargs):
+                if request.method != 'GET':
+                    return method(*args, **kwargs)
+
+                # The version conditional() read, from the same database as
+                # the payload, so an entry never holds older data than its key
+                key = (request.full_path, request.headers.get('Accept', ''), table_version(tables))
+                entry = self.backend.get(key)
+                if entry is not None:
+                    self._count(hit=True)
+                    body, status, headers = entry
+                    return Response(body, status, headers)
+
+                self._count(hit=False)
+                response = method(*args, **kwargs)
+                if isinstance(response, Response) and response.status_code == 200 and not response.is_streamed:
+                    headers = [(k, v) for k, v in response.headers.items() if k not in SKIPPED_HEADERS]
+                    self.backend.set(key, (response.get_data(), response.status_code, headers), tables)
+                return response
+
+            return wrapper
+
+        return decorator
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "invalidations": self.invalidations,
+                "entries": self.backend.size() if self.backend else None,
+            }
+
+    # Counters in the Prometheus text format, for GET /metrics
+    def metric_lines(self):
+        stats = self.stats()
+        lines = []
+        for name in ('hits', 'misses', 'invalidations'):
+            lines.append(f"# TYPE response_cache_{name}_total counter")
+            lines.append(f"response_cache_{name}_total {stats[name]}")
+        return lines
+
+    def _count(self, hit):
+        with self.lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+
+cache = ResponseCache()
@@ -0,0 +1,431 @@
+# Change data capture for the tables the API serves: students, profiles,
+# instructors, courses and enrollments. Writes record the rows they touch
+# the way reports.py records the reports they affect: ORM flushes from the
+# unit of work, session.execute() statements from their parameters, their
+# row_ids execution option or their WHERE clause, and rows the database
+# deletes by ON DELETE CASCADE by looking them up before the delete. Just
+# before the transaction commits the recorded rows are read back and
+# appended to the changes table, one entry per row however often the
+# transaction wrote it, so GET /changes?since=<seq> can hand consumers
+# what changed instead of whole tables.
+#
+# seq order is commit order: just before appending, as the last step before
+# commit, a transaction bumps the changes table's version row, whose lock it
+# then holds until it commits.
+# On a database with row locks this serializes the commits of all writes
+# to these tables from that point on; SQLite serializes writers anyway.
+import threading
+import time
+from datetime import datetime, timedelta
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import event, select, insert, update, delete, func, inspect, tuple_, bindparam, UniqueConstraint
+from sqlalchemy.orm import Session
+from werkzeug.http import http_date
+
+from models import db, chunked, on_commit, before_commit, record_changed_tables, bump_changed_tables, cascaded_tables, child_ids, Student, Profile, Instructor, Course, Enrollment, Change
+
+# Parents before children, the order inserts are logged in; deletes are
+# logged in the reverse order
+MODELS = (Student, Instructor, Course, Profile, Enrollment)
+TABLE_MODELS = {model.__table__: model for model in MODELS}
+TABLE_NAMES = {model.__tablename__: model for model in MODELS}
+
+INSERT = 'insert'
+UPDATE = 'update'
+DELETE = 'delete'
+# The whole table was replaced; consumers download it again
+RESET = 'reset'
+# Marks where expired entries were dropped, see expire()
+EXPIRED = 'expired'
+
+changes = Change.__table__
+
+# Seconds between checks for entries committed by other processes while
+# a long poll waits
+POLL_INTERVAL = 1.0
+
+
+class LogTruncated(Exception):
+    pass
+
+
+# Columns an entry reports: all but the id and the read-only ones
+def _columns(model):
+    return [column for column in model.__table__.columns if column.key != 'id' and column.key not in model.read_only_fields]
+
+
+# JSON-safe value, with datetimes as the HTTP dates the API returns
+def _value(value):
+    if isinstance(value, datetime):
+        return http_date(value)
+    return value
+
+
+def _pending(session):
+    return session.info.setdefault('changes', {"rows": {}, "keys": {}, "reset": set()})
+
+
+# Merges a write into what the transaction already recorded for each row:
+# {id: (op, fields)}, fields being None for every column. A row deleted and
+# inserted again in one transaction counts as updated.
+def _record(pending, table_name, ids, op, fields=None):
+    if table_name in pending["reset"]:
+        return
+
+    rows = pending["rows"].setdefault(table_name, {})
+    for id in ids:
+        if id is None:
+            continue
+        recorded = rows.get(id)
+        if recorded is None:
+            rows[id] = (op, None if fields is None else set(fields))
+        elif op == DELETE:
+            if recorded[0] == INSERT:
+                del rows[id]
+            else:
+                rows[id] = (DELETE, None)
+        elif op == INSERT:
+            rows[id] = (UPDATE if recorded[0] == DELETE else INSERT, None)
+        elif recorded[0] == UPDATE:
+            rows[id] = (UPDATE, None if fields is None or recorded[1] is None else recorded[1] | set(fields))
+
+
+# Logs the whole of each table as replaced instead of row by row, for
+# writes that replace a table (see seed.py) or whose rows can't be known
+def reset(session, table_names):
+    pending = _pending(session)
+    for name in table_names:
+        pending["reset"].add(name)
+        pending["rows"].pop(name, None)
+        pending["keys"].pop(name, None)
+
+
+# Rows of the logged tables the database deletes along with the given rows,
+# following ON DELETE CASCADE foreign keys. Must run before the delete.
+def _record_cascaded(session, table, ids):
+    pending = _pending(session)
+    parents = [(table, list(ids))]
+    while parents:
+        parent, parent_ids = parents.pop()
+        for child in TABLE_MODELS:
+            for fk in child.foreign_keys:
+                if fk.ondelete != 'CASCADE' or fk.column.table is not parent:
+                    continue
+                children = child_ids(session, fk.parent, parent_ids)
+                if children:
+                    _record(pending, child.name, children, DELETE)
+                    parents.append((child, children))
+
+
+# Inserts that don't set ids are found again at commit through a unique
+# constraint whose columns they all set, e.g. an enrollment's student and
+# course. Without one the table is logged as reset.
+def _record_keys(session, table, parameters):
+    for constraint in table.constraints:
+        if not isinstance(constraint, UniqueConstraint):
+            continue
+        columns = tuple(column.key for column in constraint.columns)
+        if parameters and all(key in row for row in parameters for key in columns):
+            keys = _pending(session)["keys"].setdefault(table.name, {}).setdefault(columns, set())
+            keys.update(tuple(row[key] for key in columns) for row in parameters)
+            return
+    reset(session, [table.name])
+
+
+# Students deleted through the session take their unloaded profiles and
+# enrollments with them in the database, instructors their courses
+@event.listens_for(Session, 'before_flush')
+def _record_cascades(session, flush_context, instances):
+    deleted = {}
+    for obj in session.deleted:
+        if type(obj) in MODELS and obj.id is not None:
+            deleted.setdefault(obj.__table__, []).append(obj.id)
+    for table, ids in deleted.items():
+        _record_cascaded(session, table, ids)
+
+
+@event.listens_for(Session, 'after_flush')
+def _record_flushed(session, flush_context):
+    for obj in session.new:
+        if type(obj) in MODELS:
+            _record(_pending(session), obj.__tablename__, [obj.id], INSERT)
+    for obj in session.deleted:
+        if type(obj) in MODELS:
+            _record(_pending(session), obj.__tablename__, [obj.id], DELETE)
+    for obj in session.dirty:
+        if type(obj) in MODELS:
+            state = inspect(obj)
+            fields = [attr.key for attr in state.mapper.column_attrs if state.attrs[attr.key].history.has_changes()]
+            if fields:
+                _record(_pending(session), obj.__tablename__, [obj.id], UPDATE, fields)
+
+
+# Rows written through session.execute(): ids from the parameters of an
+# insert, from the row_ids execution option, or read with the statement's
+# own WHERE clause before it runs. Updates log the columns their parameters
+# set, or every column when they set them with values(). Statements
+# writing a whole table, or once per parameter set without row_ids, log
+# the table as reset.
+@event.listens_for(Session, 'do_orm_execute')
+def _record_executed(execute_state):
+    if not (execute_state.is_insert or execute_state.is_update or execute_state.is_delete):
+        return
+    model = TABLE_MODELS.get(getattr(execute_state.statement, 'table', None))
+    session = execute_state.session
+    if model is None or model.__tablename__ in _pending(session)["reset"]:
+        return
+
+    table = model.__table__
+    parameters = execute_state.parameters or []
+    if isinstance(parameters, dict):
+        parameters = [parameters]
+    if execute_state.is_insert:
+        if parameters and all("id" in row for row in parameters):
+            _record(_pending(session), table.name, [row["id"] for row in parameters], INSERT)
+        else:
+            _record_keys(session, table, parameters)
+        return
+
+    row_ids = execute_state.execution_options.get('row_ids')
+    statement = execute_state.statement
+    if row_ids is None and statement.whereclause is not None and len(parameters) <= 1:
+        row_ids = session.connection().scalars(select(table.c.id).where(statement.whereclause)).all()
+    if row_ids is None:
+        written = cascaded_tables({table.name}) if execute_state.is_delete else {table.name}
+        reset(session, [name for name in written if name in TABLE_NAMES])
+        return
+
+    if execute_state.is_delete:
+        _record_cascaded(session, table, row_ids)
+        _record(_pending(session), table.name, row_ids, DELETE)
+    else:
+        fields = set(parameters[0]) & set(table.c.keys()) if parameters else None
+        _record(_pending(session), table.name, row_ids, UPDATE, fields or None)
+
+
+# Appends the recorded rows to the log, read back as they are now. The last
+# before_commit step, so its bump covers every table the transaction wrote.
+@before_commit(50)
+def _append_before_commit(session):
+    session.flush()
+    pending = session.info.pop('changes', None)
+    if pending is None or not (pending["rows"] or pending["keys"] or pending["reset"]):
+        return
+
+    # Rows inserted without ids are read by their keys, along with the
+    # columns their entries report
+    connection = session.connection()
+    current = {}
+    for name, keyed in pending["keys"].items():
+        model = TABLE_NAMES[name]
+        table = model.__table__
+        for columns, keys in keyed.items():
+            for chunk in chunked(keys):
+                rows = connection.execute(
+                    select(table.c.id, *_columns(model)).where(tuple_(*(table.c[key] for key in columns)).in_(chunk))
+                ).all()
+                _record(pending, name, [row[0] for row in rows], INSERT)
+                current.setdefault(name, {}).update((row[0], row[1:]) for row in rows)
+
+    entries = [{"table_name": name, "row_id": None, "op": RESET, "data": None} for name in sorted(pending["reset"])]
+    deleted = []
+    for model in MODELS:
+        rows = pending["rows"].get(model.__tablename__)
+        if not rows:
+            continue
+
+        table = model.__table__
+        columns = _columns(model)
+        read = current.setdefault(table.name, {})
+        for chunk in chunked(sorted(id for id, (op, _) in rows.items() if op != DELETE and id not in read)):
+            read.update((row[0], row[1:]) for row in connection.execute(select(table.c.id, *columns).where(table.c.id.in_(chunk))))
+
+        for id in sorted(rows):
+            op, fields = rows[id]
+            values = read.get(id)
+            if values is None:
+                # Deleted, or gone by a way that wasn't recorded
+                deleted.append({"table_name": table.name, "row_id": id, "op": DELETE, "data": None})
+                continue
+            data = {column.key: _value(value) for column, value in zip(columns, values) if fields is None or column.key in fields}
+            if data or op == INSERT:
+                entries.append({"table_name": table.name, "row_id": id, "op": op, "data": data})
+
+    entries.extend(sorted(deleted, key=lambda entry: -MODELS.index(TABLE_NAMES[entry["table_name"]])))
+    if not entries:
+        return
+
+    record_changed_tables(session, {changes.name})
+    versions = bump_changed_tables(session)
+    changed_at = datetime.utcnow()
+    for entry in entries:
+        entry["version"] = versions.get(entry["table_name"], 0)
+        entry["changed_at"] = changed_at
+    connection.execute(insert(changes), entries)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_pending(session):
+    session.info.pop('changes', None)
+
+
+def _entry(row):
+    return {
+        "seq": row.seq,
+        "table": row.table_name,
+        "id": row.row_id,
+        "op": row.op,
+        "data": row.data,
+        "version": row.version,
+        "changed_at": row.changed_at,
+    }
+
+
+# Entries after since, oldest first, at most limit of them. Raises
+# LogTruncated when some of the entries after since have expired.
+def read(session, since, limit):
+    oldest = session.execute(select(changes.c.seq, changes.c.op).order_by(changes.c.seq).limit(1)).first()
+    if oldest is not None and oldest.op == EXPIRED and since < oldest.seq:
+        raise LogTruncated(f"Changes up to {oldest.seq} have expired")
+
+    rows = session.execute(select(changes).where(changes.c.seq > since).order_by(changes.c.seq).limit(limit))
+    return [_entry(row) for row in rows]
+
+
+class ChangeFeed:
+    # Wakes long polls when this process commits log entries
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.appended = 0
+
+    def notify(self, tables):
+        if changes.name in tables:
+            with self.condition:
+                self.appended += 1
+                self.condition.notify_all()
+
+    # Like read(), but waits up to timeout seconds for entries when there
+    # are none yet. The session is closed while waiting so it doesn't hold
+    # a read transaction open.
+    def wait(self, session, since, limit, timeout=0):
+        deadline = time.monotonic() + timeout
+        while True:
+            with self.condition:
+                appended = self.appended
+            entries = read(session, since, limit)
+            remaining = deadline - time.monotonic()
+            if entries or remaining <= 0:
+                return entries
+
+            session.close()
+            with self.condition:
+                if self.appended == appended:
+                    self.condition.wait(min(remaining, POLL_INTERVAL))
+
+
+feed = ChangeFeed()
+on_commit(feed.notify)
+
+
+# Folds the entries of each row up to seq cutoff into the row's last one,
+# and drops entries a later reset of their table makes moot. Consumers
+# behind the cutoff then get one entry per row with its latest values; an
+# insert followed by updates stays an insert. Returns the number of
+# entries dropped.
+def compact(session, cutoff):
+    connection = session.connection()
+    dropped = 0
+
+    resets = connection.execute(
+        select(changes.c.table_name, func.max(changes.c.seq))
+        .where(changes.c.op == RESET, changes.c.seq <= cutoff)
+        .group_by(changes.c.table_name)
+    ).all()
+    for name, seq in resets:
+        dropped += connection.execute(delete(changes).where(changes.c.table_name == name, changes.c.seq < seq)).rowcount
+
+    keys = connection.execute(
+        select(changes.c.table_name, changes.c.row_id)
+        .where(changes.c.seq <= cutoff, changes.c.row_id.is_not(None))
+        .group_by(changes.c.table_name, changes.c.row_id)
+        .having(func.count() > 1)
+    ).all()
+    for chunk in chunked(keys):
+        rows = connection.execute(
+            select(changes.c.seq, changes.c.table_name, changes.c.row_id, changes.c.op, changes.c.data)
+            .where(changes.c.seq <= cutoff, tuple_(changes.c.table_name, changes.c.row_id).in_(chunk))
+            .order_by(changes.c.table_name, changes.c.row_id, changes.c.seq)
+        )
+        folded = {}
+        superseded = []
+        for seq, name, row_id, op, data in rows:
+            previous = folded.get((name, row_id))
+            if previous is not None:
+                superseded.append(previous["kept"])
+                op, data = _fold(previous["merged_op"], previous["merged_data"], op, data)
+            folded[(name, row_id)] = {"kept": seq, "merged_op": op, "merged_data": data}
+
+        connection.execute(
+            update(changes)
+            .where(changes.c.seq == bindparam('kept'))
+            .values(op=bindparam('merged_op'), data=bindparam('merged_data')),
+            list(folded.values()),
+        )
+        for seqs in chunked(superseded):
+            dropped += connection.execute(delete(changes).where(changes.c.seq.in_(seqs))).rowcount
+
+    return dropped
+
+
+def _fold(op, data, later_op, later_data):
+    if later_op == DELETE:
+        return DELETE, None
+    if later_op == INSERT or op == DELETE:
+        return later_op, later_data
+    return op, {**data, **later_data}
+
+
+# Drops the entries made before the given time. The newest of them is kept
+# as an expired marker, so reads know the log no longer reaches back past
+# it. Returns the number of entries dropped.
+def expire(session, before):
+    connection = session.connection()
+    horizon = connection.scalar(select(func.max(changes.c.seq)).where(changes.c.changed_at < before))
+    if horizon is None:
+        return 0
+
+    dropped = connection.execute(delete(changes).where(changes.c.seq < horizon)).rowcount
+    connection.execute(
+        update(changes).where(changes.c.seq == horizon).values(table_name='*', row_id=None, op=EXPIRED, data=None)
+    )
+    return dropped
+
+
+@click.group('changes')
+def changes_cli():
+    """Manage the change log."""
+
+
+@changes_cli.command('compact')
+@click.option('--older-than', type=float, help='Fold entries older than this many seconds.  [default: CHANGES_COMPACT_AFTER]')
+@click.option('--retention-days', type=float, help='Drop entries older than this many days.  [default: CHANGES_RETENTION_DAYS]')
+@with_appcontext
+def compact_command(older_than, retention_days):
+    """Fold each row's older entries into one and drop expired entries."""
+    if older_than is None:
+        older_than = current_app.config.get('CHANGES_COMPACT_AFTER', 3600)
+    if retention_days is None:
+        retention_days = current_app.config.get('CHANGES_RETENTION_DAYS', 7)
+
+    started = time.perf_counter()
+    now = datetime.utcnow()
+    expired = expire(db.session, now - timedelta(days=retention_days))
+    cutoff = db.session.scalar(select(func.max(changes.c.seq)).where(changes.c.changed_at < now - timedelta(seconds=older_than)))
+    folded = compact(db.session, cutoff) if cutoff is not None else 0
+    db.session.commit()
+
+    remaining = db.session.scalar(select(func.count()).select_from(changes))
+    click.echo(f"expired {expired} and folded {folded} entries in {time.perf_counter() - started:.1f}s, {remaining} left")
@@ -0,0 +1,101 @@
+import zlib
+
+from flask import request
+
+from metrics import serializing
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_MIMETYPES = {'application/json', 'application/x-ndjson', 'application/msgpack'}
+
+
+class GzipEncoder:
+    def __init__(self, level):
+        self.compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def process(self, data):
+        return self.compressor.compress(data)
+
+    # Everything passed in so far, decodable without waiting for the rest
+    def flush(self):
+        return self.compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self.compressor.flush()
+
+
+class BrotliEncoder:
+    def __init__(self, quality):
+        self.compressor = brotli.Compressor(quality=quality)
+
+    def process(self, data):
+        return self.compressor.process(data)
+
+    def flush(self):
+        return self.compressor.flush()
+
+    def finish(self):
+        return self.compressor.finish()
+
+
+class Compression:
+    # Compresses JSON, NDJSON and MessagePack responses with brotli (when
+    # the brotli package is installed) or gzip, whichever the client's
+    # Accept-Encoding prefers. Bodies below COMPRESS_MIN_SIZE go out as
+    # they are; streamed responses are compressed chunk by chunk as they
+    # are sent, so memory stays flat, and each chunk is flushed so the
+    # client can decode it without waiting for the compressor's buffer to
+    # fill.
+    def __init__(self):
+        self.encodings = {}
+        self.min_size = 1024
+
+    def init_app(self, app):
+        self.min_size = app.config.get('COMPRESS_MIN_SIZE', 1024)
+        gzip_level = app.config.get('COMPRESS_GZIP_LEVEL', 6)
+        brotli_quality = app.config.get('COMPRESS_BROTLI_QUALITY', 4)
+
+        # In order of preference when the client accepts several equally
+        self.encodings = {}
+        if brotli is not None:
+            self.encodings['br'] = lambda: BrotliEncoder(brotli_quality)
+        self.encodings['gzip'] = lambda: GzipEncoder(gzip_level)
+        app.after_request(self._after_request)
+
+    def _after_request(self, response):
+        if response.mimetype not in COMPRESSIBLE_MIMETYPES or 'Content-Encoding' in response.headers:
+            return response
+        response.vary.add('Accept-Encoding')
+        if response.status_code != 200 or request.method == 'HEAD':
+            return response
+
+        encoding = request.accept_encodings.best_match(list(self.encodings))
+        if encoding is None:
+            return response
+
+        if response.is_streamed:
+            response.response = self._stream(self.encodings[encoding](), response.iter_encoded())
+            response.headers.pop('Content-Length', None)
+        else:
+            data = response.get_data()
+            if len(data) < self.min_size:
+                return response
+            with serializing():
+                encoder = self.encodings[encoding]()
+                response.set_data(encoder.process(data) + encoder.finish())
+
+        response.headers['Content-Encoding'] = encoding
+        return response
+
+    def _stream(self, encoder, chunks):
+        for chunk in chunks:
+            data = encoder.process(chunk) + encoder.flush()
+            if data:
+                yield data
+        yield encoder.finish()
+
+
+compression = Compression()
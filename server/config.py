@@ -0,0 +1,105 @@
+import os
+
+
+def env_bool(name, default):
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return value.lower() in ('1', 'true', 'yes', 'on')
+
+
+class Config:
+    SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL', 'sqlite:///app.db')
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # Used by the async read path instead of DATABASE_URL with its driver
+    # swapped for the asyncio one
+    ASYNC_DATABASE_URL = os.environ.get('ASYNC_DATABASE_URL')
+
+    # Connection pool, per worker process
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        'pool_size': int(os.environ.get('DB_POOL_SIZE', 10)),
+        'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 20)),
+        'pool_recycle': int(os.environ.get('DB_POOL_RECYCLE', 1800)),
+        'pool_pre_ping': env_bool('DB_POOL_PRE_PING', True),
+    }
+
+    # Applied to every new SQLite connection. WAL lets readers run while a
+    # write is in progress, and busy_timeout makes writers wait for the
+    # lock instead of failing straight away with "database is locked".
+    # SQLite only enforces foreign keys, and their ON DELETE CASCADE, when
+    # foreign_keys is on.
+    SQLITE_PRAGMAS = {
+        'foreign_keys': 'ON',
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'busy_timeout': int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 5000)),
+    }
+
+    # Read-only copies of the primary, comma separated. GET requests read
+    # from them once they have caught up with the client's last write;
+    # responses to writes carry the version to wait for in a cookie that
+    # lasts REPLICA_STICKY_SECONDS.
+    SQLALCHEMY_REPLICA_URLS = [url for url in os.environ.get('DATABASE_REPLICA_URLS', '').split(',') if url]
+    REPLICA_STICKY_SECONDS = int(os.environ.get('REPLICA_STICKY_SECONDS', 60))
+
+    # GET /changes long polls wait at most CHANGES_MAX_WAIT seconds.
+    # `flask changes compact` folds each row's entries older than
+    # CHANGES_COMPACT_AFTER seconds into one and drops entries older than
+    # CHANGES_RETENTION_DAYS.
+    CHANGES_MAX_WAIT = float(os.environ.get('CHANGES_MAX_WAIT', 25))
+    CHANGES_COMPACT_AFTER = float(os.environ.get('CHANGES_COMPACT_AFTER', 3600))
+    CHANGES_RETENTION_DAYS = float(os.environ.get('CHANGES_RETENTION_DAYS', 7))
+
+    CACHE_MAX_ENTRIES = int(os.environ.get('CACHE_MAX_ENTRIES', 1024))
+    CACHE_TTL = int(os.environ.get('CACHE_TTL', 60))
+    CACHE_REDIS_URL = os.environ.get('CACHE_REDIS_URL')
+
+    # Responses smaller than this are sent uncompressed. Brotli quality 4
+    # and gzip level 6 trade some ratio for encoding speed on dynamic
+    # payloads.
+    COMPRESS_MIN_SIZE = int(os.environ.get('COMPRESS_MIN_SIZE', 1024))
+    COMPRESS_GZIP_LEVEL = int(os.environ.get('COMPRESS_GZIP_LEVEL', 6))
+    COMPRESS_BROTLI_QUALITY = int(os.environ.get('COMPRESS_BROTLI_QUALITY', 4))
+
+    N_PLUS_ONE_THRESHOLD = int(os.environ.get('N_PLUS_ONE_THRESHOLD', 20))
+
+    # Write-behind grade queue (grades.py): a batch is written once this
+    # many enrollments are waiting or the oldest has waited the interval
+    # (seconds). A full queue makes requests wait up to the timeout, then
+    # fail with 503.
+    GRADE_QUEUE_SIZE = int(os.environ.get('GRADE_QUEUE_SIZE', 50000))
+    GRADE_BATCH_SIZE = int(os.environ.get('GRADE_BATCH_SIZE', 1000))
+    GRADE_FLUSH_INTERVAL = float(os.environ.get('GRADE_FLUSH_INTERVAL', 0.2))
+    GRADE_ENQUEUE_TIMEOUT = float(os.environ.get('GRADE_ENQUEUE_TIMEOUT', 2.0))
+
+
+class DevelopmentConfig(Config):
+    DEBUG = True
+
+
+class ProductionConfig(Config):
+    DEBUG = False
+
+
+class TestingConfig(Config):
+    TESTING = True
+    SQLALCHEMY_DATABASE_URI = os.environ.get('TEST_DATABASE_URL', 'sqlite://')
+    SQLALCHEMY_REPLICA_URLS = [url for url in os.environ.get('TEST_DATABASE_REPLICA_URLS', '').split(',') if url]
+    # An in-memory SQLite database lives in a single shared connection, so
+    # there is no pool to size
+    SQLALCHEMY_ENGINE_OPTIONS = {}
+    # ...which is also why grades are written by the request that queues
+    # them rather than by a background thread
+    GRADE_WRITE_BEHIND = False
+
+
+configs = {
+    'development': DevelopmentConfig,
+    'production': ProductionConfig,
+    'testing': TestingConfig,
+}
+
+
+# Config class for the given profile name, or the APP_ENV environment variable
+def get_config(name=None):
+    return configs[name or os.environ.get('APP_ENV', 'development')]
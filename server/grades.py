@@ -0,0 +1,273 @@
+# Write-behind queue for grade updates. Requests put (enrollment id, grade)
+# pairs in an in-process queue and return straight away; a background
+# thread writes them out in batches, each batch one executemany UPDATE in
+# one transaction, instead of one transaction per grade. Updates to an
+# enrollment still waiting in the queue replace its pending grade, so only
+# the latest one is written. A batch goes out once GRADE_BATCH_SIZE
+# enrollments are waiting or the oldest has waited GRADE_FLUSH_INTERVAL
+# seconds. The queue holds at most GRADE_QUEUE_SIZE enrollments; when it is
+# full, callers wait up to GRADE_ENQUEUE_TIMEOUT seconds for room and then
+# get QueueFull. Whatever is queued is written when the process exits.
+# Updates the database refuses outright (a constraint or a bad value) are
+# dropped and counted rather than retried; other failures are retried.
+import atexit
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+from sqlalchemy.exc import DataError, IntegrityError
+
+from models import db, Enrollment
+
+logger = logging.getLogger(__name__)
+
+RECENT_FLUSHES = 1000
+RETRY_DELAY = 1.0
+
+
+class QueueFull(Exception):
+    pass
+
+
+class GradeQueue:
+    def __init__(self):
+        self.app = None
+        self.condition = threading.Condition()
+        # enrollment id -> (grade, time it was first queued), oldest first
+        self.pending = {}
+        self.worker = None
+        self.worker_pid = None
+        self.stopping = False
+        self.flushing = 0
+        self.exit_registered = False
+
+        self.enqueued = 0
+        self.coalesced = 0
+        self.written = 0
+        self.batches = 0
+        self.rejected = 0
+        self.failures = 0
+        self.dropped = 0
+        self.last_error = None
+        self.dropped_ids = deque(maxlen=RECENT_FLUSHES)
+        self.flush_times = deque(maxlen=RECENT_FLUSHES)
+        self.wait_times = deque(maxlen=RECENT_FLUSHES)
+
+    def init_app(self, app):
+        self.app = app
+        self.max_size = app.config.get('GRADE_QUEUE_SIZE', 50000)
+        self.batch_size = app.config.get('GRADE_BATCH_SIZE', 1000)
+        self.flush_interval = app.config.get('GRADE_FLUSH_INTERVAL', 0.2)
+        self.enqueue_timeout = app.config.get('GRADE_ENQUEUE_TIMEOUT', 2.0)
+        # Without a worker every put() is written before it returns, for
+        # the in-memory test database whose one connection can't be shared
+        self.write_behind = app.config.get('GRADE_WRITE_BEHIND', True)
+        # Once per queue, however many apps it is set up with
+        if not self.exit_registered:
+            atexit.register(self.shutdown)
+            self.exit_registered = True
+
+    # Queues grades, a dict of enrollment id -> grade. Waits for room when
+    # the queue is full and raises QueueFull if none frees up in time.
+    def put(self, grades):
+        if not self.write_behind:
+            self._write_or_drop([(id, grade, time.monotonic()) for id, grade in grades.items()])
+            with self.condition:
+                self.enqueued += len(grades)
+            return
+
+        deadline = time.monotonic() + self.enqueue_timeout
+        with self.condition:
+            self._start_worker()
+            while len(self.pending) + sum(id not in self.pending for id in grades) > self.max_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or self.stopping:
+                    self.rejected += len(grades)
+                    raise QueueFull(f"{len(self.pending)} grade updates are waiting to be written")
+                self.condition.wait(remaining)
+
+            now = time.monotonic()
+            for id, grade in grades.items():
+                queued = self.pending.get(id)
+                if queued is None:
+                    self.pending[id] = (grade, now)
+                else:
+                    self.pending[id] = (grade, queued[1])
+                    self.coalesced += 1
+            self.enqueued += len(grades)
+            self.condition.notify_all()
+
+    # Blocks until everything queued so far has been written
+    def join(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.condition:
+            while self.pending or self.flushing:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self.condition.wait(remaining)
+        return True
+
+    # Writes out everything still queued and stops the worker
+    def shutdown(self, timeout=30):
+        with self.condition:
+            self.stopping = True
+            self.condition.notify_all()
+            worker = self.worker
+        if worker is not None and worker.is_alive():
+            worker.join(timeout)
+            if worker.is_alive():
+                logger.error("gave up writing grade updates after %ss, %d are lost", timeout, len(self.pending))
+        with self.condition:
+            self.worker = None
+            self.stopping = False
+
+    def stats(self):
+        with self.condition:
+            flush_times = sorted(self.flush_times)
+            wait_times = sorted(self.wait_times)
+            oldest = next(iter(self.pending.values()), None)
+            return {
+                "depth": len(self.pending),
+                "capacity": self.max_size,
+                "oldest_ms": round((time.monotonic() - oldest[1]) * 1000, 3) if oldest else None,
+                "enqueued": self.enqueued,
+                "coalesced": self.coalesced,
+                "written": self.written,
+                "batches": self.batches,
+                "rejected": self.rejected,
+                "failures": self.failures,
+                "dropped": self.dropped,
+                "dropped_ids": list(self.dropped_ids),
+                "last_error": self.last_error,
+                "flush_ms": _percentiles(flush_times),
+                "queued_ms": _percentiles(wait_times),
+            }
+
+    # Gauges and counters in the Prometheus text format, for GET /metrics
+    def metric_lines(self):
+        stats = self.stats()
+        lines = ["# TYPE grade_queue_depth gauge", f"grade_queue_depth {stats['depth']}"]
+        for name in ('enqueued', 'coalesced', 'written', 'batches', 'rejected', 'failures', 'dropped'):
+            lines.append(f"# TYPE grade_queue_{name}_total counter")
+            lines.append(f"grade_queue_{name}_total {stats[name]}")
+        for name, unit in (('flush_ms', 'flush'), ('queued_ms', 'queued')):
+            lines.append(f"# TYPE grade_queue_{unit}_seconds summary")
+            for quantile, key in (('0.5', 'p50'), ('0.95', 'p95'), ('0.99', 'p99')):
+                value = stats[name][key]
+                if value is not None:
+                    lines.append(f'grade_queue_{unit}_seconds{{quantile="{quantile}"}} {value / 1000}')
+        return lines
+
+    # Starts the worker in this process if it isn't running. Called with
+    # the condition held, on first use, so forked server workers each get
+    # their own.
+    def _start_worker(self):
+        if self.worker is not None and self.worker_pid == os.getpid() and self.worker.is_alive():
+            return
+        self.worker = threading.Thread(target=self._run, name='grade-queue', daemon=True)
+        self.worker_pid = os.getpid()
+        self.worker.start()
+
+    def _run(self):
+        while True:
+            with self.condition:
+                batch = self._next_batch()
+                if batch is None:
+                    return
+                self.flushing += 1
+            try:
+                self._write_or_drop(batch)
+            except Exception as error:
+                logger.exception("writing %d grade updates failed, retrying", len(batch))
+                with self.condition:
+                    self.failures += 1
+                    self.last_error = str(error)
+                    # Put the batch back, behind nothing newer for the same enrollments
+                    requeued = {id: (grade, queued) for id, grade, queued in batch if id not in self.pending}
+                    self.pending = {**requeued, **self.pending}
+                # Also while stopping, so a database that stays down doesn't
+                # spin until shutdown gives up
+                time.sleep(RETRY_DELAY)
+            finally:
+                with self.condition:
+                    self.flushing -= 1
+                    self.condition.notify_all()
+
+    # Waits for a batch to be due and takes it from the queue: up to
+    # batch_size enrollments, oldest first. Returns None once stopping with
+    # nothing left. Called with the condition held.
+    def _next_batch(self):
+        while not self.pending:
+            if self.stopping:
+                return None
+            self.condition.wait()
+
+        while len(self.pending) < self.batch_size and not self.stopping:
+            oldest = next(iter(self.pending.values()))[1]
+            remaining = oldest + self.flush_interval - time.monotonic()
+            if remaining <= 0:
+                break
+            self.condition.wait(remaining)
+
+        batch = []
+        for id in list(self.pending)[:self.batch_size]:
+            grade, queued = self.pending.pop(id)
+            batch.append((id, grade, queued))
+        self.condition.notify_all()
+        return batch
+
+    # Writes a batch, and when the database refuses it for good (a
+    # constraint or a bad value) writes its halves separately, down to the
+    # single updates it refuses, which are dropped. Other errors are raised
+    # for _run to retry the batch.
+    def _write_or_drop(self, batch):
+        try:
+            self._write(batch)
+        except (IntegrityError, DataError) as error:
+            if len(batch) > 1:
+                middle = len(batch) // 2
+                self._write_or_drop(batch[:middle])
+                self._write_or_drop(batch[middle:])
+                return
+            id, grade, _ = batch[0]
+            logger.error("dropping grade %r for enrollment %s: %s", grade, id, error)
+            with self.condition:
+                self.dropped += 1
+                self.dropped_ids.append(id)
+                self.last_error = str(error)
+
+    # One transaction: a single executemany UPDATE by id. Enrollments
+    # deleted since their grade was queued are skipped by the WHERE.
+    def _write(self, batch):
+        started = time.monotonic()
+        with self.app.app_context():
+            try:
+                Enrollment.update_many([{"id": id, "grade": grade} for id, grade, _ in batch])
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                raise
+            finally:
+                db.session.remove()
+
+        finished = time.monotonic()
+        with self.condition:
+            self.written += len(batch)
+            self.batches += 1
+            self.flush_times.append(finished - started)
+            self.wait_times.extend(finished - queued for _, _, queued in batch)
+
+
+def _percentiles(sorted_values):
+    if not sorted_values:
+        return {"p50": None, "p95": None, "p99": None, "max": None}
+
+    def at(fraction):
+        return round(sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))] * 1000, 3)
+    return {"p50": at(0.50), "p95": at(0.95), "p99": at(0.99), "max": round(sorted_values[-1] * 1000, 3)}
+
+
+grade_queue = GradeQueue()
@@ -0,0 +1,41 @@
+# Multi-process, multi-threaded serving. Every worker process has its own
+# SQLAlchemy connection pool (DB_POOL_SIZE + DB_MAX_OVERFLOW connections),
+# so keep workers * threads within what the database can serve.
+#
+# With preload_app (WEB_PRELOAD, on by default) the master imports the app
+# and configures its mappers once, and workers fork from it already warm.
+# Code changes then need a restart rather than a HUP.
+import gc
+import multiprocessing
+import os
+
+bind = os.environ.get('BIND', '0.0.0.0:5555')
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.environ.get('WEB_THREADS', 4))
+worker_class = 'gthread'
+timeout = int(os.environ.get('WEB_TIMEOUT', 30))
+keepalive = 5
+accesslog = '-'
+preload_app = os.environ.get('WEB_PRELOAD', 'true').lower() in ('1', 'true', 'yes')
+
+
+# Moves everything the master has built so far out of the garbage
+# collector's reach, so collections in the workers don't write to those
+# objects and unshare the pages they live on
+def pre_fork(server, worker):
+    gc.freeze()
+
+
+# Connections can't be shared across a fork. The master shouldn't have
+# opened any, but drop whatever pools it handed down without closing
+# their connections from under it.
+def post_fork(server, worker):
+    if not server.cfg.preload_app:
+        return
+    from models import db
+
+    # The app the master loaded
+    app = server.app.wsgi()
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=False)
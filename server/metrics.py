@@ -0,0 +1,172 @@
+import logging
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+from flask import g, has_app_context, request, Response
+from sqlalchemy import event
+
+from models import upkeep
+
+logger = logging.getLogger(__name__)
+
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (1, 2, 3, 5, 10, 20, 50, 100, 200, 500, 1000)
+ROW_BUCKETS = (1, 10, 100, 1000, 10000, 100000, 1000000)
+
+
+class RequestMetrics:
+    # What one request spent its time on, kept in flask.g while it runs
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.upkeep_queries = 0
+        self.sql_time = 0.0
+        self.serialize_time = 0.0
+        self.rows = 0
+
+
+class Histogram:
+    # Cumulative histogram per label value, in the Prometheus text format
+    def __init__(self, name, help, buckets):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        self.series = {}
+
+    def observe(self, label, value):
+        counts, total = self.series.get(label, ([0] * (len(self.buckets) + 1), 0))
+        counts[bisect_left(self.buckets, value)] += 1
+        self.series[label] = (counts, total + value)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for label, (counts, total) in sorted(self.series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{endpoint="{label}",le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_sum{{endpoint="{label}"}} {total}')
+            lines.append(f'{self.name}_count{{endpoint="{label}"}} {cumulative}')
+        return lines
+
+
+class Metrics:
+    # Records per-request query count, SQL time, serialization time and
+    # row counts. Each response gets a Server-Timing header, the values are
+    # aggregated into histograms per endpoint for GET /metrics, and requests
+    # issuing more than N_PLUS_ONE_THRESHOLD statements of their own, not
+    # counting the commit-time upkeep in models.upkeep, are logged.
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = [
+            Histogram('request_duration_seconds', 'Time spent handling the request', DURATION_BUCKETS),
+            Histogram('sql_duration_seconds', 'Time spent executing SQL per request', DURATION_BUCKETS),
+            Histogram('sql_queries_per_request', 'SQL statements executed per request', COUNT_BUCKETS),
+            Histogram('serialize_duration_seconds', 'Time spent building and encoding payloads per request', DURATION_BUCKETS),
+            Histogram('rows_per_request', 'Result rows serialized per request', ROW_BUCKETS),
+        ]
+        self.extra_sources = []
+
+    # Times statements on the given engines: the primary and any replicas
+    def init_app(self, app, *engines):
+        self.threshold = app.config.get('N_PLUS_ONE_THRESHOLD', 20)
+        for engine in engines:
+            event.listen(engine, 'before_cursor_execute', self._before_cursor_execute)
+            event.listen(engine, 'after_cursor_execute', self._after_cursor_execute)
+            event.listen(engine, 'handle_error', self._handle_error)
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+
+    # Adds lines produced by source() to the /metrics output
+    def add_source(self, source):
+        self.extra_sources.append(source)
+
+    def render(self):
+        with self.lock:
+            lines = [line for histogram in self.histograms for line in histogram.render()]
+        for source in self.extra_sources:
+            lines.extend(source())
+        return Response('\n'.join(lines) + '\n', mimetype='text/plain; version=0.0.4')
+
+    def _before_request(self):
+        g.request_metrics = RequestMetrics()
+
+    def _after_request(self, response):
+        current = g.pop('request_metrics', None)
+        if current is None:
+            return response
+
+        elapsed = time.perf_counter() - current.started
+        response.headers['Server-Timing'] = ', '.join([
+            f'sql;dur={current.sql_time * 1000:.2f};desc="{current.queries} queries"',
+            f'serialize;dur={current.serialize_time * 1000:.2f};desc="{current.rows} rows"',
+            f'total;dur={elapsed * 1000:.2f}',
+        ])
+
+        endpoint = request.endpoint or 'unmatched'
+        with self.lock:
+            for histogram, value in zip(
+                self.histograms,
+                (elapsed, current.sql_time, current.queries, current.serialize_time, current.rows),
+            ):
+                histogram.observe(endpoint, value)
+
+        own = current.queries - current.upkeep_queries
+        if own > self.threshold:
+            logger.warning(
+                "%s %s issued %d SQL statements plus %d for upkeep (threshold %d), possible N+1 query",
+                request.method, request.full_path.rstrip('?'), own, current.upkeep_queries, self.threshold,
+            )
+        return response
+
+    # The start time goes on the statement's execution context, which is
+    # dropped with the statement whether it succeeds or fails
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if context is not None:
+            context._query_started = time.perf_counter()
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self._record_statement(context)
+
+    # Statements that raise, e.g. on an IntegrityError, count too
+    def _handle_error(self, exception_context):
+        self._record_statement(exception_context.execution_context)
+
+    def _record_statement(self, context):
+        started = getattr(context, '_query_started', None)
+        if started is None:
+            return
+        context._query_started = None
+        current = _current()
+        if current is not None:
+            current.queries += 1
+            current.upkeep_queries += upkeep.get()
+            current.sql_time += time.perf_counter() - started
+
+
+def _current():
+    return g.get('request_metrics') if has_app_context() else None
+
+
+# Times a block of payload building or encoding for the current request
+@contextmanager
+def serializing():
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        current = _current()
+        if current is not None:
+            current.serialize_time += time.perf_counter() - started
+
+
+# Counts result rows serialized for the current request
+def count_rows(count):
+    current = _current()
+    if current is not None:
+        current.rows += count
+
+
+metrics = Metrics()
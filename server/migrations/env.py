@@ -7,6 +7,8 @@ from flask import current_app
 
 from alembic import context
 
+from search import SEARCH_TABLE
+
 # this is the Alembic Config object, which provides
 # access to the values within the .ini file in use.
 config = context.config
@@ -71,19 +73,39 @@ def run_migrations_online():
                 directives[:] = []
                 logger.info('No changes in schema detected.')
 
+    # The full-text search index is an SQLite virtual table (plus the shadow
+    # tables FTS5 keeps its data in) created outside the models' metadata,
+    # so autogenerate must not propose dropping it
+    def include_name(name, type_, parent_names):
+        return not (type_ == 'table' and name.startswith(SEARCH_TABLE))
+
     connectable = current_app.extensions['migrate'].db.get_engine()
 
     with connectable.connect() as connection:
+        # Batch operations on SQLite copy a table and drop the original.
+        # With foreign keys enforced, dropping a parent table deletes or
+        # rejects the rows referencing it, so migrations run without them.
+        # The pragma has no effect inside a transaction, hence the commits.
+        sqlite = connection.dialect.name == 'sqlite'
+        if sqlite:
+            connection.exec_driver_sql('PRAGMA foreign_keys=OFF')
+            connection.commit()
+
         context.configure(
             connection=connection,
             target_metadata=target_metadata,
             process_revision_directives=process_revision_directives,
+            include_name=include_name,
             **current_app.extensions['migrate'].configure_args
         )
 
         with context.begin_transaction():
             context.run_migrations()
 
+        if sqlite:
+            connection.exec_driver_sql('PRAGMA foreign_keys=ON')
+            connection.commit()
+
 
 if context.is_offline_mode():
     run_migrations_offline()
@@ -0,0 +1,40 @@
+"""Index enrollment and course foreign keys
+
+Revision ID: 3f1a2c7b9e41
+Revises: d9c5d894b0be
+Create Date: 2026-10-17 09:12:44.518203
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f1a2c7b9e41'
+down_revision = 'd9c5d894b0be'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Keep the oldest row of any duplicated enrollment so the unique constraint can be created
+    op.execute(
+        "DELETE FROM enrollments WHERE id NOT IN "
+        "(SELECT MIN(id) FROM enrollments GROUP BY student_id, course_id)"
+    )
+
+    with op.batch_alter_table('enrollments', schema=None) as batch_op:
+        batch_op.create_unique_constraint('uq_enrollments_student_id_course_id', ['student_id', 'course_id'])
+        batch_op.create_index(batch_op.f('ix_enrollments_course_id'), ['course_id'], unique=False)
+
+    with op.batch_alter_table('courses', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_courses_instructor_id'), ['instructor_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('courses', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_courses_instructor_id'))
+
+    with op.batch_alter_table('enrollments', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_enrollments_course_id'))
+        batch_op.drop_constraint('uq_enrollments_student_id_course_id', type_='unique')
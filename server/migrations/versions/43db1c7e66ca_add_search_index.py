@@ -0,0 +1,41 @@
+"""Add search index
+
+Creates the search_index FTS5 table on SQLite and fills it from the
+students, courses and instructors already stored. Other databases have no
+index; /search scans the tables with LIKE there.
+
+Revision ID: 43db1c7e66ca
+Revises: 33403edb9c72
+Create Date: 2026-10-18 00:34:12.408153
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '43db1c7e66ca'
+down_revision = '33403edb9c72'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+
+    op.execute(
+        "CREATE VIRTUAL TABLE search_index "
+        "USING fts5(name, detail, tokenize='unicode61', prefix='2 3')"
+    )
+    # rowid = id * 4 + 1 for students, 2 for courses, 3 for instructors
+    op.execute("INSERT INTO search_index (rowid, name, detail) SELECT id * 4 + 1, name, email FROM students")
+    op.execute("INSERT INTO search_index (rowid, name, detail) SELECT id * 4 + 2, title, NULL FROM courses")
+    op.execute("INSERT INTO search_index (rowid, name, detail) SELECT id * 4 + 3, name, NULL FROM instructors")
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+
+    op.execute("DROP TABLE search_index")
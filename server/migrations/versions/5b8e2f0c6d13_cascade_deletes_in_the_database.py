@@ -0,0 +1,52 @@
+"""Cascade deletes in the database
+
+Foreign keys from profiles, courses and enrollments to their parents get
+ON DELETE CASCADE, so deleting a student, instructor or course removes its
+children without the ORM loading them. Rows already orphaned by deletes
+made while SQLite did not enforce foreign keys are removed first.
+
+Revision ID: 5b8e2f0c6d13
+Revises: 32ced05af8cf
+Create Date: 2026-10-18 01:12:37.640215
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5b8e2f0c6d13'
+down_revision = '32ced05af8cf'
+branch_labels = None
+depends_on = None
+
+# (table, constraint, column, referred table), parents before children
+FOREIGN_KEYS = [
+    ('courses', 'fk_courses_instructor_id_instructors', 'instructor_id', 'instructors'),
+    ('profiles', 'fk_profiles_student_id_students', 'student_id', 'students'),
+    ('enrollments', 'fk_enrollments_student_id_students', 'student_id', 'students'),
+    ('enrollments', 'fk_enrollments_course_id_courses', 'course_id', 'courses'),
+]
+
+
+def replace_foreign_keys(ondelete):
+    for table in dict.fromkeys(table for table, _, _, _ in FOREIGN_KEYS):
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            for fk_table, name, column, referred in FOREIGN_KEYS:
+                if fk_table == table:
+                    batch_op.drop_constraint(name, type_='foreignkey')
+                    batch_op.create_foreign_key(name, referred, [column], ['id'], ondelete=ondelete)
+
+
+def upgrade():
+    for table, _, column, referred in FOREIGN_KEYS:
+        op.execute(
+            f"DELETE FROM {table} WHERE {column} IS NOT NULL "
+            f"AND {column} NOT IN (SELECT id FROM {referred})"
+        )
+
+    replace_foreign_keys('CASCADE')
+
+
+def downgrade():
+    replace_foreign_keys(None)
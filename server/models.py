@@ -1,166 +1,557 @@
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import MetaData
-from sqlalchemy_serializer import SerializerMixin
+from flask_sqlalchemy.session import Session as FlaskSession
+from sqlalchemy import MetaData, select, func, event, bindparam
+from sqlalchemy.sql.dml import UpdateBase
+from sqlalchemy.orm import Session
 from sqlalchemy.ext.associationproxy import association_proxy
+from contextvars import ContextVar
 from datetime import datetime
+from itertools import chain
 
 metadata = MetaData(naming_convention={
+    "ix": "ix_%(column_0_label)s",
     "fk": "fk_%(table_name)s_%(column_0_name)s_%(referred_table_name)s",
 })
 
 
-db = SQLAlchemy(metadata=metadata)
-
-class Student(db.Model, SerializerMixin):
+# Sends reads to the engine in session.info['replica'] when a request set
+# one (see replicas.py). Flushes and INSERT/UPDATE/DELETE statements always
+# go to the primary.
+class RoutingSession(FlaskSession):
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        replica = self.info.get('replica')
+        if replica is not None and bind is None and not self._flushing and not isinstance(clause, UpdateBase):
+            return replica
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+db = SQLAlchemy(metadata=metadata, session_options={"class_": RoutingSession})
+
+
+# Runs the given PRAGMA statements on every new SQLite connection
+def enable_sqlite_pragmas(engine, pragmas):
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
+
+
+_commit_listeners = []
+_commit_steps = []
+
+
+# Registers a callback run after every commit with the set of table
+# names the committed transaction wrote to
+def on_commit(callback):
+    _commit_listeners.append(callback)
+
+
+# Registers step(session) to run just before every commit. Steps run in
+# ascending order: seats.py first, since it can add enrollments, then the
+# read models, then the change log last. The versions of the tables the
+# transaction wrote are bumped after the last step.
+def before_commit(order):
+    def register(step):
+        _commit_steps.append((order, step))
+        _commit_steps.sort(key=lambda item: item[0])
+        return step
+    return register
+
+
+# Remembers the tables a transaction wrote to, for bump_changed_tables.
+# Called automatically for writes made through the session; code writing
+# through session.connection() calls it itself.
+def record_changed_tables(session, tables):
+    tables = set(tables) - {TableVersion.__tablename__}
+    if tables:
+        session.info.setdefault('changed_tables', set()).update(tables)
+
+
+# Bumps the versions of the tables the transaction wrote, all in one
+# statement, and returns the versions by table name. Each table is bumped
+# once per transaction: all its writes become visible together, so they
+# share the version. Runs after the last before_commit step; the change log
+# calls it earlier for the versions of its entries.
+def bump_changed_tables(session):
+    versions = session.info.setdefault('table_versions', {})
+    unbumped = session.info.get('changed_tables', set()) - set(versions)
+    if unbumped:
+        versions.update(TableVersion.bump(session.connection(), unbumped))
+    return versions
+
+
+# Columns an UPDATE run through session.execute() sets, from the keys of
+# its parameters, or None when it has none and the columns aren't known
+def updated_columns(execute_state):
+    parameters = execute_state.parameters
+    if isinstance(parameters, dict):
+        parameters = [parameters]
+    if not parameters:
+        return None
+    return set(parameters[0]) & set(execute_state.statement.table.c.keys())
+
+
+# The given tables plus every table the database deletes rows from along
+# with theirs, following ON DELETE CASCADE foreign keys
+def cascaded_tables(tables):
+    found = set(tables)
+    pending = list(found)
+    while pending:
+        name = pending.pop()
+        for table in metadata.tables.values():
+            if table.name not in found and any(
+                fk.ondelete == 'CASCADE' and fk.column.table.name == name for fk in table.foreign_keys
+            ):
+                found.add(table.name)
+                pending.append(table.name)
+    return found
+
+
+# Tables touched through the unit of work (add, attribute changes, delete).
+# Deletes reach further than the objects in the session because the
+# database cascades them to child rows the session never loaded.
+@event.listens_for(Session, 'after_flush')
+def _record_flushed_tables(session, flush_context):
+    tables = {obj.__table__.name for obj in chain(session.new, session.dirty)}
+    tables |= cascaded_tables({obj.__table__.name for obj in session.deleted})
+    record_changed_tables(session, tables)
+
+
+# Tables touched by INSERT/UPDATE/DELETE statements run through session.execute()
+@event.listens_for(Session, 'do_orm_execute')
+def _record_executed_tables(execute_state):
+    if execute_state.is_insert or execute_state.is_update or execute_state.is_delete:
+        table = getattr(execute_state.statement, 'table', None)
+        if table is not None:
+            tables = cascaded_tables({table.name}) if execute_state.is_delete else {table.name}
+            record_changed_tables(execute_state.session, tables)
+
+
+# True while the before_commit steps run. Their statements are a fixed
+# amount of upkeep per commit, read in chunks rather than per row, so
+# metrics.py leaves them out of the N+1 warning.
+upkeep = ContextVar('upkeep', default=False)
+
+
+@event.listens_for(Session, 'before_commit')
+def _run_commit_steps(session):
+    token = upkeep.set(True)
+    try:
+        for _, step in _commit_steps:
+            step(session)
+        bump_changed_tables(session)
+    finally:
+        upkeep.reset(token)
+
+
+# Rows the upkeep of a write reads just before it runs: the seats, reports,
+# schedules and change log listeners each need them for the same statement
+# or flush. Each lookup is read once and kept until the next statement or
+# flush starts, so these are only for do_orm_execute and before_flush
+# listeners. The lookups are dropped here, by listeners registered before
+# those of the other modules.
+@event.listens_for(Session, 'do_orm_execute')
+def _drop_executed_lookups(execute_state):
+    execute_state.session.info.pop('write_lookups', None)
+
+
+@event.listens_for(Session, 'before_flush')
+def _drop_flushed_lookups(session, flush_context, instances):
+    session.info.pop('write_lookups', None)
+
+
+def _lookup(session, key, read):
+    lookups = session.info.setdefault('write_lookups', {})
+    if key not in lookups:
+        lookups[key] = read(session.connection())
+    return lookups[key]
+
+
+# (id, course_id, student_id, grade) of the enrollments whose column holds
+# one of ids
+def enrollments_where(session, column, ids):
+    column = Enrollment.__table__.c[column.key]
+    ids = tuple(sorted({id for id in ids if id is not None}))
+
+    def read(connection):
+        rows = []
+        for chunk in chunked(ids):
+            rows.extend(connection.execute(
+                select(Enrollment.id, Enrollment.course_id, Enrollment.student_id, Enrollment.grade).where(column.in_(chunk))
+            ).all())
+        return rows
+    return _lookup(session, (column.table.name, column.key, ids), read)
+
+
+# Ids of the rows whose column holds one of parent_ids, e.g. the rows the
+# database deletes along with those parents by ON DELETE CASCADE
+def child_ids(session, column, parent_ids):
+    if column.table is Enrollment.__table__:
+        return [row.id for row in enrollments_where(session, column, parent_ids)]
+
+    table = column.table
+    column = table.c[column.key]
+    parent_ids = tuple(sorted({id for id in parent_ids if id is not None}))
+
+    def read(connection):
+        ids = []
+        for chunk in chunked(parent_ids):
+            ids.extend(connection.scalars(select(table.c.id).where(column.in_(chunk))))
+        return ids
+    return _lookup(session, (table.name, column.key, parent_ids), read)
+
+
+# The table versions a commit wrote are kept as committed_versions, for
+# read-your-writes routing in replicas.py
+@event.listens_for(Session, 'after_commit')
+def _notify_commit_listeners(session):
+    versions = session.info.pop('table_versions', None)
+    if versions:
+        session.info['committed_versions'] = versions
+    tables = session.info.pop('changed_tables', None)
+    if tables:
+        for callback in _commit_listeners:
+            callback(tables)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_changed_tables(session):
+    session.info.pop('changed_tables', None)
+    session.info.pop('table_versions', None)
+
+
+IN_CLAUSE_CHUNK = 500
+
+
+# Splits values into lists of at most size items, keeping IN clauses
+# below the database's bound parameter limit
+def chunked(values, size=IN_CLAUSE_CHUNK):
+    values = list(values)
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+class QueryMixin:
+    # Names that can be requested through a column projection
+    @classmethod
+    def projectable_fields(cls):
+        return list(cls.__mapper__.column_attrs.keys())
+
+    # Columns only the application itself writes
+    read_only_fields = ()
+
+    # Columns that can be written through an update: all but the primary
+    # key and read_only_fields
+    @classmethod
+    def updatable_fields(cls):
+        return [
+            column.key for column in cls.__table__.columns
+            if not column.primary_key and column.key not in cls.read_only_fields
+        ]
+
+    # UPDATE of one row by id, without loading it first. Returns the row as
+    # updated, or None when the id does not exist. The row_ids execution
+    # option tells session listeners exactly which rows were written, and
+    # the values go in as parameters so they can see which columns.
+    @classmethod
+    def update_by_id(cls, id, values):
+        table = cls.__table__
+        statement = table.update().where(table.c.id == id)
+        options = {"row_ids": [id]}
+
+        if db.engine.dialect.update_returning:
+            return db.session.execute(statement.returning(*table.columns), values, execution_options=options).first()
+
+        if db.session.execute(statement, values, execution_options=options).rowcount == 0:
+            return None
+        return db.session.execute(select(*table.columns).where(table.c.id == id)).first()
+
+    # UPDATEs many rows by id in one executemany. Each row is a dict of the
+    # id and the columns to set, and all rows must set the same columns.
+    @classmethod
+    def update_many(cls, rows):
+        table = cls.__table__
+        statement = table.update().where(table.c.id == bindparam('row_id'))
+        parameters = [{"row_id": row["id"], **{k: v for k, v in row.items() if k != "id"}} for row in rows]
+        db.session.execute(statement, parameters, execution_options={"row_ids": [row["id"] for row in rows]})
+
+    # DELETEs rows by id, one statement per chunk of ids, and leaves child
+    # rows to the database's ON DELETE CASCADE. Returns the ids that existed.
+    @classmethod
+    def delete_by_ids(cls, ids):
+        table = cls.__table__
+        deleted = []
+        for chunk in chunked(ids):
+            statement = table.delete().where(table.c.id.in_(chunk))
+            options = {"row_ids": chunk}
+
+            if db.engine.dialect.delete_returning:
+                deleted.extend(db.session.scalars(statement.returning(table.c.id), execution_options=options))
+            else:
+                deleted.extend(db.session.scalars(select(table.c.id).where(table.c.id.in_(chunk))))
+                db.session.execute(statement, execution_options=options)
+        return deleted
+
+    # SELECT of only the given columns (id is always included)
+    @classmethod
+    def projection(cls, fields):
+        names = ['id'] + [f for f in fields if f != 'id']
+        return select(*[cls.__mapper__.column_attrs[name].class_attribute for name in names])
+
+    # Restricts the statement to one keyset page: ids after the cursor, in
+    # order, fetching one extra row to tell whether another page follows
+    @classmethod
+    def keyset_statement(cls, statement, after=None, limit=None):
+        if after is not None:
+            statement = statement.where(cls.id > after)
+        statement = statement.order_by(cls.id)
+
+        if limit is not None:
+            statement = statement.limit(limit + 1)
+        return statement
+
+    # Splits the rows of a keyset_statement() into (rows, next_cursor)
+    @staticmethod
+    def split_page(rows, limit):
+        if limit is not None and len(rows) > limit:
+            return rows[:limit], rows[limit - 1][0]
+        return rows, None
+
+    # Keyset pagination on the primary key: runs the statement and returns
+    # (rows, next_cursor). The statement's first column must be the id.
+    # Without a limit the whole result comes back and next_cursor is None.
+    @classmethod
+    def keyset_page(cls, statement, after=None, limit=None):
+        rows = db.session.execute(cls.keyset_statement(statement, after, limit)).all()
+        return cls.split_page(rows, limit)
+
+
+class Student(db.Model, QueryMixin):
     __tablename__ = "students"
 
-    serialize_rules = ('-profile.student', '-enrollments.student',)
-
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String, nullable=False)
     email = db.Column(db.String, nullable=False, unique=True)
     # Relationship between the student to the related profile
-    profile = db.relationship('Profile', uselist=False, back_populates='student', cascade='all, delete-orphan')
+    profile = db.relationship('Profile', uselist=False, back_populates='student', cascade='all, delete-orphan', passive_deletes=True)
     # Relationship between students to their related enrollments
-    enrollments = db.relationship('Enrollment', back_populates='student', cascade="all, delete-orphan")
+    enrollments = db.relationship('Enrollment', back_populates='student', cascade="all, delete-orphan", passive_deletes=True)
 
     courses = association_proxy('enrollments', 'course', creator=lambda course_obj: Enrollment(course=course_obj))
 
-    def to_dict(self):
-        return {
-            "id": self.id,
-            "name": self.name,
-            "email": self.email,
-            "profile": {
-                "age": self.profile.age,
-                "bio": self.profile.bio,
-                "student_id": self.profile.student_id,
-            },
-            "enrollments": [e.to_dict() for e in self.enrollments]
-        }
-
-
     def __repr__(self):
         return f"<Student {self.id} {self.name} {self.email}>"
 
-class Profile(db.Model, SerializerMixin):
+class Profile(db.Model, QueryMixin):
     __tablename__ = "profiles"
 
-    serialize_rules = ('-student.profile',)
-
     id = db.Column(db.Integer, primary_key=True)
     age = db.Column(db.Integer, nullable=False)
     bio = db.Column(db.String, nullable=False)
     # Storing the foreign key to initialize the relationship
-    student_id = db.Column(db.Integer, db.ForeignKey('students.id'), unique=True)
+    student_id = db.Column(db.Integer, db.ForeignKey('students.id', ondelete='CASCADE'), unique=True)
     # Relationship between profile to the associated student
     student = db.relationship('Student', back_populates='profile')
 
 
-    def to_dict(self):
-        return {
-            "age": self.age,
-            "bio": self.bio,
-            "student_id": self.student_id
-        }
-
-
     def __repr__(self):
         return f"<Profile {self.id} {self.age} {self.bio}>"
 
-class Instructor(db.Model, SerializerMixin):
+class Instructor(db.Model, QueryMixin):
     __tablename__ = "instructors"
 
-    serialize_rules = ('-courses.instructor',)
-
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String, nullable=False)
     # Relationship between instractor to their associated courses
-    courses = db.relationship('Course', back_populates="instructor", cascade="all, delete-orphan")
-
-    def to_dict(self):
-        return {
-            "id": self.id,
-            "name": self.name,
-            "courses": [
-                {
-                    "id": course.id,
-                    "title": course.title,
-                    "instructor_id": course.instructor_id
-                } 
-                for course in self.courses
-            ]
-        }
+    courses = db.relationship('Course', back_populates="instructor", cascade="all, delete-orphan", passive_deletes=True)
 
     def __repr__(self):
         return f"<Instructor {self.id} {self.name}>"
 
-class Course(db.Model, SerializerMixin):
+class Course(db.Model, QueryMixin):
     __tablename__ = "courses"
 
-    serialize_rules = ('-instructor.courses', '-enrollments.course',)
-    # serialize_only = ('id', 'title', 'instructor_id', 'instructor', 'enrollments')
-
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String, nullable=False)
 
-    instructor_id = db.Column(db.Integer, db.ForeignKey('instructors.id'))
+    instructor_id = db.Column(db.Integer, db.ForeignKey('instructors.id', ondelete='CASCADE'), index=True)
 
     instructor = db.relationship('Instructor', back_populates="courses")
 
+    # Seats on offer, or None for no limit
+    capacity = db.Column(db.Integer, nullable=True)
+    # Enrollments holding a seat. seats.py keeps it equal to the number of
+    # the course's enrollments and admits students with conditional UPDATEs
+    # of it, so it is never written through the API.
+    seats_taken = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    read_only_fields = ('seats_taken',)
+
     # Relationship between course to their related enrolments
-    enrollments = db.relationship('Enrollment', back_populates='course', cascade='all, delete-orphan')
+    enrollments = db.relationship('Enrollment', back_populates='course', cascade='all, delete-orphan', passive_deletes=True)
 
     students = association_proxy('enrollments', 'student', creator=lambda student_obj: Enrollment(student=student_obj))
 
-    def to_dict(self):
-        return {
-            "id": self.id,
-            "title": self.title,
-
-            "instructor": {
-                "id": self.instructor.id,
-                "name": self.instructor.name
-            } if self.instructor else None,
-            "student_count": len(self.students)
-        }
-
     def __repr__(self):
         return f"<Course {self.id} {self.title}>"
 
-class Enrollment(db.Model, SerializerMixin):
+class Enrollment(db.Model, QueryMixin):
     __tablename__ = "enrollments"
 
-    serialize_rules = ('-student.enrollments', '-course.enrollments',)
+    # A student can only enroll in a course once. The constraint's index
+    # also serves lookups by student_id, so that column needs no index of its own.
+    __table_args__ = (
+        db.UniqueConstraint('student_id', 'course_id', name='uq_enrollments_student_id_course_id'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     grade = db.Column(db.String, nullable=True, default="N/A")
     date_enrolled = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
     # Foreing key to store the relationship between student and enrollment
-    student_id = db.Column(db.Integer, db.ForeignKey('students.id'))
+    student_id = db.Column(db.Integer, db.ForeignKey('students.id', ondelete='CASCADE'))
     # Foreign key to store the relationship between courses and enrollment 
-    course_id = db.Column(db.Integer, db.ForeignKey('courses.id'))
+    course_id = db.Column(db.Integer, db.ForeignKey('courses.id', ondelete='CASCADE'), index=True)
 
     student = db.relationship('Student', back_populates="enrollments")
     course = db.relationship('Course', back_populates="enrollments")
 
-    def to_dict(self):
-        return{
-            "id": self.id,
-            "student_id": self.student_id,
-            "course_id": self.course_id,
-            "date_enrolled": self.date_enrolled,
-            "grade":self.grade,
-            "course": {
-                "id": self.course.id,
-                "title": self.course.title,
-                "instructor_id": self.course.instructor_id,
-                "instructor": {
-                    "id": self.course.instructor.id,
-                    "name": self.course.instructor.name
-                }
-            }if self.course else None
-        }
+    def __repr__(self):
+        return f"<Enrollment {self.id} {self.grade} {self.date_enrolled}>"
+
+# Students waiting for a seat in a full course, promoted to enrollments in
+# id order as seats free up
+class WaitlistEntry(db.Model, QueryMixin):
+    __tablename__ = "waitlist_entries"
+
+    __table_args__ = (
+        db.UniqueConstraint('student_id', 'course_id', name='uq_waitlist_entries_student_id_course_id'),
+        db.Index('ix_waitlist_entries_course_id_id', 'course_id', 'id'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    student_id = db.Column(db.Integer, db.ForeignKey('students.id', ondelete='CASCADE'), nullable=False)
+    course_id = db.Column(db.Integer, db.ForeignKey('courses.id', ondelete='CASCADE'), nullable=False)
+    date_added = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f"<WaitlistEntry {self.id} {self.student_id} {self.course_id}>"
+
+# Number of enrollments per course, computed by the database as a
+# correlated COUNT(*) in the same SELECT that loads the courses.
+# Deferred so that courses loaded through other relationships don't pay for it.
+Course.student_count = db.column_property(
+    select(func.count(Enrollment.id))
+    .where(Enrollment.course_id == Course.id)
+    .correlate_except(Enrollment)
+    .scalar_subquery(),
+    deferred=True,
+)
+
+
+
+
+# Read model behind the student payload, kept up to date by schedules.py:
+# each student's enrollments with their course and instructor, stored in
+# the shape the API returns them so a student is read in one query
+class StudentSchedule(db.Model):
+    __tablename__ = "student_schedules"
+
+    id = db.Column(db.Integer, db.ForeignKey('students.id', ondelete='CASCADE'), primary_key=True)
+    enrollments = db.Column(db.JSON, nullable=False, default=list)
+
+    def __repr__(self):
+        return f"<StudentSchedule {self.id} {len(self.enrollments)}>"
+
+# Summary tables behind /reports, kept up to date by reports.py. Each row
+# is keyed by the id of the course or instructor it describes. grades maps
+# each grade to its number of enrollments, with NULL grades counted as N/A.
+class CourseReport(db.Model, QueryMixin):
+    __tablename__ = "course_reports"
+
+    id = db.Column(db.Integer, primary_key=True)
+    title = db.Column(db.String, nullable=False)
+    instructor_id = db.Column(db.Integer, index=True)
+    enrollments = db.Column(db.Integer, nullable=False, default=0)
+    grades = db.Column(db.JSON, nullable=False, default=dict)
+
+    def __repr__(self):
+        return f"<CourseReport {self.id} {self.enrollments}>"
+
+class InstructorReport(db.Model, QueryMixin):
+    __tablename__ = "instructor_reports"
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String, nullable=False)
+    courses = db.Column(db.Integer, nullable=False, default=0)
+    enrollments = db.Column(db.Integer, nullable=False, default=0)
+    # Distinct students across all of the instructor's courses
+    students = db.Column(db.Integer, nullable=False, default=0)
+    grades = db.Column(db.JSON, nullable=False, default=dict)
+
+    def __repr__(self):
+        return f"<InstructorReport {self.id} {self.courses} {self.enrollments}>"
+
+# Version of the data in each table, for conditional GETs and response
+# cache keys. Every transaction writing to a table increments that table's
+# own row just before it commits, so writers only queue behind others
+# writing the same table, and only while they commit.
+class TableVersion(db.Model):
+    __tablename__ = "table_versions"
+
+    table_name = db.Column(db.String, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+    # Moves each of the given tables to its next version. Returns the new
+    # versions by table name.
+    @classmethod
+    def bump(cls, connection, tables):
+        table = cls.__table__
+        statement = table.update().where(table.c.table_name.in_(tables)).values(version=table.c.version + 1)
+        if connection.dialect.update_returning:
+            versions = dict(connection.execute(statement.returning(table.c.table_name, table.c.version)).all())
+        else:
+            connection.execute(statement)
+            versions = dict(connection.execute(select(table.c.table_name, table.c.version).where(table.c.table_name.in_(tables))).all())
+
+        missing = set(tables) - set(versions)
+        if missing:
+            connection.execute(table.insert(), [{"table_name": name, "version": 1} for name in missing])
+            versions.update(dict.fromkeys(missing, 1))
+        return versions
+
+    # Version of the given tables together, 0 if none was ever written.
+    # The sum of their versions: they only ever grow, so it changes
+    # whenever any of them does.
+    @classmethod
+    def latest(cls, tables):
+        return db.session.scalar(select(func.sum(cls.version)).where(cls.table_name.in_(tables))) or 0
+
+    def __repr__(self):
+        return f"<TableVersion {self.table_name} {self.version}>"
+
+
+# Append-only log of the rows written to the API's tables, kept by
+# changes.py. seq orders entries by commit; op is insert, update, delete,
+# or reset when a whole table was replaced. data holds the columns an
+# insert or update set, as the API serializes them.
+class Change(db.Model):
+    __tablename__ = "changes"
+
+    # AUTOINCREMENT, so seqs freed by compaction are never handed out again
+    __table_args__ = (
+        db.Index('ix_changes_table_name_row_id', 'table_name', 'row_id'),
+        {"sqlite_autoincrement": True},
+    )
+
+    seq = db.Column(db.Integer, primary_key=True)
+    table_name = db.Column(db.String, nullable=False)
+    row_id = db.Column(db.Integer, nullable=True)
+    op = db.Column(db.String, nullable=False)
+    data = db.Column(db.JSON, nullable=True)
+    # Version the transaction that made the change gave the row's table
+    version = db.Column(db.Integer, nullable=False)
+    changed_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
 
     def __repr__(self):
-        return f"<Enrollment {self.id} {self.grade} {self.date_enrolled}>"
\ No newline at end of file
+        return f"<Change {self.seq} {self.op} {self.table_name} {self.row_id}>"
@@ -0,0 +1,186 @@
+# Read replica routing. DATABASE_REPLICA_URLS lists read-only copies of the
+# primary database; GET and HEAD requests read from one of them, round
+# robin, and every other request uses the primary. Replicas lag behind the
+# primary, so a replica only serves a client once it has caught up with the
+# client's own writes: responses to writes hand back the versions they gave
+# the tables they wrote, merged with those the client sent, in the
+# read_version cookie and the X-Read-Version header, e.g.
+# "courses:5|enrollments:7". Replicas with any of those tables older are
+# skipped. With none caught up the read goes to the primary.
+#
+# A page read from a lagging replica is safe to cache: the response cache
+# keys it on the table version read from that same replica.
+import itertools
+import logging
+import sqlite3
+import threading
+
+import click
+from flask import request
+from flask.cli import with_appcontext
+from sqlalchemy import select
+from sqlalchemy.exc import SQLAlchemyError
+
+from models import db, enable_sqlite_pragmas, TableVersion
+
+logger = logging.getLogger(__name__)
+
+READ_VERSION_COOKIE = 'read_version'
+READ_VERSION_HEADER = 'X-Read-Version'
+PRIMARY = 'primary'
+
+
+class Replicas:
+    def __init__(self):
+        self.keys = []
+        self.lock = threading.Lock()
+        self.turn = itertools.count()
+        # bind key -> table name -> highest version seen on that replica
+        self.versions = {}
+        self.reads = {}
+
+    # Adds a bind per replica URL. Must run before db.init_app().
+    def init_app(self, app):
+        urls = app.config.get('SQLALCHEMY_REPLICA_URLS') or []
+        self.keys = [f'replica_{n}' for n in range(len(urls))]
+        self.versions = {}
+        self.reads = {}
+        self.sticky_seconds = app.config.get('REPLICA_STICKY_SECONDS', 60)
+        if not self.keys:
+            return
+
+        app.config['SQLALCHEMY_BINDS'] = {**(app.config.get('SQLALCHEMY_BINDS') or {}), **dict(zip(self.keys, urls))}
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.teardown_request(self._teardown_request)
+
+    # Engines of the replicas. SQLite replicas get the primary's pragmas
+    # and refuse writes. Needs an app context.
+    def engines(self, pragmas=None):
+        engines = [db.engines[key] for key in self.keys]
+        if pragmas is not None:
+            for engine in engines:
+                if engine.dialect.name == 'sqlite':
+                    enable_sqlite_pragmas(engine, {**pragmas, 'query_only': 'ON'})
+        return engines
+
+    def stats(self):
+        with self.lock:
+            return {
+                "replicas": {key: {"versions": dict(self.versions.get(key) or {})} for key in self.keys},
+                "reads": dict(self.reads),
+            }
+
+    # Counters in the Prometheus text format, for GET /metrics
+    def metric_lines(self):
+        if not self.keys:
+            return []
+        lines = ["# TYPE replica_reads_total counter"]
+        for target, count in sorted(self.stats()["reads"].items()):
+            lines.append(f'replica_reads_total{{target="{target}"}} {count}')
+        return lines
+
+    # The first replica, in round robin order, with every table at or past
+    # the version required of it. None when all of them are behind.
+    def choose(self, required):
+        start = next(self.turn)
+        for n in range(len(self.keys)):
+            key = self.keys[(start + n) % len(self.keys)]
+            if caught_up(self.versions.get(key), required) or caught_up(self._refresh_versions(key), required):
+                return key
+        return None
+
+    # A replica that can't be read, e.g. one not yet synced, has no versions
+    def _refresh_versions(self, key):
+        table = TableVersion.__table__
+        try:
+            with db.engines[key].connect() as connection:
+                versions = dict(connection.execute(select(table.c.table_name, table.c.version)).all())
+        except SQLAlchemyError as error:
+            logger.warning("could not read the table versions of %s: %s", key, error.orig or error)
+            return None
+        with self.lock:
+            seen = self.versions.setdefault(key, {})
+            for name, version in versions.items():
+                seen[name] = max(seen.get(name, 0), version)
+            return dict(seen)
+
+    def _client_versions(self):
+        return parse_versions(request.headers.get(READ_VERSION_HEADER) or request.cookies.get(READ_VERSION_COOKIE))
+
+    def _before_request(self):
+        if request.method not in ('GET', 'HEAD'):
+            return
+        key = self.choose(self._client_versions())
+        if key is not None:
+            db.session.info['replica'] = db.engines[key]
+        with self.lock:
+            self.reads[key or PRIMARY] = self.reads.get(key or PRIMARY, 0) + 1
+
+    def _after_request(self, response):
+        committed = db.session.info.pop('committed_versions', None)
+        if committed and request.method not in ('GET', 'HEAD'):
+            versions = self._client_versions()
+            for name, version in committed.items():
+                versions[name] = max(versions.get(name, 0), version)
+            value = format_versions(versions)
+            response.headers[READ_VERSION_HEADER] = value
+            response.set_cookie(READ_VERSION_COOKIE, value, max_age=self.sticky_seconds, httponly=True, samesite='Lax')
+        return response
+
+    def _teardown_request(self, error=None):
+        db.session.info.pop('replica', None)
+
+
+replicas = Replicas()
+
+
+# Whether versions, a replica's table versions, are at or past required
+def caught_up(versions, required):
+    return versions is not None and all(versions.get(name, 0) >= version for name, version in required.items())
+
+
+# Table versions from a read_version value; malformed parts are ignored
+def parse_versions(value):
+    versions = {}
+    for part in (value or '').split('|'):
+        name, _, version = part.partition(':')
+        if name and version.isdigit():
+            versions[name] = int(version)
+    return versions
+
+
+def format_versions(versions):
+    return '|'.join(f'{name}:{version}' for name, version in sorted(versions.items()))
+
+
+# Copies one SQLite database file over another with SQLite's online backup,
+# a consistent snapshot even while the source is being written
+def copy_sqlite(source, target):
+    source_connection = sqlite3.connect(source)
+    target_connection = sqlite3.connect(target)
+    try:
+        source_connection.backup(target_connection)
+    finally:
+        target_connection.close()
+        source_connection.close()
+
+
+@click.group('replicas')
+def replicas_cli():
+    """Manage read replicas."""
+
+
+@replicas_cli.command('sync')
+@with_appcontext
+def sync_command():
+    """Copy the primary SQLite database to every SQLite replica."""
+    if db.engine.dialect.name != 'sqlite':
+        raise click.ClickException('Only SQLite replicas can be synced here; use the database\'s own replication')
+
+    for key, engine in zip(replicas.keys, replicas.engines()):
+        if engine.dialect.name != 'sqlite':
+            raise click.ClickException(f'{key} is not an SQLite database')
+        engine.dispose()
+        copy_sqlite(db.engine.url.database, engine.url.database)
+        click.echo(f"copied {db.engine.url.database} to {engine.url.database}")
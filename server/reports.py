@@ -0,0 +1,490 @@
+# Keeps the course_reports and instructor_reports summary tables in step
+# with students, courses, instructors and enrollments. Every write to those
+# tables is recorded as it happens: enrollments by the values they had
+# before the transaction changed them, or the values it inserted, and
+# courses and instructors by id. Just before the transaction commits the
+# report rows are adjusted by the difference. Per-grade counts go up or
+# down by the enrollments added and removed, and an instructor's student
+# count by the students who gained their first or lost their last
+# enrollment in the instructor's courses. Only courses moving to another
+# instructor and deleted courses, whose enrollments the database removes
+# unseen, have their instructors' rows recomputed from scratch. Statements
+# whose rows can't be known (e.g. an UPDATE with a WHERE clause) trigger a
+# full rebuild.
+import time
+from collections import Counter
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import event, select, insert, update, delete, func, distinct, bindparam, inspect
+from sqlalchemy.orm import Session
+
+from models import db, chunked, before_commit, record_changed_tables, updated_columns, enrollments_where, child_ids, Student, Instructor, Course, Enrollment, CourseReport, InstructorReport
+
+UNGRADED = 'N/A'
+
+# Columns of the source tables the reports show
+REPORTED_COLUMNS = {
+    Enrollment.__table__: {"course_id", "student_id", "grade"},
+    Course.__table__: {"title", "instructor_id"},
+    Instructor.__table__: {"name"},
+}
+
+
+# before: enrollment id -> (course_id, student_id, grade) before the
+# transaction first changed it. deleted: ids among them known to be gone.
+# inserted: (course_id, student_id, grade) of each enrollment inserted.
+# courses and instructors: ids whose own rows were written. created: the
+# report columns of courses and instructors added through the session, by
+# id, which need no reading back unless written again.
+def _pending(session):
+    return session.info.setdefault('reports', {
+        "before": {}, "deleted": set(), "inserted": [], "courses": set(), "instructors": set(),
+        "created_courses": {}, "created_instructors": {}, "rebuild": False,
+    })
+
+
+# Remembers the enrollments whose column is in values as they are now,
+# before a write changes or deletes them
+def _remember(session, column, values, deleted=False):
+    pending = _pending(session)
+    for id, course_id, student_id, grade in enrollments_where(session, column, values):
+        pending["before"].setdefault(id, (course_id, student_id, grade))
+        if deleted:
+            pending["deleted"].add(id)
+
+
+# Courses of the given instructors, whose rows the database deletes with them
+def _instructor_courses(session, ids):
+    return set(child_ids(session, Course.instructor_id, ids))
+
+
+# Enrollments changed or deleted through the session, read before the
+# flush writes them, and the rows students and instructors deleted through
+# the session take with them in the database
+@event.listens_for(Session, 'before_flush')
+def _record_before_flush(session, flush_context, instances):
+    enrollments = [obj.id for obj in (*session.dirty, *session.deleted) if isinstance(obj, Enrollment) and obj.id is not None]
+    if enrollments:
+        _remember(session, Enrollment.id, enrollments)
+        _pending(session)["deleted"].update(obj.id for obj in session.deleted if isinstance(obj, Enrollment))
+
+    students = [obj.id for obj in session.deleted if isinstance(obj, Student)]
+    if students:
+        _remember(session, Enrollment.student_id, students, deleted=True)
+    instructors = [obj.id for obj in session.deleted if isinstance(obj, Instructor)]
+    if instructors:
+        _pending(session)["courses"].update(_instructor_courses(session, instructors))
+
+
+@event.listens_for(Session, 'after_flush')
+def _record_flushed(session, flush_context):
+    pending = _pending(session)
+    for obj in session.new:
+        if isinstance(obj, Enrollment):
+            pending["inserted"].append((obj.course_id, obj.student_id, obj.grade))
+        elif isinstance(obj, Course):
+            pending["created_courses"][obj.id] = {"id": obj.id, "title": obj.title, "instructor_id": obj.instructor_id}
+        elif isinstance(obj, Instructor):
+            pending["created_instructors"][obj.id] = {"id": obj.id, "name": obj.name}
+    for obj in (*session.dirty, *session.deleted):
+        if isinstance(obj, (Course, Instructor)) and (obj in session.deleted or _reported_changes(obj)):
+            pending["courses" if isinstance(obj, Course) else "instructors"].add(obj.id)
+
+
+# Whether the flush changed any column of the object the reports show
+def _reported_changes(obj):
+    state = inspect(obj)
+    return any(state.attrs[column].history.has_changes() for column in REPORTED_COLUMNS[obj.__table__])
+
+
+# Rows written through session.execute(): enrollments inserted, from the
+# insert's parameters, and rows named by the row_ids execution option of
+# an UPDATE of enrollments, courses or instructors or of any DELETE.
+# Updates of columns no report shows are skipped. Anything else on the
+# source tables falls back to a full rebuild.
+@event.listens_for(Session, 'do_orm_execute')
+def _record_executed(execute_state):
+    if not (execute_state.is_insert or execute_state.is_update or execute_state.is_delete):
+        return
+    table = getattr(execute_state.statement, 'table', None)
+    if table not in (Student.__table__, Enrollment.__table__, Course.__table__, Instructor.__table__):
+        return
+    if table is Student.__table__ and not execute_state.is_delete:
+        # Student columns don't appear in any report
+        return
+    if execute_state.is_update:
+        columns = updated_columns(execute_state)
+        if columns is not None and not columns & REPORTED_COLUMNS[table]:
+            return
+
+    session = execute_state.session
+    pending = _pending(session)
+    row_ids = execute_state.execution_options.get('row_ids')
+    parameters = execute_state.parameters
+    if isinstance(parameters, dict):
+        parameters = [parameters]
+
+    if execute_state.is_insert and table is Enrollment.__table__:
+        if parameters and all("course_id" in row and "student_id" in row for row in parameters):
+            pending["inserted"].extend((row["course_id"], row["student_id"], row.get("grade", UNGRADED)) for row in parameters)
+            return
+    elif execute_state.is_insert:
+        if parameters and all("id" in row for row in parameters):
+            pending["courses" if table is Course.__table__ else "instructors"].update(row["id"] for row in parameters)
+            return
+    elif row_ids is not None:
+        if table is Enrollment.__table__:
+            _remember(session, Enrollment.id, row_ids, deleted=execute_state.is_delete)
+        elif table is Student.__table__:
+            _remember(session, Enrollment.student_id, row_ids, deleted=True)
+        elif table is Course.__table__:
+            pending["courses"].update(row_ids)
+        else:
+            pending["instructors"].update(row_ids)
+            if execute_state.is_delete:
+                pending["courses"].update(_instructor_courses(session, row_ids))
+        return
+
+    pending["rebuild"] = True
+
+
+@before_commit(20)
+def _refresh_before_commit(session):
+    # Pending objects are only flushed after before_commit, so flush them
+    # now to see their effect on the reports
+    session.flush()
+    pending = session.info.pop('reports', None)
+    if pending is None:
+        return
+
+    if pending["rebuild"]:
+        rebuild(session)
+    else:
+        apply_changes(session, pending)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_pending(session):
+    session.info.pop('reports', None)
+
+
+REPORT_TABLES = {CourseReport.__tablename__, InstructorReport.__tablename__}
+
+
+# Adjusts the report rows by the changes recorded in pending, see
+# _pending(). Writes go straight to the session's connection, and the
+# report tables are recorded as changed once at the end rather than per
+# statement.
+def apply_changes(session, pending):
+    connection = session.connection()
+    courses, pairs = _enrollment_changes(connection, pending)
+
+    new_courses = {id: row for id, row in pending["created_courses"].items() if id not in pending["courses"]}
+    new_instructors = {id: row for id, row in pending["created_instructors"].items() if id not in pending["instructors"]}
+
+    # Instructors whose rows are recomputed: those of courses that moved to
+    # another instructor or were deleted along with their enrollments.
+    # Courses with changes but no report are recomputed too, as a fallback.
+    recompute, missing = set(), set()
+    instructors = {}
+
+    written = pending["courses"] | set(new_courses)
+    reports = _read_rows(connection, CourseReport, (set(courses) | pending["courses"]) - set(new_courses))
+    current = {**new_courses, **_read_rows(connection, Course, pending["courses"], ("id", "title", "instructor_id"))}
+    inserts, updates, deletes = {}, {}, []
+    for id in set(courses) | written:
+        report = reports.get(id)
+        if id in written:
+            course = current.get(id)
+            if course is None:
+                if report is not None:
+                    deletes.append(id)
+                    recompute.add(report["instructor_id"])
+                continue
+            if report is None:
+                report = inserts[id] = {**course, "enrollments": 0, "grades": {}}
+                _add_counts(instructors, course["instructor_id"], courses=1)
+            elif (report["title"], report["instructor_id"]) != (course["title"], course["instructor_id"]):
+                if report["instructor_id"] != course["instructor_id"]:
+                    recompute.update((report["instructor_id"], course["instructor_id"]))
+                report.update(course)
+                updates[id] = report
+        elif report is None:
+            missing.add(id)
+            continue
+
+        change = courses.get(id)
+        if change is not None:
+            _apply_counts(report, change)
+            if id not in inserts:
+                updates[id] = report
+            _add_counts(instructors, report["instructor_id"], **change)
+    changed = _write_rows(connection, CourseReport, inserts, updates, deletes)
+
+    course_instructors = {id: report["instructor_id"] for id, report in (*reports.items(), *inserts.items())}
+    _add_students(connection, instructors, pairs, course_instructors, recompute)
+
+    written = pending["instructors"] | set(new_instructors)
+    instructor_ids = (set(instructors) | written) - recompute - {None}
+    reports = _read_rows(connection, InstructorReport, instructor_ids - set(new_instructors))
+    current = {**new_instructors, **_read_rows(connection, Instructor, pending["instructors"] & instructor_ids, ("id", "name"))}
+    inserts, updates, deletes = {}, {}, []
+    for id in instructor_ids:
+        report = reports.get(id)
+        if id in written:
+            instructor = current.get(id)
+            if instructor is None:
+                if report is not None:
+                    deletes.append(id)
+                continue
+            if report is None:
+                report = inserts[id] = {**instructor, "courses": 0, "enrollments": 0, "students": 0, "grades": {}}
+            elif report["name"] != instructor["name"]:
+                report["name"] = instructor["name"]
+                updates[id] = report
+        elif report is None:
+            recompute.add(id)
+            continue
+
+        change = instructors.get(id)
+        if change is not None:
+            _apply_counts(report, change)
+            if id not in inserts:
+                updates[id] = report
+    changed = _write_rows(connection, InstructorReport, inserts, updates, deletes) or changed
+
+    recompute.discard(None)
+    if missing or recompute:
+        refresh(session, missing, recompute)
+    elif changed:
+        record_changed_tables(session, REPORT_TABLES)
+
+
+# Net changes to enrollments, as counts to add per course, and the number
+# of enrollments gained or lost per (student, course)
+def _enrollment_changes(connection, pending):
+    changes = [(*values, 1) for values in pending["inserted"]]
+    changes.extend((*values, -1) for values in pending["before"].values())
+    existing = [id for id in pending["before"] if id not in pending["deleted"]]
+    for ids in chunked(existing):
+        rows = connection.execute(
+            select(Enrollment.course_id, Enrollment.student_id, Enrollment.grade).where(Enrollment.id.in_(ids))
+        )
+        changes.extend((*row, 1) for row in rows)
+
+    courses, pairs = {}, Counter()
+    for course_id, student_id, grade, sign in changes:
+        change = courses.setdefault(course_id, {"enrollments": 0, "grades": Counter()})
+        change["enrollments"] += sign
+        change["grades"][grade if grade is not None else UNGRADED] += sign
+        pairs[student_id, course_id] += sign
+
+    courses = {id: change for id, change in courses.items() if change["enrollments"] or any(change["grades"].values())}
+    return courses, {pair: count for pair, count in pairs.items() if count}
+
+
+# Adds counts to the running change for an instructor
+def _add_counts(instructors, instructor_id, courses=0, enrollments=0, grades=(), students=0):
+    if instructor_id is None:
+        return
+    change = instructors.setdefault(instructor_id, {"courses": 0, "enrollments": 0, "students": 0, "grades": Counter()})
+    change["courses"] += courses
+    change["enrollments"] += enrollments
+    change["students"] += students
+    change["grades"].update(dict(grades))
+
+
+# Adds a change's counts to a report row, dropping grades no one has
+def _apply_counts(report, change):
+    for name in ("courses", "enrollments", "students"):
+        if name in report and name in change:
+            report[name] += change[name]
+    grades = Counter(report["grades"])
+    grades.update(change["grades"])
+    report["grades"] = {grade: count for grade, count in sorted(grades.items()) if count > 0}
+
+
+# Students who gained their first or lost their last enrollment with an
+# instructor. The enrollments each student has with each instructor now,
+# less the net number gained, tell whether they had any before.
+def _add_students(connection, instructors, pairs, course_instructors, recompute):
+    gained = Counter()
+    for (student_id, course_id), count in pairs.items():
+        instructor_id = course_instructors.get(course_id)
+        if instructor_id is not None and instructor_id not in recompute:
+            gained[student_id, instructor_id] += count
+    gained = {pair: count for pair, count in gained.items() if count}
+    if not gained:
+        return
+
+    now = Counter()
+    instructor_ids = {instructor_id for _, instructor_id in gained}
+    for students in chunked({student_id for student_id, _ in gained}):
+        for ids in chunked(instructor_ids):
+            rows = connection.execute(
+                select(Enrollment.student_id, Course.instructor_id, func.count(Enrollment.id))
+                .join(Course, Enrollment.course_id == Course.id)
+                .where(Enrollment.student_id.in_(students), Course.instructor_id.in_(ids))
+                .group_by(Enrollment.student_id, Course.instructor_id)
+            )
+            now.update({(student_id, instructor_id): count for student_id, instructor_id, count in rows})
+
+    for pair, count in gained.items():
+        students = (now[pair] > 0) - (now[pair] - count > 0)
+        if students:
+            _add_counts(instructors, pair[1], students=students)
+
+
+# Report or source rows by id, as dicts of the given columns (all by default)
+def _read_rows(connection, model, ids, columns=None):
+    table = model.__table__
+    selected = [table.c[name] for name in columns] if columns else list(table.columns)
+    rows = {}
+    for chunk in chunked(ids):
+        for row in connection.execute(select(*selected).where(table.c.id.in_(chunk))).mappings():
+            rows[row["id"]] = dict(row)
+    return rows
+
+
+# Inserts, updates (one executemany by id) and deletes report rows.
+# Returns whether it wrote any.
+def _write_rows(connection, model, inserts, updates, deletes):
+    table = model.__table__
+    if inserts:
+        connection.execute(insert(table), list(inserts.values()))
+    if updates:
+        statement = update(table).where(table.c.id == bindparam('row_id'))
+        connection.execute(statement, [
+            {"row_id": id, **{name: value for name, value in row.items() if name != "id"}} for id, row in updates.items()
+        ])
+    for ids in chunked(deletes):
+        connection.execute(delete(table).where(table.c.id.in_(ids)))
+    return bool(inserts or updates or deletes)
+
+
+# Recomputes the report rows of the given courses and instructors, plus the
+# instructors those courses belong to now or belonged to before. Writes go
+# straight to the session's connection, and the report tables are recorded
+# as changed once at the end rather than per statement.
+def refresh(session, course_ids=(), instructor_ids=()):
+    connection = session.connection()
+    course_ids = {id for id in course_ids if id is not None}
+    instructor_ids = set(instructor_ids)
+
+    for ids in chunked(course_ids):
+        instructor_ids.update(_delete_course_reports(connection, CourseReport.id.in_(ids)))
+
+        rows = _course_rows(connection, Course.id.in_(ids))
+        if rows:
+            connection.execute(insert(CourseReport.__table__), rows)
+        instructor_ids.update(row["instructor_id"] for row in rows)
+
+    instructor_ids.discard(None)
+    for ids in chunked(instructor_ids):
+        connection.execute(delete(InstructorReport.__table__).where(InstructorReport.id.in_(ids)))
+
+        rows = _instructor_rows(connection, Instructor.id.in_(ids))
+        if rows:
+            connection.execute(insert(InstructorReport.__table__), rows)
+
+    if course_ids or instructor_ids:
+        record_changed_tables(session, REPORT_TABLES)
+
+
+# Replaces both report tables with figures computed from scratch
+def rebuild(session):
+    session.info.pop('reports', None)
+    connection = session.connection()
+    connection.execute(delete(CourseReport.__table__))
+    connection.execute(delete(InstructorReport.__table__))
+
+    for ids in chunked(connection.scalars(select(Course.id).order_by(Course.id)).all()):
+        rows = _course_rows(connection, Course.id.in_(ids))
+        if rows:
+            connection.execute(insert(CourseReport.__table__), rows)
+
+    for ids in chunked(connection.scalars(select(Instructor.id).order_by(Instructor.id)).all()):
+        rows = _instructor_rows(connection, Instructor.id.in_(ids))
+        if rows:
+            connection.execute(insert(InstructorReport.__table__), rows)
+
+    record_changed_tables(session, REPORT_TABLES)
+
+
+# Deletes course reports, returning the instructors they belonged to
+def _delete_course_reports(connection, condition):
+    statement = delete(CourseReport.__table__).where(condition)
+    if connection.dialect.delete_returning:
+        return connection.scalars(statement.returning(CourseReport.instructor_id)).all()
+
+    instructor_ids = connection.scalars(select(CourseReport.instructor_id).where(condition)).all()
+    connection.execute(statement)
+    return instructor_ids
+
+
+# Report rows for the matching courses, from one grouped outer join of
+# courses with their enrollments
+def _course_rows(connection, condition):
+    grade = func.coalesce(Enrollment.grade, UNGRADED)
+    counts = connection.execute(
+        select(Course.id, Course.title, Course.instructor_id, grade, func.count(Enrollment.id))
+        .outerjoin(Enrollment, Enrollment.course_id == Course.id)
+        .where(condition)
+        .group_by(Course.id, grade)
+    )
+
+    rows = {}
+    for id, title, instructor_id, grade, count in counts:
+        row = rows.setdefault(id, {"id": id, "title": title, "instructor_id": instructor_id, "enrollments": 0, "grades": {}})
+        if count:
+            row["grades"][grade] = count
+            row["enrollments"] += count
+    return list(rows.values())
+
+
+# Report rows for the matching instructors, summing their course reports
+def _instructor_rows(connection, condition):
+    courses = connection.execute(
+        select(Instructor.id, Instructor.name, CourseReport.enrollments, CourseReport.grades)
+        .outerjoin(CourseReport, CourseReport.instructor_id == Instructor.id)
+        .where(condition)
+    )
+
+    rows = {}
+    for id, name, enrollments, grades in courses:
+        row = rows.setdefault(id, {"id": id, "name": name, "courses": 0, "enrollments": 0, "students": 0, "grades": {}})
+        if enrollments is not None:
+            row["courses"] += 1
+            row["enrollments"] += enrollments
+            for grade, count in grades.items():
+                row["grades"][grade] = row["grades"].get(grade, 0) + count
+
+    if rows:
+        students = connection.execute(
+            select(Course.instructor_id, func.count(distinct(Enrollment.student_id)))
+            .join(Course, Enrollment.course_id == Course.id)
+            .where(Course.instructor_id.in_(rows))
+            .group_by(Course.instructor_id)
+        )
+        for instructor_id, count in students:
+            rows[instructor_id]["students"] = count
+    return list(rows.values())
+
+
+@click.group('reports')
+def reports_cli():
+    """Manage the reporting summary tables."""
+
+
+@reports_cli.command('rebuild')
+@with_appcontext
+def rebuild_command():
+    """Recompute every course and instructor report."""
+    started = time.perf_counter()
+    rebuild(db.session)
+    db.session.commit()
+
+    courses = db.session.scalar(select(func.count(CourseReport.id)))
+    instructors = db.session.scalar(select(func.count(InstructorReport.id)))
+    click.echo(f"rebuilt {courses} course and {instructors} instructor reports in {time.perf_counter() - started:.1f}s")
@@ -0,0 +1,251 @@
+# Keeps the student_schedules read model in step with enrollments, courses
+# and instructors. Each row holds one student's enrollments, with their
+# course and instructor, already in the shape GET /student returns them, so
+# a student is served by a single indexed read. Writes record the students
+# whose schedules they affect (directly, or through the courses and
+# instructors those students are enrolled with), and just before the
+# transaction commits only those schedules are rewritten. Statements whose
+# rows can't be known trigger a full rebuild, as in reports.py.
+import time
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import event, select, insert, delete, func, inspect
+from sqlalchemy.orm import Session
+from werkzeug.http import http_date
+
+from models import db, chunked, before_commit, record_changed_tables, updated_columns, enrollments_where, child_ids, Student, Instructor, Course, Enrollment, StudentSchedule
+from serializers import enrollment_rows
+
+DAYS = ('Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun')
+MONTHS = ('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec')
+
+# Course and instructor columns a schedule shows
+SCHEDULED_COLUMNS = {
+    Course.__table__: {"title", "instructor_id"},
+    Instructor.__table__: {"name"},
+}
+
+
+def _pending(session):
+    return session.info.setdefault('schedules', {"students": set(), "courses": set(), "instructors": set(), "enrollments": set(), "rebuild": False})
+
+
+# Students of the enrollments, or enrolled in any of the courses or in any
+# course of the instructors, as they are now
+def _enrolled_students(connection, course_ids=(), instructor_ids=(), enrollment_ids=()):
+    students = set()
+    for ids in chunked(enrollment_ids):
+        students.update(connection.scalars(select(Enrollment.student_id).where(Enrollment.id.in_(ids))))
+    for ids in chunked(course_ids):
+        students.update(connection.scalars(select(Enrollment.student_id).where(Enrollment.course_id.in_(ids)).distinct()))
+    for ids in chunked(instructor_ids):
+        students.update(connection.scalars(
+            select(Enrollment.student_id)
+            .join(Course, Enrollment.course_id == Course.id)
+            .where(Course.instructor_id.in_(ids))
+            .distinct()
+        ))
+    return students
+
+
+# Students whose schedules change when rows of table are deleted, or
+# enrollments updated. Must run before the write, while the cascaded
+# enrollments can still be read; the rows come from the lookups the other
+# upkeep listeners share (see models.py). Deleted students take their own
+# schedule row with them.
+def _deleted_students(session, table, ids):
+    if table is Enrollment.__table__:
+        enrollments = enrollments_where(session, Enrollment.id, ids)
+    elif table is Course.__table__:
+        enrollments = enrollments_where(session, Enrollment.course_id, ids)
+    elif table is Instructor.__table__:
+        enrollments = enrollments_where(session, Enrollment.course_id, child_ids(session, Course.instructor_id, ids))
+    else:
+        return set()
+    return {row.student_id for row in enrollments}
+
+
+# Students touched by an insert, or None when the parameters don't say
+def _inserted_students(table, parameters):
+    column = {Enrollment.__table__: "student_id", Student.__table__: "id"}.get(table)
+    if column is None:
+        # New courses and instructors have no enrollments yet
+        return set()
+    if isinstance(parameters, dict):
+        parameters = [parameters]
+    if not parameters or not all(column in row for row in parameters):
+        return None
+    return {row[column] for row in parameters}
+
+
+@event.listens_for(Session, 'before_flush')
+def _record_cascades(session, flush_context, instances):
+    for table in (Course.__table__, Instructor.__table__):
+        ids = [obj.id for obj in session.deleted if obj.__table__ is table]
+        if ids:
+            _pending(session)["students"].update(_deleted_students(session, table, ids))
+
+
+@event.listens_for(Session, 'after_flush')
+def _record_flushed(session, flush_context):
+    pending = _pending(session)
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        if isinstance(obj, Enrollment):
+            pending["students"].update({obj.student_id, *inspect(obj).attrs.student_id.history.deleted})
+        elif isinstance(obj, Student) and obj in session.new:
+            # Gets an empty schedule rather than falling back to the enrollments
+            pending["students"].add(obj.id)
+        elif obj in session.new:
+            # New courses and instructors have no enrollments yet
+            continue
+        elif isinstance(obj, Course) and _scheduled_changes(obj):
+            pending["courses"].add(obj.id)
+        elif isinstance(obj, Instructor) and _scheduled_changes(obj):
+            pending["instructors"].add(obj.id)
+
+
+# Whether the flush changed any column of the course or instructor that
+# schedules show
+def _scheduled_changes(obj):
+    state = inspect(obj)
+    return any(state.attrs[column].history.has_changes() for column in SCHEDULED_COLUMNS[obj.__table__])
+
+
+# Keys of rows written through session.execute(), from the parameters of an
+# insert or the row_ids execution option of an UPDATE or DELETE. Updated
+# enrollments count for their students now and again at commit, in case
+# the update moved them. Student updates, and course and instructor updates
+# of columns schedules don't show, are skipped; anything else falls back to
+# a rebuild.
+@event.listens_for(Session, 'do_orm_execute')
+def _record_executed(execute_state):
+    if not (execute_state.is_insert or execute_state.is_update or execute_state.is_delete):
+        return
+    table = getattr(execute_state.statement, 'table', None)
+    if table not in (Student.__table__, Enrollment.__table__, Course.__table__, Instructor.__table__):
+        return
+    if table is Student.__table__ and execute_state.is_update:
+        return
+    if execute_state.is_update and table in SCHEDULED_COLUMNS:
+        columns = updated_columns(execute_state)
+        if columns is not None and not columns & SCHEDULED_COLUMNS[table]:
+            return
+
+    session = execute_state.session
+    pending = _pending(session)
+    row_ids = execute_state.execution_options.get('row_ids')
+    students = None
+    if execute_state.is_insert:
+        students = _inserted_students(table, execute_state.parameters)
+    elif row_ids is not None and (execute_state.is_delete or table is Enrollment.__table__):
+        students = _deleted_students(session, table, row_ids)
+        if table is Enrollment.__table__ and execute_state.is_update:
+            pending["enrollments"].update(row_ids)
+    elif row_ids is not None and table is Course.__table__:
+        pending["courses"].update(row_ids)
+        return
+    elif row_ids is not None and table is Instructor.__table__:
+        pending["instructors"].update(row_ids)
+        return
+
+    if students is None:
+        pending["rebuild"] = True
+    else:
+        pending["students"].update(students)
+
+
+@before_commit(30)
+def _refresh_before_commit(session):
+    session.flush()
+    pending = session.info.pop('schedules', None)
+    if pending is None:
+        return
+
+    if pending["rebuild"]:
+        rebuild(session)
+    else:
+        connection = session.connection()
+        students = (
+            pending["students"]
+            | _enrolled_students(connection, pending["courses"], pending["instructors"], pending["enrollments"])
+        )
+        refresh(session, students)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_pending(session):
+    session.info.pop('schedules', None)
+
+
+# Rewrites the schedules of the given students. Ids of students that no
+# longer exist are skipped; their rows went with them.
+def refresh(session, student_ids):
+    connection = session.connection()
+    student_ids = sorted(id for id in student_ids if id is not None)
+    for ids in chunked(student_ids):
+        connection.execute(delete(StudentSchedule.__table__).where(StudentSchedule.id.in_(ids)))
+        rows = _schedule_rows(connection, ids)
+        if rows:
+            connection.execute(insert(StudentSchedule.__table__), rows)
+
+    if student_ids:
+        record_changed_tables(session, {StudentSchedule.__tablename__})
+
+
+# Replaces every schedule with one computed from scratch
+def rebuild(session):
+    session.info.pop('schedules', None)
+    connection = session.connection()
+    connection.execute(delete(StudentSchedule.__table__))
+
+    for ids in chunked(connection.scalars(select(Student.id).order_by(Student.id)).all()):
+        connection.execute(insert(StudentSchedule.__table__), _schedule_rows(connection, ids))
+
+    record_changed_tables(session, {StudentSchedule.__tablename__})
+
+
+# Same output as werkzeug's http_date, which the JSON provider uses. Naive
+# datetimes (UTC) are formatted directly instead of through email.utils,
+# several times faster when a rebuild formats every enrollment date.
+def _http_date(value):
+    if value.tzinfo is not None:
+        return http_date(value)
+    return (
+        f"{DAYS[value.weekday()]}, {value.day:02d} {MONTHS[value.month - 1]} {value.year:04d} "
+        f"{value.hour:02d}:{value.minute:02d}:{value.second:02d} GMT"
+    )
+
+
+# Schedule rows for the given students, built by enrollment_rows so they
+# match the enrollments of the student payload. Dates are stored the way
+# the JSON provider writes them. Students without enrollments get an empty
+# schedule if they still exist.
+def _schedule_rows(connection, ids):
+    schedules = {}
+    rows = connection.execute(enrollment_rows.children_of(Enrollment.student_id, ids)).all()
+    for enrollment in enrollment_rows.shape.build(rows):
+        enrollment["date_enrolled"] = _http_date(enrollment["date_enrolled"])
+        schedules.setdefault(enrollment["student_id"], []).append(enrollment)
+
+    missing = [id for id in ids if id not in schedules]
+    if missing:
+        schedules.update((id, []) for id in connection.scalars(select(Student.id).where(Student.id.in_(missing))))
+    return [{"id": id, "enrollments": enrollments} for id, enrollments in schedules.items()]
+
+
+@click.group('schedules')
+def schedules_cli():
+    """Manage the student schedule read model."""
+
+
+@schedules_cli.command('rebuild')
+@with_appcontext
+def rebuild_command():
+    """Recompute every student's schedule."""
+    started = time.perf_counter()
+    rebuild(db.session)
+    db.session.commit()
+
+    schedules = db.session.scalar(select(func.count(StudentSchedule.id)))
+    click.echo(f"rebuilt {schedules} student schedules in {time.perf_counter() - started:.1f}s")
@@ -0,0 +1,281 @@
+# Full-text and prefix search over student names and emails, course titles
+# and instructor names. On SQLite they are indexed in the search_index FTS5
+# table, one row per searchable record whose rowid encodes its kind and id,
+# so a single MATCH ranks all kinds together by bm25. The table is kept in
+# step the way reports.py keeps the reports: writes record the rows they
+# touch and those index rows are rewritten just before commit. Other
+# databases fall back to LIKE '%term%' filters, which is also the baseline
+# benchmarks/search.py measures the index against.
+import re
+import time
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import event, select, insert, delete, literal, null, or_, and_, union_all, table, column, text, DDL, inspect
+from sqlalchemy.orm import Session
+
+from models import db, chunked, before_commit, metadata, updated_columns, child_ids, Student, Instructor, Course
+
+SEARCH_TABLE = 'search_index'
+# rowid = id * KIND_SLOTS + kind code
+KIND_SLOTS = 4
+
+search_index = table(SEARCH_TABLE, column('rowid'), column('name'), column('detail'))
+
+# Search kinds: code in the rowid, model, and the indexed name and detail columns
+KINDS = {
+    'student': (1, Student, Student.name, Student.email),
+    'course': (2, Course, Course.title, None),
+    'instructor': (3, Instructor, Instructor.name, None),
+}
+KIND_NAMES = {code: name for name, (code, *_) in KINDS.items()}
+MODEL_KINDS = {model: name for name, (_, model, *_) in KINDS.items()}
+TABLE_MODELS = {model.__table__: model for model in MODEL_KINDS}
+# Columns each model's index rows are built from
+INDEXED_COLUMNS = {model: {column.key for column in (name, detail) if column is not None} for _, model, name, detail in KINDS.values()}
+
+# Name matches count ten times as much as detail (email) matches. The
+# prefix indexes make 2 and 3 character prefix queries index lookups.
+CREATE_INDEX = (
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} "
+    "USING fts5(name, detail, tokenize='unicode61', prefix='2 3')"
+)
+RANK = f"bm25({SEARCH_TABLE}, 10.0, 1.0)"
+
+event.listen(metadata, 'after_create', DDL(CREATE_INDEX).execute_if(dialect='sqlite'))
+event.listen(metadata, 'before_drop', DDL(f"DROP TABLE IF EXISTS {SEARCH_TABLE}").execute_if(dialect='sqlite'))
+
+
+def indexed(connection):
+    return connection.dialect.name == 'sqlite'
+
+
+# Words of a query, split the way the unicode61 tokenizer splits text
+def terms(q):
+    return re.findall(r'\w+', q.lower())
+
+
+# Ranked matches of every term, each as a prefix, among the given kinds.
+# Returns up to limit items starting at offset, and the offset of the next
+# page or None.
+def search(connection, q, kinds=KINDS, limit=50, offset=0):
+    words = terms(q)
+    if not words:
+        return [], None
+    if not indexed(connection):
+        return like_search(connection, q, kinds, limit, offset)
+
+    codes = ', '.join(str(KINDS[kind][0]) for kind in kinds)
+    rows = connection.execute(
+        text(
+            f"SELECT rowid, name, detail FROM {SEARCH_TABLE} "
+            f"WHERE {SEARCH_TABLE} MATCH :match AND rowid % {KIND_SLOTS} IN ({codes}) "
+            f"ORDER BY {RANK} LIMIT :limit OFFSET :offset"
+        ),
+        {"match": ' '.join(f'"{word}"*' for word in words), "limit": limit + 1, "offset": offset},
+    ).all()
+    items = [_item(KIND_NAMES[rowid % KIND_SLOTS], rowid // KIND_SLOTS, name, detail) for rowid, name, detail in rows]
+    return _page(items, limit, offset)
+
+
+# Unindexed search: every term must appear somewhere in the name or
+# detail. Scans the tables and isn't ranked; results come by kind and id.
+def like_search(connection, q, kinds=KINDS, limit=50, offset=0):
+    words = terms(q)
+    if not words:
+        return [], None
+
+    selects = []
+    for kind in kinds:
+        code, model, name, detail = KINDS[kind]
+        columns = [name] if detail is None else [name, detail]
+        matches = [or_(*(c.icontains(word, autoescape=True) for c in columns)) for word in words]
+        selects.append(
+            select(
+                literal(code).label('code'),
+                model.id.label('id'),
+                name.label('name'),
+                (detail if detail is not None else null()).label('detail'),
+            )
+            .where(and_(*matches))
+        )
+
+    statement = union_all(*selects).subquery()
+    rows = connection.execute(
+        select(statement).order_by(statement.c.code, statement.c.id).limit(limit + 1).offset(offset)
+    ).all()
+    items = [_item(KIND_NAMES[code], id, name, detail) for code, id, name, detail in rows]
+    return _page(items, limit, offset)
+
+
+def _item(kind, id, name, detail):
+    if kind == 'student':
+        return {"type": kind, "id": id, "name": name, "email": detail}
+    if kind == 'course':
+        return {"type": kind, "id": id, "title": name}
+    return {"type": kind, "id": id, "name": name}
+
+
+def _page(items, limit, offset):
+    if len(items) > limit:
+        return items[:limit], offset + limit
+    return items, None
+
+
+# rows: rowids to rewrite. new: rowids of records inserted by the
+# transaction, which have no index row to delete first. deleted: rowids of
+# records the transaction deleted, whose index rows are only deleted.
+def _pending(session):
+    return session.info.setdefault('search', {"rows": set(), "new": set(), "deleted": set(), "rebuild": False})
+
+
+def _rowids(kind, ids):
+    code = KINDS[kind][0]
+    return {id * KIND_SLOTS + code for id in ids if id is not None}
+
+
+# Courses deleted by ON DELETE CASCADE along with their instructors. Must
+# run before the delete.
+def _cascaded_rowids(session, instructor_ids):
+    return _rowids('course', child_ids(session, Course.instructor_id, instructor_ids))
+
+
+@event.listens_for(Session, 'before_flush')
+def _record_cascades(session, flush_context, instances):
+    if not indexed(session.get_bind()):
+        return
+    ids = [obj.id for obj in session.deleted if isinstance(obj, Instructor)]
+    if ids:
+        _pending(session)["deleted"] |= _cascaded_rowids(session, ids)
+
+
+@event.listens_for(Session, 'after_flush')
+def _record_flushed(session, flush_context):
+    if not indexed(session.get_bind()):
+        return
+    pending = _pending(session)
+    for obj in session.new:
+        if type(obj) in MODEL_KINDS:
+            pending["new"] |= _rowids(MODEL_KINDS[type(obj)], [obj.id])
+    for obj in session.deleted:
+        if type(obj) in MODEL_KINDS:
+            pending["deleted"] |= _rowids(MODEL_KINDS[type(obj)], [obj.id])
+    for obj in session.dirty:
+        if type(obj) in MODEL_KINDS and _indexed_changes(obj):
+            pending["rows"] |= _rowids(MODEL_KINDS[type(obj)], [obj.id])
+
+
+# Whether the flush changed any column the object's index row is built from
+def _indexed_changes(obj):
+    state = inspect(obj)
+    return any(state.attrs[column].history.has_changes() for column in INDEXED_COLUMNS[type(obj)])
+
+
+# Rows written through session.execute(): ids from the parameters of an
+# insert or the row_ids execution option of an UPDATE or DELETE. Updates
+# of columns the index doesn't hold are skipped. Anything else on the
+# indexed tables falls back to a rebuild.
+@event.listens_for(Session, 'do_orm_execute')
+def _record_executed(execute_state):
+    if not (execute_state.is_insert or execute_state.is_update or execute_state.is_delete):
+        return
+    model = TABLE_MODELS.get(getattr(execute_state.statement, 'table', None))
+    session = execute_state.session
+    if model is None or not indexed(session.get_bind()):
+        return
+
+    pending = _pending(session)
+    row_ids = execute_state.execution_options.get('row_ids')
+    if execute_state.is_insert:
+        parameters = execute_state.parameters
+        if isinstance(parameters, dict):
+            parameters = [parameters]
+        if parameters and all("id" in row for row in parameters):
+            pending["new"] |= _rowids(MODEL_KINDS[model], [row["id"] for row in parameters])
+            return
+    elif execute_state.is_update:
+        columns = updated_columns(execute_state)
+        if columns is not None and not columns & INDEXED_COLUMNS[model]:
+            return
+
+    if row_ids is None:
+        pending["rebuild"] = True
+        return
+
+    if not execute_state.is_delete:
+        pending["rows"] |= _rowids(MODEL_KINDS[model], row_ids)
+        return
+
+    pending["deleted"] |= _rowids(MODEL_KINDS[model], row_ids)
+    if model is Instructor:
+        pending["deleted"] |= _cascaded_rowids(session, row_ids)
+
+
+@before_commit(40)
+def _refresh_before_commit(session):
+    session.flush()
+    pending = session.info.pop('search', None)
+    if pending is None:
+        return
+
+    if pending["rebuild"]:
+        rebuild(session)
+    else:
+        refresh(session, pending["rows"], pending["new"], pending["deleted"])
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_pending(session):
+    session.info.pop('search', None)
+
+
+# Rewrites the index rows with the given rowids from their records, dropping
+# those whose records no longer exist. new_rowids are only added: their
+# records are new, so they have no index row yet. deleted_rowids are only
+# dropped, unless the record was inserted again. Old index rows of every
+# kind go in one DELETE per chunk.
+def refresh(session, rowids, new_rowids=(), deleted_rowids=()):
+    connection = session.connection()
+    rowids, new_rowids, deleted_rowids = set(rowids), set(new_rowids), set(deleted_rowids)
+    for chunk in chunked(sorted(rowids | deleted_rowids)):
+        connection.execute(delete(search_index).where(search_index.c.rowid.in_(chunk)))
+
+    written = (rowids - deleted_rowids) | new_rowids
+    for kind, (code, model, name, detail) in KINDS.items():
+        ids = sorted(rowid // KIND_SLOTS for rowid in written if rowid % KIND_SLOTS == code)
+        for chunk in chunked(ids):
+            connection.execute(_insert_rows(kind, model.id.in_(chunk)))
+
+
+# Replaces the whole index with rows read from the indexed tables
+def rebuild(session):
+    session.info.pop('search', None)
+    connection = session.connection()
+    connection.execute(delete(search_index))
+    for kind in KINDS:
+        connection.execute(_insert_rows(kind))
+
+
+def _insert_rows(kind, condition=None):
+    code, model, name, detail = KINDS[kind]
+    rows = select(model.id * KIND_SLOTS + code, name, detail if detail is not None else null())
+    if condition is not None:
+        rows = rows.where(condition)
+    return insert(search_index).from_select(['rowid', 'name', 'detail'], rows)
+
+
+@click.group('search')
+def search_cli():
+    """Manage the full-text search index."""
+
+
+@search_cli.command('rebuild')
+@with_appcontext
+def rebuild_command():
+    """Reindex every student, course and instructor."""
+    started = time.perf_counter()
+    rebuild(db.session)
+    db.session.commit()
+
+    rows = db.session.execute(text(f"SELECT count(*) FROM {SEARCH_TABLE}")).scalar()
+    click.echo(f"indexed {rows} rows in {time.perf_counter() - started:.1f}s")
@@ -0,0 +1,340 @@
+# Seats and waitlists of capacity-limited courses. Students are admitted
+# with conditional UPDATEs of courses.seats_taken, so concurrent requests
+# can't oversubscribe a course, and the seat check only contends for that
+# course's row, never for a lock around the whole read-then-insert
+# sequence. On a database with row locks their commits still queue behind
+# other writers of courses and enrollments, on those tables' version rows,
+# and behind every logged write, on the change log's (see changes.py).
+# Enrollments written any other way (ORM adds, bulk inserts, deletes,
+# cascades) adjust seats_taken just before commit, keeping it equal to the
+# enrollment count, and seats freed by deletes or capacity increases go to
+# the oldest waitlist entries of the course in the same transaction.
+import time
+from datetime import datetime
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import event, select, insert, update, delete, func, or_, case, bindparam, inspect
+from sqlalchemy.orm import Session
+
+from models import db, chunked, before_commit, record_changed_tables, updated_columns, enrollments_where, Student, Course, Enrollment, WaitlistEntry
+
+courses = Course.__table__
+
+# Execution options of enrollment inserts whose seats were already taken
+SEATED = {"seated": True}
+
+
+# Takes one seat in the course if one is free. Returns whether it did.
+def take_seat(session, course_id):
+    result = session.connection().execute(
+        update(courses)
+        .where(courses.c.id == course_id)
+        .where(or_(courses.c.capacity.is_(None), courses.c.seats_taken < courses.c.capacity))
+        .values(seats_taken=courses.c.seats_taken + 1)
+    )
+    if result.rowcount:
+        record_changed_tables(session, {courses.name})
+    return result.rowcount == 1
+
+
+# Takes up to wanted[course_id] seats in each course, as many as are free.
+# Each course is read, then updated only if its seats_taken is still the
+# value read (compare-and-set), retrying courses that changed in between.
+# Returns the number of seats granted per course.
+def take_seats(session, wanted):
+    connection = session.connection()
+    granted = {}
+    pending = {course_id: count for course_id, count in wanted.items() if count > 0}
+    while pending:
+        seats = {}
+        for ids in chunked(pending):
+            rows = connection.execute(select(courses.c.id, courses.c.capacity, courses.c.seats_taken).where(courses.c.id.in_(ids)))
+            seats.update((id, (capacity, taken)) for id, capacity, taken in rows)
+
+        retry = {}
+        for course_id, count in pending.items():
+            capacity, taken = seats.get(course_id, (0, 0))
+            free = count if capacity is None else max(0, min(count, capacity - taken))
+            granted[course_id] = 0
+            if free:
+                result = connection.execute(
+                    update(courses)
+                    .where(courses.c.id == course_id, courses.c.seats_taken == taken)
+                    .values(seats_taken=taken + free)
+                )
+                if result.rowcount:
+                    granted[course_id] = free
+                else:
+                    retry[course_id] = count
+        pending = retry
+
+    if any(granted.values()):
+        record_changed_tables(session, {courses.name})
+    return granted
+
+
+# Inserts one enrollment whose seat was taken with take_seat(s). Returns its id.
+def add_enrollment(session, row):
+    statement = insert(Enrollment.__table__).returning(Enrollment.__table__.c.id)
+    return session.execute(statement, row, execution_options=SEATED).scalar_one()
+
+
+# Inserts enrollments whose seats were taken with take_seats()
+def add_enrollments(session, rows):
+    if rows:
+        session.execute(insert(Enrollment.__table__), rows, execution_options=SEATED)
+
+
+# Puts the student at the end of the course's waitlist. Returns their
+# position, 1 being next in line. Raises IntegrityError if already on it.
+def join_waitlist(session, student_id, course_id):
+    id = session.execute(
+        insert(WaitlistEntry.__table__).returning(WaitlistEntry.__table__.c.id),
+        {"student_id": student_id, "course_id": course_id, "date_added": datetime.utcnow()},
+    ).scalar_one()
+    return session.scalar(
+        select(func.count(WaitlistEntry.id)).where(WaitlistEntry.course_id == course_id, WaitlistEntry.id <= id)
+    )
+
+
+def _pending(session):
+    return session.info.setdefault('seats', {"changes": {}, "promote": set(), "enrollments": set(), "recount": False})
+
+
+def _add_changes(pending, counts, sign=1):
+    for course_id, count in counts.items():
+        if course_id is not None:
+            pending["changes"][course_id] = pending["changes"].get(course_id, 0) + sign * count
+
+
+# Enrollments per course among those whose column holds one of ids, as
+# they are now
+def _counts(connection, column, ids):
+    counts = {}
+    for chunk in chunked(ids):
+        rows = connection.execute(
+            select(Enrollment.course_id, func.count(Enrollment.id)).where(column.in_(chunk)).group_by(Enrollment.course_id)
+        )
+        for course_id, count in rows:
+            counts[course_id] = counts.get(course_id, 0) + count
+    return counts
+
+
+# Same as _counts(), from the rows read before a write changes or deletes
+# them, which the other upkeep listeners share (see models.py)
+def _counts_before(session, column, ids):
+    counts = {}
+    for row in enrollments_where(session, column, ids):
+        counts[row.course_id] = counts.get(row.course_id, 0) + 1
+    return counts
+
+
+# Students deleted through the session take their unloaded enrollments
+# with them in the database
+@event.listens_for(Session, 'before_flush')
+def _record_cascades(session, flush_context, instances):
+    ids = [obj.id for obj in session.deleted if isinstance(obj, Student)]
+    if ids:
+        _add_changes(_pending(session), _counts_before(session, Enrollment.student_id, ids), -1)
+
+
+@event.listens_for(Session, 'after_flush')
+def _record_flushed(session, flush_context):
+    pending = _pending(session)
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        if isinstance(obj, Enrollment):
+            history = inspect(obj).attrs.course_id.history
+            if obj in session.new:
+                _add_changes(pending, {obj.course_id: 1})
+            elif obj in session.deleted:
+                _add_changes(pending, {(history.deleted or [obj.course_id])[0]: 1}, -1)
+            elif history.has_changes():
+                _add_changes(pending, {course_id: 1 for course_id in history.deleted}, -1)
+                _add_changes(pending, {obj.course_id: 1})
+        elif isinstance(obj, Course) and obj in session.dirty and inspect(obj).attrs.capacity.history.has_changes():
+            pending["promote"].add(obj.id)
+
+
+# Enrollments written through session.execute(): counted from the
+# parameters of an insert, or from the row_ids execution option of a
+# DELETE of enrollments or students. Enrollments updated by row_ids leave
+# their courses now and count again wherever they are at commit, unless
+# the update leaves course_id alone. Course updates that may raise
+# capacities promote their waitlists. Anything else on enrollments falls
+# back to recounting every course.
+@event.listens_for(Session, 'do_orm_execute')
+def _record_executed(execute_state):
+    if not (execute_state.is_insert or execute_state.is_update or execute_state.is_delete):
+        return
+    table = getattr(execute_state.statement, 'table', None)
+    session = execute_state.session
+    row_ids = execute_state.execution_options.get('row_ids')
+
+    if table == courses and execute_state.is_update:
+        columns = updated_columns(execute_state)
+        if columns is not None and 'capacity' not in columns:
+            return
+        if row_ids is None:
+            _pending(session)["promote"].update(session.connection().scalars(select(WaitlistEntry.course_id).distinct()))
+        else:
+            _pending(session)["promote"].update(row_ids)
+        return
+    if table == Student.__table__ and execute_state.is_delete:
+        if row_ids is None:
+            _pending(session)["recount"] = True
+        else:
+            _add_changes(_pending(session), _counts_before(session, Enrollment.student_id, row_ids), -1)
+        return
+    if table != Enrollment.__table__ or execute_state.execution_options.get('seated'):
+        return
+    if execute_state.is_update and row_ids is not None:
+        columns = updated_columns(execute_state)
+        if columns is not None and 'course_id' not in columns:
+            return
+
+    parameters = execute_state.parameters
+    if isinstance(parameters, dict):
+        parameters = [parameters]
+    if execute_state.is_insert and parameters and all("course_id" in row for row in parameters):
+        counts = {}
+        for row in parameters:
+            counts[row["course_id"]] = counts.get(row["course_id"], 0) + 1
+        _add_changes(_pending(session), counts)
+    elif row_ids is not None:
+        _add_changes(_pending(session), _counts_before(session, Enrollment.id, row_ids), -1)
+        if execute_state.is_update:
+            _pending(session)["enrollments"].update(row_ids)
+    else:
+        _pending(session)["recount"] = True
+
+
+# Runs ahead of the other before_commit steps so that the enrollments of
+# promoted students reach the read models and the change log
+@before_commit(10)
+def _settle_before_commit(session):
+    session.flush()
+    pending = session.info.pop('seats', None)
+    if pending is None:
+        return
+
+    if pending["recount"]:
+        recount(session)
+        return
+
+    _add_changes(pending, _counts(session.connection(), Enrollment.id, pending["enrollments"]))
+    changes = {course_id: count for course_id, count in pending["changes"].items() if count}
+    if changes:
+        session.connection().execute(
+            update(courses)
+            .where(courses.c.id == bindparam('course'))
+            .values(seats_taken=courses.c.seats_taken + bindparam('change')),
+            [{"course": course_id, "change": count} for course_id, count in changes.items()],
+        )
+        record_changed_tables(session, {courses.name})
+
+    freed = {course_id for course_id, count in changes.items() if count < 0}
+    promote(session, freed | pending["promote"])
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_pending(session):
+    session.info.pop('seats', None)
+
+
+# Fills the free seats of the given courses from their waitlists, oldest
+# entry first. The seats and waitlists of all the courses are read
+# together, a chunk of courses at a time. Returns the number of students
+# enrolled.
+def promote(session, course_ids):
+    connection = session.connection()
+    free = {}
+    for ids in chunked(sorted(course_ids)):
+        for course_id, capacity, taken in connection.execute(
+            select(courses.c.id, courses.c.capacity, courses.c.seats_taken).where(courses.c.id.in_(ids))
+        ):
+            if capacity is None or taken < capacity:
+                free[course_id] = None if capacity is None else capacity - taken
+
+    # The oldest entries of each course, as many as it has free seats
+    waiting = {}
+    for ids in chunked(sorted(free)):
+        place = func.row_number().over(partition_by=WaitlistEntry.course_id, order_by=WaitlistEntry.id).label('place')
+        ranked = select(WaitlistEntry.id, WaitlistEntry.student_id, WaitlistEntry.course_id, place).where(WaitlistEntry.course_id.in_(ids)).subquery()
+        entries = select(ranked.c.id, ranked.c.student_id, ranked.c.course_id).order_by(ranked.c.course_id, ranked.c.id)
+        limits = {course_id: free[course_id] for course_id in ids if free[course_id] is not None}
+        if limits:
+            limit = case(limits, value=ranked.c.course_id)
+            entries = entries.where(or_(limit.is_(None), ranked.c.place <= limit))
+        for id, student_id, course_id in connection.execute(entries):
+            waiting.setdefault(course_id, []).append((id, student_id))
+    if not waiting:
+        return 0
+
+    granted = take_seats(session, {course_id: len(entries) for course_id, entries in waiting.items()})
+    offered = {course_id: entries[:granted.get(course_id, 0)] for course_id, entries in waiting.items()}
+    claimed = _claim(session, [id for entries in offered.values() for id, _ in entries])
+
+    # Entries promoted by a concurrent transaction give their seats back
+    returned = {course_id: sum(id not in claimed for id, _ in entries) for course_id, entries in offered.items()}
+    returned = [{"course": course_id, "seats": count} for course_id, count in returned.items() if count]
+    if returned:
+        connection.execute(
+            update(courses).where(courses.c.id == bindparam('course')).values(seats_taken=courses.c.seats_taken - bindparam('seats')),
+            returned,
+        )
+
+    date_enrolled = datetime.utcnow()
+    add_enrollments(session, [
+        {"student_id": student_id, "course_id": course_id, "grade": "N/A", "date_enrolled": date_enrolled}
+        for course_id in sorted(offered)
+        for id, student_id in offered[course_id] if id in claimed
+    ])
+    return len(claimed)
+
+
+# Deletes waitlist entries, returning the ids actually deleted
+def _claim(session, ids):
+    if not ids:
+        return set()
+
+    connection = session.connection()
+    statement = delete(WaitlistEntry.__table__).where(WaitlistEntry.id.in_(ids))
+    if connection.dialect.delete_returning:
+        claimed = set(connection.scalars(statement.returning(WaitlistEntry.id)))
+    else:
+        claimed = set(connection.scalars(select(WaitlistEntry.id).where(WaitlistEntry.id.in_(ids))))
+        connection.execute(statement)
+
+    if claimed:
+        record_changed_tables(session, {WaitlistEntry.__tablename__})
+    return claimed
+
+
+# Sets every course's seats_taken to its enrollment count, then promotes
+# waitlisted students into any seats that frees up
+def recount(session):
+    session.info.pop('seats', None)
+    connection = session.connection()
+    connection.execute(
+        update(courses).values(
+            seats_taken=select(func.count(Enrollment.id)).where(Enrollment.course_id == courses.c.id).scalar_subquery()
+        )
+    )
+    record_changed_tables(session, {courses.name})
+    return promote(session, connection.scalars(select(WaitlistEntry.course_id).distinct()).all())
+
+
+@click.group('seats')
+def seats_cli():
+    """Manage course seat counts and waitlists."""
+
+
+@seats_cli.command('recount')
+@with_appcontext
+def recount_command():
+    """Recount the seats taken in every course and fill free seats from the waitlists."""
+    started = time.perf_counter()
+    promoted = recount(db.session)
+    db.session.commit()
+    click.echo(f"recounted seats in {time.perf_counter() - started:.1f}s, promoted {promoted} waitlisted students")
@@ -0,0 +1,350 @@
+import json
+from itertools import repeat
+
+from flask import has_request_context, request
+from flask.json.provider import DefaultJSONProvider
+from sqlalchemy import select
+
+from models import db, chunked, Student, Profile, Instructor, Course, Enrollment, WaitlistEntry, CourseReport, InstructorReport, StudentSchedule
+from metrics import serializing, count_rows
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+MSGPACK_MIMETYPE = 'application/msgpack'
+
+
+class RowShape:
+    # Output layout of a serialized row. Keys map to columns, or to a nested
+    # dict for a to-one relationship, which becomes None when its first
+    # column is NULL. build() works a column at a time: the rows are
+    # transposed once, each nested key gets its list of dicts from its own
+    # columns, and each output dict is zipped from its keys and its row of
+    # those lists, all in C rather than a Python call per row.
+    def __init__(self, fields):
+        self.columns = []
+        self._build_columns = self._builder(fields)
+
+    # The dicts of a list of row tuples
+    def build(self, rows):
+        if not rows:
+            return []
+        return self._build_columns(list(zip(*rows)))
+
+    def _builder(self, fields):
+        keys = tuple(fields)
+        parts = []
+        for key, value in fields.items():
+            if isinstance(value, dict):
+                parts.append((len(self.columns), self._builder(value)))
+            else:
+                parts.append((len(self.columns), None))
+                self.columns.append(value)
+
+        def build(columns):
+            values = []
+            for position, build_nested in parts:
+                if build_nested is None:
+                    values.append(columns[position])
+                else:
+                    nested = build_nested(columns)
+                    firsts = columns[position]
+                    if None in firsts:
+                        nested = [item if first is not None else None for item, first in zip(nested, firsts)]
+                    values.append(nested)
+            return list(map(dict, map(zip, repeat(keys), zip(*values))))
+        return build
+
+
+class RowSerializer:
+    # Serializes a model for read-only endpoints straight from Core result
+    # rows, without building ORM objects. To-one relationships come from
+    # outer joins in the same SELECT; collections (children) are loaded for
+    # a whole page at once with one IN query per chunk of parent ids.
+    #
+    # children maps an output key to (serializer, foreign key column,
+    # output key of the child holding the parent id).
+    def __init__(self, model, fields, joins=(), children=None):
+        self.model = model
+        self.shape = RowShape(fields)
+        self.joins = joins
+        self.children = children or {}
+
+    def statement(self):
+        columns = [column.label(f"c{index}") for index, column in enumerate(self.shape.columns)]
+        statement = select(*columns).select_from(self.model)
+        for join in self.joins:
+            statement = statement.outerjoin(join)
+        return statement
+
+    # One page of serialized rows, keyset paginated on id: (items, next_cursor)
+    def page(self, after=None, limit=None):
+        rows, next_cursor = self.model.keyset_page(self.statement(), after, limit)
+        items = self.build(rows)
+        self.attach(items)
+        return items, next_cursor
+
+    # A single serialized row, or None when the id does not exist
+    def one(self, id):
+        row = db.session.execute(self.statement().where(self.model.id == id)).first()
+        if row is None:
+            return None
+
+        item = self.build([row])[0]
+        self.attach([item])
+        return item
+
+    # Same as page(), on an AsyncSession
+    async def page_async(self, session, after=None, limit=None):
+        result = await session.execute(self.model.keyset_statement(self.statement(), after, limit))
+        rows, next_cursor = self.model.split_page(result.all(), limit)
+        items = self.build(rows)
+        await self.attach_async(session, items)
+        return items, next_cursor
+
+    # Same as one(), on an AsyncSession
+    async def one_async(self, session, id):
+        row = (await session.execute(self.statement().where(self.model.id == id))).first()
+        if row is None:
+            return None
+
+        item = self.build([row])[0]
+        await self.attach_async(session, [item])
+        return item
+
+    def build(self, rows):
+        with serializing():
+            items = self.shape.build(rows)
+        count_rows(len(items))
+        return items
+
+    def attach(self, items):
+        for key, (serializer, foreign_key, parent_key) in self.children.items():
+            grouped = {item["id"]: [] for item in items}
+            for ids in chunked(grouped):
+                children = serializer.build(db.session.execute(serializer.children_of(foreign_key, ids)).all())
+                serializer.attach(children)
+                for child in children:
+                    grouped[child[parent_key]].append(child)
+
+            for item in items:
+                item[key] = grouped[item["id"]]
+
+    async def attach_async(self, session, items):
+        for key, (serializer, foreign_key, parent_key) in self.children.items():
+            grouped = {item["id"]: [] for item in items}
+            for ids in chunked(grouped):
+                result = await session.execute(serializer.children_of(foreign_key, ids))
+                children = serializer.build(result.all())
+                await serializer.attach_async(session, children)
+                for child in children:
+                    grouped[child[parent_key]].append(child)
+
+            for item in items:
+                item[key] = grouped[item["id"]]
+
+    # Rows belonging to the given parent ids, in id order
+    def children_of(self, foreign_key, ids):
+        return self.statement().where(foreign_key.in_(ids)).order_by(self.model.id)
+
+
+instructor_fields = {
+    "id": Instructor.id,
+    "name": Instructor.name,
+}
+
+course_rows = RowSerializer(
+    Course,
+    {
+        "id": Course.id,
+        "title": Course.title,
+        "instructor": instructor_fields,
+        "student_count": Course.student_count,
+        "capacity": Course.capacity,
+    },
+    joins=(Course.instructor,),
+)
+
+enrollment_rows = RowSerializer(
+    Enrollment,
+    {
+        "id": Enrollment.id,
+        "student_id": Enrollment.student_id,
+        "course_id": Enrollment.course_id,
+        "date_enrolled": Enrollment.date_enrolled,
+        "grade": Enrollment.grade,
+        "course": {
+            "id": Course.id,
+            "title": Course.title,
+            "instructor_id": Course.instructor_id,
+            "instructor": instructor_fields,
+        },
+    },
+    joins=(Enrollment.course, Course.instructor),
+)
+
+class ScheduledRowSerializer(RowSerializer):
+    # Reads its collections from a precomputed read model joined into the
+    # main SELECT (see schedules.py). Rows the read model doesn't cover yet
+    # come back as None and have their children loaded as usual.
+    def attach(self, items):
+        super().attach(self._unscheduled(items))
+
+    async def attach_async(self, session, items):
+        await super().attach_async(session, self._unscheduled(items))
+
+    def _unscheduled(self, items):
+        return [item for item in items if any(item[key] is None for key in self.children)]
+
+
+student_rows = ScheduledRowSerializer(
+    Student,
+    {
+        "id": Student.id,
+        "name": Student.name,
+        "email": Student.email,
+        "profile": {
+            "student_id": Profile.student_id,
+            "age": Profile.age,
+            "bio": Profile.bio,
+        },
+        "enrollments": StudentSchedule.enrollments,
+    },
+    joins=(Student.profile, StudentSchedule),
+    children={"enrollments": (enrollment_rows, Enrollment.student_id, "student_id")},
+)
+
+instructor_course_rows = RowSerializer(
+    Course,
+    {
+        "id": Course.id,
+        "title": Course.title,
+        "instructor_id": Course.instructor_id,
+    },
+)
+
+instructor_rows = RowSerializer(
+    Instructor,
+    instructor_fields,
+    children={"courses": (instructor_course_rows, Course.instructor_id, "instructor_id")},
+)
+
+waitlist_rows = RowSerializer(
+    WaitlistEntry,
+    {
+        "id": WaitlistEntry.id,
+        "student_id": WaitlistEntry.student_id,
+        "course_id": WaitlistEntry.course_id,
+        "date_added": WaitlistEntry.date_added,
+    },
+)
+
+profile_rows = RowSerializer(
+    Profile,
+    {
+        "age": Profile.age,
+        "bio": Profile.bio,
+        "student_id": Profile.student_id,
+    },
+)
+
+course_report_rows = RowSerializer(
+    CourseReport,
+    {
+        "id": CourseReport.id,
+        "title": CourseReport.title,
+        "instructor_id": CourseReport.instructor_id,
+        "enrollments": CourseReport.enrollments,
+        "grades": CourseReport.grades,
+    },
+)
+
+instructor_report_rows = RowSerializer(
+    InstructorReport,
+    {
+        "id": InstructorReport.id,
+        "name": InstructorReport.name,
+        "courses": InstructorReport.courses,
+        "enrollments": InstructorReport.enrollments,
+        "students": InstructorReport.students,
+        "grades": InstructorReport.grades,
+    },
+)
+
+row_serializers = {
+    Course: course_rows,
+    Enrollment: enrollment_rows,
+    Student: student_rows,
+    Instructor: instructor_rows,
+    Profile: profile_rows,
+    CourseReport: course_report_rows,
+    InstructorReport: instructor_report_rows,
+}
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    # Encodes responses with orjson when it is installed, falling back to
+    # the standard library otherwise. Output matches the default provider:
+    # sorted keys and datetimes as HTTP dates. When the msgpack package is
+    # installed, clients sending Accept: application/msgpack get the same
+    # payload as MessagePack instead.
+    def dumps(self, obj, **kwargs):
+        with serializing():
+            if orjson is None or kwargs:
+                return super().dumps(obj, **kwargs)
+            return self._orjson_dumps(obj).decode()
+
+    def response(self, *args, **kwargs):
+        if msgpack is not None and wants_msgpack():
+            obj = self._prepare_response_obj(args, kwargs)
+            with serializing():
+                body = dumps_msgpack(obj)
+            response = self._app.response_class(body, mimetype=MSGPACK_MIMETYPE)
+        elif orjson is None:
+            response = super().response(*args, **kwargs)
+        else:
+            obj = self._prepare_response_obj(args, kwargs)
+            with serializing():
+                body = self._orjson_dumps(obj)
+            response = self._app.response_class(body, mimetype=self.mimetype)
+
+        if msgpack is not None:
+            response.vary.add('Accept')
+        return response
+
+    def _orjson_dumps(self, obj):
+        options = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+        if self.sort_keys:
+            options |= orjson.OPT_SORT_KEYS
+        if self.compact is False or (self.compact is None and self._app.debug):
+            options |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, default=self.default, option=options)
+
+
+# Encodes obj to JSON bytes the way FastJSONProvider does, for code
+# running outside a Flask application
+def dumps_bytes(obj):
+    if orjson is None:
+        return json.dumps(obj, default=DefaultJSONProvider.default, sort_keys=True).encode()
+    options = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS | orjson.OPT_SORT_KEYS
+    return orjson.dumps(obj, default=DefaultJSONProvider.default, option=options)
+
+
+# Whether the current request prefers MessagePack to JSON
+def wants_msgpack():
+    if not has_request_context():
+        return False
+    return request.accept_mimetypes.best_match(['application/json', MSGPACK_MIMETYPE]) == MSGPACK_MIMETYPE
+
+
+# Encodes obj to MessagePack with the same values as the JSON encoding,
+# datetimes included as HTTP date strings
+def dumps_msgpack(obj):
+    return msgpack.packb(obj, default=DefaultJSONProvider.default)
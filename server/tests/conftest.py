@@ -0,0 +1,73 @@
+import pytest
+from sqlalchemy import event
+
+from app import create_app, cache
+from models import db, upkeep, Student, Profile, Instructor, Course, Enrollment
+
+
+# Adds students, each with a profile and three enrollments, spread over
+# courses and instructors so every relationship has rows
+def populate(students, courses=20, instructors=5):
+    offset = db.session.query(Student).count()
+    teachers = db.session.query(Instructor).all()
+    for n in range(len(teachers), instructors):
+        teachers.append(Instructor(name=f"Instructor {n}"))
+    catalog = db.session.query(Course).all()
+    for n in range(len(catalog), courses):
+        catalog.append(Course(title=f"Course {n}", instructor=teachers[n % instructors]))
+    db.session.add_all(teachers + catalog)
+
+    for n in range(offset, offset + students):
+        student = Student(name=f"Student {n}", email=f"student{n}@example.com")
+        student.profile = Profile(age=20, bio="Bio")
+        db.session.add(student)
+        for course in catalog[n % courses:n % courses + 3]:
+            db.session.add(Enrollment(student=student, course=course))
+    db.session.commit()
+
+
+# App on an empty in-memory database, with a new response cache that is
+# off so every request reaches the database. Only the primary's tables are
+# created: db keeps the bind keys of replicas set up by earlier apps.
+@pytest.fixture
+def app():
+    cache.backend = None
+    app = create_app('testing')
+    cache.backend.max_entries = 0
+    with app.app_context():
+        db.create_all(bind_key=None)
+        yield app
+        db.session.remove()
+        db.drop_all(bind_key=None)
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+# Counts the SQL statements sent to the database while the block runs, and
+# how many of them were commit-time upkeep
+class StatementCounter:
+    def __init__(self, engine):
+        self.engine = engine
+        self.count = 0
+        self.upkeep = 0
+
+    def _increment(self, *args):
+        self.count += 1
+        self.upkeep += upkeep.get()
+
+    def __enter__(self):
+        self.count = 0
+        self.upkeep = 0
+        event.listen(self.engine, 'before_cursor_execute', self._increment)
+        return self
+
+    def __exit__(self, *exc_info):
+        event.remove(self.engine, 'before_cursor_execute', self._increment)
+
+
+@pytest.fixture
+def statements(app):
+    return StatementCounter(db.engine)
@@ -0,0 +1,91 @@
+import asyncio
+import json
+
+import pytest
+
+from app import create_app, cache
+from async_api import AsyncAPI
+from config import TestingConfig
+from conftest import populate
+from models import db
+
+
+# The async engine opens connections of its own, so the database is a
+# file both apps can reach rather than the shared in-memory one
+@pytest.fixture
+def async_api(tmp_path):
+    class FileConfig(TestingConfig):
+        SQLALCHEMY_DATABASE_URI = f"sqlite:///{tmp_path / 'async.db'}"
+
+    cache.backend = None
+    app = create_app(FileConfig)
+    cache.backend.max_entries = 0
+    with app.app_context():
+        db.create_all(bind_key=None)
+        populate(3)
+        api = AsyncAPI(app)
+        yield api
+        asyncio.run(api.engine.dispose())
+        db.session.remove()
+        db.engine.dispose()
+
+
+# Sends one request through the ASGI app. Returns the status, the headers
+# and the body.
+def call(api, method, path, query=b''):
+    scope = {'type': 'http', 'method': method, 'path': path, 'query_string': query, 'headers': []}
+    messages = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        messages.append(message)
+
+    asyncio.run(api(scope, receive, send))
+    start, *bodies = messages
+    return start['status'], dict(start['headers']), b''.join(message['body'] for message in bodies)
+
+
+def test_get(async_api):
+    status, headers, body = call(async_api, 'GET', '/async/student/1')
+    assert status == 200
+    assert headers[b'content-type'] == b'application/json'
+    assert int(headers[b'content-length']) == len(body)
+    assert json.loads(body)["name"] == "Student 0"
+
+    status, headers, body = call(async_api, 'GET', '/async/course', b'limit=2')
+    assert status == 200
+    assert [course["id"] for course in json.loads(body)] == [1, 2]
+    assert headers[b'x-next-cursor'] == b'2'
+
+
+def test_head_sends_the_headers_without_the_body(async_api):
+    _, get_headers, get_body = call(async_api, 'GET', '/async/student/1')
+    status, headers, body = call(async_api, 'HEAD', '/async/student/1')
+    assert status == 200
+    assert body == b''
+    assert headers == get_headers
+    assert int(headers[b'content-length']) == len(get_body)
+
+    status, _, body = call(async_api, 'HEAD', '/async/student/99')
+    assert status == 404
+    assert body == b''
+
+
+@pytest.mark.parametrize('method,path,status', [
+    ('GET', '/async/student/99', 404),
+    ('GET', '/async/nothing', 404),
+    ('GET', '/elsewhere', 404),
+    ('POST', '/async/student', 405),
+])
+def test_errors(async_api, method, path, status):
+    got, _, body = call(async_api, method, path)
+    assert got == status
+    assert "message" in json.loads(body)
+
+
+def test_bad_page_arguments(async_api):
+    status, _, body = call(async_api, 'GET', '/async/student', b'limit=abc')
+    assert status == 400
+    assert json.loads(body) == {"message": "limit must be an integer"}
@@ -0,0 +1,42 @@
+import pytest
+
+from app import cache
+from cache import LRUCache, SharedCache, LocalClient
+from conftest import populate
+from models import db, Course, TableVersion
+
+
+# Renames a course the way another worker process would: committed to the
+# database without this process's commit listeners seeing it
+def rename_elsewhere(course_id, title):
+    with db.engine.begin() as connection:
+        connection.execute(Course.__table__.update().where(Course.__table__.c.id == course_id).values(title=title))
+        TableVersion.bump(connection, {'courses'})
+
+
+@pytest.mark.parametrize('backend', [lambda: LRUCache(max_entries=1000), lambda: SharedCache(LocalClient())])
+def test_cached_response_follows_writes_of_other_processes(client, backend):
+    populate(5)
+    cache.backend = backend()
+
+    hits = cache.stats()["hits"]
+    first = client.get('/course/1')
+    assert client.get('/course/1').get_data() == first.get_data()
+    assert cache.stats()["hits"] == hits + 1
+
+    rename_elsewhere(1, 'Renamed elsewhere')
+    response = client.get('/course/1', headers={'If-None-Match': first.headers['ETag']})
+    assert response.status_code == 200
+    assert response.json["title"] == 'Renamed elsewhere'
+    assert response.headers['ETag'] != first.headers['ETag']
+
+
+def test_not_modified_until_a_write(client):
+    populate(5)
+    etag = client.get('/course').headers['ETag']
+    assert client.get('/course', headers={'If-None-Match': etag}).status_code == 304
+
+    assert client.patch('/course/1', json={"title": "Renamed"}).status_code == 200
+    response = client.get('/course', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.json[0]["title"] == 'Renamed'
@@ -0,0 +1,120 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from changes import compact, expire, _columns, _value, MODELS, INSERT, DELETE
+from conftest import populate
+from models import db, Change
+
+
+# Every entry after since, following X-Next-Cursor a page at a time
+def read_log(client, since=0, limit=7):
+    entries = []
+    while True:
+        response = client.get(f'/changes?since={since}&limit={limit}')
+        assert response.status_code == 200
+        page = response.get_json()
+        assert len(page) <= limit
+        cursor = int(response.headers['X-Next-Cursor'])
+        if not page:
+            assert cursor == since
+            return entries
+        assert cursor == page[-1]["seq"]
+        entries.extend(page)
+        since = cursor
+
+
+# The tables as a consumer rebuilds them by applying entries in order
+def replay(entries):
+    tables = {}
+    for entry in entries:
+        rows = tables.setdefault(entry["table"], {})
+        if entry["op"] == DELETE:
+            rows.pop(entry["id"], None)
+        elif entry["op"] == INSERT:
+            rows[entry["id"]] = entry["data"]
+        else:
+            rows[entry["id"]] = {**rows[entry["id"]], **entry["data"]}
+    return {name: rows for name, rows in tables.items() if rows}
+
+
+def table_contents():
+    tables = {}
+    for model in MODELS:
+        rows = {row.id: {column.key: _value(getattr(row, column.key)) for column in _columns(model)}
+                for row in db.session.scalars(db.select(model))}
+        if rows:
+            tables[model.__tablename__] = rows
+    return tables
+
+
+# Inserts, updates and deletes through the API, including cascades
+def mixed_writes(client):
+    populate(6)
+    assert client.patch('/student/1', json={"name": "Renamed"}).status_code == 200
+    assert client.patch('/student/1', json={"email": "renamed@example.com"}).status_code == 200
+    assert client.patch('/course/2', json={"title": "Retitled", "capacity": 10}).status_code == 200
+    assert client.post('/enrollment', json={"student_id": 1, "course_id": 3}).status_code == 201
+    assert client.delete('/enrollment/3').status_code == 200
+    assert client.delete('/course/4').status_code == 200
+    assert client.delete('/student', json=[5]).status_code == 200
+    new = client.post('/instructor', json={"name": "New"}).get_json()["id"]
+    assert client.patch(f'/instructor/{new}', json={"name": "Newer"}).status_code == 200
+    assert client.delete(f'/instructor/{new}').status_code == 200
+
+
+def test_pages_follow_the_cursor(client):
+    mixed_writes(client)
+    entries = read_log(client)
+    seqs = [entry["seq"] for entry in entries]
+    assert seqs == sorted(seqs) and len(set(seqs)) == len(seqs)
+    assert len(entries) == db.session.query(Change).count()
+
+    assert read_log(client, since=seqs[-5]) == entries[-4:]
+    assert read_log(client, since=seqs[-1]) == []
+
+
+@pytest.mark.parametrize('query', ['', 'since=-1', 'since=abc', 'since=0&limit=abc', 'since=0&wait=abc', 'since=0&wait=nan'])
+def test_bad_arguments_are_rejected(client, query):
+    assert client.get(f'/changes?{query}').status_code == 400
+
+
+def test_replaying_the_log_rebuilds_the_tables(client):
+    mixed_writes(client)
+    assert replay(read_log(client)) == table_contents()
+
+
+def test_compaction_keeps_the_replayed_state(client):
+    mixed_writes(client)
+    entries = read_log(client)
+    middle = entries[len(entries) // 2]["seq"]
+
+    dropped = compact(db.session, entries[-1]["seq"])
+    db.session.commit()
+    assert dropped > 0
+
+    compacted = read_log(client)
+    assert len(compacted) == len(entries) - dropped
+    assert len({(entry["table"], entry["id"]) for entry in compacted}) == len(compacted)
+    assert replay(compacted) == table_contents()
+
+    # A consumer that had read up to the middle before compaction catches
+    # up from where it was
+    read = [entry for entry in entries if entry["seq"] <= middle]
+    assert replay(read + read_log(client, since=middle)) == table_contents()
+
+
+def test_reads_from_before_expiry_get_410(client):
+    populate(2)
+    entries = read_log(client)
+
+    dropped = expire(db.session, datetime.utcnow() + timedelta(seconds=1))
+    db.session.commit()
+    assert dropped == len(entries) - 1
+
+    assert client.get('/changes?since=0').status_code == 410
+    assert client.get(f'/changes?since={entries[-2]["seq"]}').status_code == 410
+
+    assert client.patch('/student/1', json={"name": "Renamed"}).status_code == 200
+    newer = read_log(client, since=entries[-1]["seq"])
+    assert [(entry["table"], entry["id"], entry["op"]) for entry in newer] == [("students", 1, "update")]
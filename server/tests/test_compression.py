@@ -0,0 +1,42 @@
+import json
+import zlib
+
+import pytest
+
+import app as app_module
+from conftest import populate
+
+
+def gzip_decoder():
+    decoder = zlib.decompressobj(31)
+    return decoder.decompress
+
+
+def brotli_decoder():
+    brotli = pytest.importorskip('brotli')
+    return brotli.Decompressor().process
+
+
+# The first chunk of a compressed NDJSON stream decodes to the whole first
+# batch, before the rest of the collection is read
+@pytest.mark.parametrize('encoding,decoder', [('gzip', gzip_decoder), ('br', brotli_decoder)])
+def test_stream_chunks_decode_as_they_arrive(client, monkeypatch, encoding, decoder):
+    populate(30)
+    monkeypatch.setattr(app_module, 'STREAM_BATCH_SIZE', 10)
+    decode = decoder()
+
+    response = client.get('/student?stream=1', headers={'Accept-Encoding': encoding}, buffered=False)
+    assert response.headers['Content-Encoding'] == encoding
+    chunks = iter(response.response)
+    lines = decode(next(chunks)).decode().splitlines()
+    assert [json.loads(line)["id"] for line in lines] == list(range(1, 11))
+
+    rest = b''.join(decode(chunk) for chunk in chunks).decode().splitlines()
+    assert len(rest) == 20
+    response.close()
+
+
+def test_small_bodies_are_not_compressed(client):
+    populate(1)
+    response = client.get('/student/1', headers={'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in response.headers
@@ -0,0 +1,26 @@
+from conftest import populate
+from models import db, Enrollment
+
+
+# Malformed ids get a 400 result of their own and the valid items in the
+# batch are still enrolled
+def test_bulk_enrollment_rejects_malformed_ids(client):
+    populate(2)
+    enrollments = db.session.query(Enrollment).count()
+
+    items = [
+        {"student_id": [1], "course_id": 10},
+        {"student_id": True, "course_id": 10},
+        {"student_id": 1, "course_id": {"id": 10}},
+        {"student_id": 1, "course_id": "10"},
+        "not an object",
+        {"student_id": 1, "course_id": 10},
+    ]
+    response = client.post('/enrollment/bulk', json=items)
+    assert response.status_code == 200
+
+    body = response.get_json()
+    assert [result["status"] for result in body["results"]] == [400, 400, 400, 400, 400, 201]
+    assert body["created"] == 1 and body["failed"] == 5
+    assert db.session.query(Enrollment).count() == enrollments + 1
+    assert db.session.query(Enrollment).filter_by(student_id=1, course_id=10).count() == 1
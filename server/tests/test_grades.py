@@ -0,0 +1,48 @@
+import pytest
+
+from conftest import populate
+from grades import grade_queue, GradeQueue
+from models import db, Enrollment
+
+
+@pytest.mark.parametrize('grade', [None, 5, ["A"]])
+def test_grades_must_be_strings(client, grade):
+    populate(1)
+    response = client.post('/enrollment/grades', json=[{"id": 1, "grade": grade}])
+    assert response.status_code == 400
+    assert db.session.get(Enrollment, 1).grade == "N/A"
+
+
+# An update the database refuses is dropped on its own, and the rest of
+# its batch is still written
+def test_refused_updates_are_dropped_without_blocking_the_batch(client):
+    populate(2)
+    db.session.execute(db.text(
+        "CREATE TRIGGER no_bad_grades BEFORE UPDATE OF grade ON enrollments "
+        "WHEN NEW.grade = 'F-' BEGIN SELECT RAISE(ABORT, 'no such grade'); END"
+    ))
+    db.session.commit()
+    dropped = grade_queue.stats()["dropped"]
+
+    grades = [{"id": id, "grade": "F-" if id in (2, 5) else "A"} for id in range(1, 7)]
+    response = client.post('/enrollment/grades', json=grades)
+    assert response.status_code == 202
+
+    db.session.expire_all()
+    assert {e.id: e.grade for e in db.session.scalars(db.select(Enrollment))} == {
+        1: "A", 2: "N/A", 3: "A", 4: "A", 5: "N/A", 6: "A",
+    }
+    stats = grade_queue.stats()
+    assert stats["dropped"] - dropped == 2
+    assert stats["dropped_ids"][-2:] == [2, 5]
+
+
+# create_app runs init_app on the same queue for every app it builds
+def test_shutdown_is_registered_once_per_queue(app, monkeypatch):
+    registered = []
+    monkeypatch.setattr('grades.atexit.register', registered.append)
+
+    queue = GradeQueue()
+    for _ in range(3):
+        queue.init_app(app)
+    assert registered == [queue.shutdown]
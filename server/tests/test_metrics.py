@@ -0,0 +1,16 @@
+from conftest import populate
+from models import db
+
+
+def test_failed_statements_are_counted_and_leave_nothing_behind(client):
+    populate(2)
+    # Enrolling the same student twice trips the unique constraint
+    first = client.post('/enrollment', json={"student_id": 1, "course_id": 10})
+    assert first.status_code == 201
+    for _ in range(3):
+        response = client.post('/enrollment', json={"student_id": 1, "course_id": 10})
+        assert response.status_code == 409
+        assert 'queries' in response.headers['Server-Timing']
+
+    with db.engine.connect() as connection:
+        assert not connection.info.get('query_started')
@@ -0,0 +1,27 @@
+import pytest
+
+from conftest import populate
+
+
+def test_keyset_pages(client):
+    populate(5)
+    response = client.get('/student?limit=2')
+    assert [student["id"] for student in response.json] == [1, 2]
+    assert response.headers['X-Next-Cursor'] == '2'
+
+    response = client.get('/student?limit=2&after=4')
+    assert [student["id"] for student in response.json] == [5]
+    assert 'X-Next-Cursor' not in response.headers
+
+
+@pytest.mark.parametrize('query', ['after=abc', 'limit=abc', 'limit=2&after=1.5'])
+def test_non_integer_cursor_or_limit(client, query):
+    populate(5)
+    response = client.get(f'/student?{query}')
+    assert response.status_code == 400
+    assert 'must be an integer' in response.json['message']
+
+
+def test_unknown_fields(client):
+    populate(1)
+    assert client.get('/student?fields=name,password').status_code == 400
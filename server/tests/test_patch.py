@@ -0,0 +1,79 @@
+import pytest
+
+from conftest import populate
+from models import db, Student, Profile, Course
+
+
+def test_patch_updates_only_the_given_fields(client):
+    populate(2)
+    response = client.patch('/student/1', json={"name": "Renamed"})
+    assert response.status_code == 200
+    assert response.get_json() == {"id": 1, "name": "Renamed", "email": "student0@example.com"}
+
+    response = client.patch('/course/1', json={"capacity": None})
+    assert response.status_code == 200
+    assert response.get_json()["capacity"] is None
+
+
+@pytest.mark.parametrize('url, body', [
+    ('/student/1', {"name": ["x"]}),
+    ('/student/1', {"name": None}),
+    ('/student/1', {"email": 5}),
+    ('/profile/1', {"age": {}}),
+    ('/profile/1', {"age": True}),
+    ('/profile/1', {"age": "20"}),
+    ('/profile/1', {"bio": None}),
+    ('/instructor/1', {"name": None}),
+    ('/course/1', {"title": 1.5}),
+])
+def test_patch_rejects_values_the_column_cannot_hold(client, url, body):
+    populate(2)
+    response = client.patch(url, json=body)
+    assert response.status_code == 400
+
+    db.session.expire_all()
+    assert db.session.get(Student, 1).name == "Student 0"
+    assert db.session.get(Profile, 1).age == 20
+    assert db.session.get(Course, 1).title == "Course 0"
+
+
+def test_patch_reports_unique_clashes_as_conflicts(client):
+    populate(2)
+    response = client.patch('/student/1', json={"email": "student1@example.com"})
+    assert response.status_code == 409
+
+
+def test_bulk_patch_checks_each_item(client):
+    populate(3)
+    items = [
+        {"id": 1, "name": "Renamed"},
+        {"id": 2, "name": None},
+        {"id": 2, "name": ["x"]},
+        {"id": True, "name": "Renamed"},
+        {"id": 3, "nickname": "x"},
+        {"id": 99, "name": "Renamed"},
+        {"id": 3, "email": "new@example.com"},
+    ]
+    response = client.patch('/student', json=items)
+    assert response.status_code == 200
+
+    body = response.get_json()
+    assert [result["status"] for result in body["results"]] == [200, 400, 400, 400, 400, 404, 200]
+    assert body["updated"] == 2 and body["failed"] == 5
+
+    db.session.expire_all()
+    assert [(s.name, s.email) for s in db.session.scalars(db.select(Student).order_by(Student.id))] == [
+        ("Renamed", "student0@example.com"),
+        ("Student 1", "student1@example.com"),
+        ("Student 2", "new@example.com"),
+    ]
+
+
+def test_bulk_patch_conflict_updates_nothing(client):
+    populate(2)
+    items = [{"id": 1, "name": "Renamed"}, {"id": 2, "email": "student0@example.com"}]
+    response = client.patch('/student', json=items)
+    assert response.status_code == 409
+
+    db.session.expire_all()
+    assert db.session.get(Student, 1).name == "Student 0"
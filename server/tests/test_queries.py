@@ -0,0 +1,91 @@
+import pytest
+
+from conftest import populate
+from models import db, Course, Enrollment
+
+# List and by-ID routes, with the statements each issues: the table
+# version read for the ETag, then the payload's queries
+ROUTES = [
+    ('/course', 2),
+    ('/course/1', 2),
+    ('/course/1/waitlist', 3),
+    ('/student', 2),
+    ('/student/1', 2),
+    ('/student_count', 2),
+    ('/instructor', 3),
+    ('/instructor/1', 3),
+    ('/enrollment', 2),
+    ('/enrollment/1', 2),
+    ('/profile/1', 2),
+    ('/reports/courses', 2),
+    ('/reports/instructors', 2),
+]
+
+
+# The count is fixed: it doesn't grow with the rows a response holds
+@pytest.mark.parametrize('url,limit', ROUTES)
+def test_statements_per_request(app, client, statements, url, limit):
+    populate(10)
+    with statements:
+        assert client.get(url).status_code == 200
+    small = statements.count
+
+    populate(40)
+    with statements:
+        assert client.get(url).status_code == 200
+
+    assert statements.count == small
+    assert statements.count <= limit
+
+
+# Routine writes, with the statements each issues including the upkeep of
+# seats, the reports, schedules, search index and change log, and one
+# version bump for every table written. Only the write's own statements,
+# not that commit-time upkeep, count toward the N+1 warning.
+WRITES = [
+    ('post', '/instructor', {"name": "New Instructor"}, 9),
+    ('patch', '/instructor/1', {"name": "Renamed"}, 13),
+    ('delete', '/instructor/2', None, 15),
+    ('post', '/course', {"title": "New Course", "instructor_id": 1}, 11),
+    ('patch', '/course/1', {"title": "Renamed"}, 13),
+    ('patch', '/course/1', {"capacity": 100}, 6),
+    ('delete', '/course/6', None, 16),
+    ('delete', '/student', [7], 15),
+    ('post', '/enrollment', {"student_id": 1, "course_id": 12}, 15),
+    ('post', '/enrollment/bulk', [{"student_id": n, "course_id": 12} for n in (1, 2, 3)] + [{"student_id": 4, "course_id": 15}], 18),
+    ('delete', '/enrollment/2', None, 15),
+    ('post', '/enrollment/grades', [{"id": 3, "grade": "B"}], 15),
+]
+
+
+def assert_within(app, statements, limit):
+    assert statements.count <= limit
+    assert statements.count - statements.upkeep <= app.config['N_PLUS_ONE_THRESHOLD']
+
+
+@pytest.mark.parametrize('method,url,body,limit', WRITES)
+def test_statements_per_write(app, client, statements, method, url, body, limit):
+    populate(40)
+    with statements:
+        response = getattr(client, method)(url, json=body)
+    assert response.status_code < 300
+    assert_within(app, statements, limit)
+
+
+# Freeing a seat in a full course also promotes the head of its waitlist
+@pytest.mark.parametrize('route,limit', [('enrollment', 15), ('student', 22)])
+def test_statements_per_write_with_promotion(app, client, statements, route, limit):
+    populate(40)
+    taken = db.session.get(Course, 1).seats_taken
+    assert client.patch('/course/1', json={"capacity": taken}).status_code == 200
+    assert client.post('/enrollment', json={"student_id": 39, "course_id": 1}).status_code == 202
+    enrollment = db.session.scalars(db.select(Enrollment).filter_by(course_id=1)).first()
+
+    with statements:
+        if route == 'enrollment':
+            response = client.delete(f'/enrollment/{enrollment.id}')
+        else:
+            response = client.delete('/student', json=[enrollment.student_id])
+    assert response.status_code == 200
+    assert db.session.scalars(db.select(Enrollment).filter_by(course_id=1, student_id=39)).first() is not None
+    assert_within(app, statements, limit)
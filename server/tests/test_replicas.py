@@ -0,0 +1,99 @@
+import pytest
+from sqlalchemy import select, update
+
+from app import create_app, cache
+from config import TestingConfig
+from conftest import populate
+from models import db, Student
+from replicas import replicas, copy_sqlite, READ_VERSION_COOKIE, READ_VERSION_HEADER, PRIMARY
+
+
+# App on a SQLite primary with one SQLite replica, both files. The replica
+# starts as a copy of the populated primary.
+@pytest.fixture
+def replica_app(tmp_path):
+    primary, replica = tmp_path / 'primary.db', tmp_path / 'replica.db'
+
+    class ReplicaConfig(TestingConfig):
+        SQLALCHEMY_DATABASE_URI = f"sqlite:///{primary}"
+        SQLALCHEMY_REPLICA_URLS = [f"sqlite:///{replica}"]
+
+    cache.backend = None
+    app = create_app(ReplicaConfig)
+    cache.backend.max_entries = 0
+    with app.app_context():
+        db.create_all(bind_key=None)
+        populate(3)
+        sync(app)
+        yield app
+        db.session.remove()
+        for engine in db.engines.values():
+            engine.dispose()
+
+
+def sync(app):
+    replica = db.engines['replica_0']
+    replica.dispose()
+    copy_sqlite(db.engine.url.database, replica.url.database)
+
+
+def names(engine):
+    with engine.connect() as connection:
+        return connection.scalars(select(Student.name).order_by(Student.id)).all()
+
+
+def reads():
+    return replicas.stats()["reads"]
+
+
+def test_get_bind_routes_reads_to_the_replica(replica_app):
+    session = db.session()
+    replica = db.engines['replica_0']
+    assert session.get_bind(Student.__mapper__, select(Student)) is db.engine
+
+    session.info['replica'] = replica
+    assert session.get_bind(Student.__mapper__, select(Student)) is replica
+    assert session.get_bind(Student.__mapper__, update(Student).values(name="x")) is db.engine
+    assert session.get_bind(Student.__mapper__, select(Student), bind=db.engine) is db.engine
+    session.info.pop('replica')
+
+
+def test_reads_go_to_the_replica_and_writes_to_the_primary(replica_app):
+    client = replica_app.test_client()
+    assert client.get('/student/1').get_json()["name"] == "Student 0"
+    assert reads() == {'replica_0': 1}
+
+    response = client.patch('/student/1', json={"name": "Renamed"})
+    assert response.status_code == 200
+    assert reads() == {'replica_0': 1}
+    assert names(db.engine)[0] == "Renamed"
+    assert names(db.engines['replica_0'])[0] == "Student 0"
+
+
+# A client that wrote reads from the primary until the replica catches up
+# with its write; other clients keep reading the lagging replica
+def test_read_version_cookie_keeps_writers_off_a_lagging_replica(replica_app):
+    writer, other = replica_app.test_client(), replica_app.test_client()
+    response = writer.patch('/student/1', json={"name": "Renamed"})
+    assert READ_VERSION_COOKIE in response.headers['Set-Cookie']
+    assert 'students:' in response.headers[READ_VERSION_HEADER]
+
+    assert writer.get('/student/1').get_json()["name"] == "Renamed"
+    assert reads() == {PRIMARY: 1}
+    assert other.get('/student/1').get_json()["name"] == "Student 0"
+    assert reads() == {PRIMARY: 1, 'replica_0': 1}
+
+    # The header works without the cookie
+    headers = {READ_VERSION_HEADER: response.headers[READ_VERSION_HEADER]}
+    assert other.get('/student/1', headers=headers).get_json()["name"] == "Renamed"
+    assert reads() == {PRIMARY: 2, 'replica_0': 1}
+
+    sync(replica_app)
+    assert writer.get('/student/1').get_json()["name"] == "Renamed"
+    assert reads() == {PRIMARY: 2, 'replica_0': 2}
+
+
+def test_replicas_refuse_writes(replica_app):
+    with db.engines['replica_0'].connect() as connection:
+        with pytest.raises(Exception, match='readonly|read-only|query_only'):
+            connection.execute(update(Student).values(name="x"))
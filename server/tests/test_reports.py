@@ -0,0 +1,73 @@
+import random
+
+from sqlalchemy import event
+
+from conftest import populate
+from models import db, Student, Course, Instructor, Enrollment, CourseReport, InstructorReport
+from reports import rebuild
+
+
+def report_rows():
+    db.session.expire_all()
+    courses = db.session.execute(db.select(CourseReport.__table__).order_by(CourseReport.id)).all()
+    instructors = db.session.execute(db.select(InstructorReport.__table__).order_by(InstructorReport.id)).all()
+    return [tuple(row) for row in courses], [tuple(row) for row in instructors]
+
+
+# The reports kept up by each commit match ones computed from scratch
+def assert_reports_current():
+    kept = report_rows()
+    rebuild(db.session)
+    db.session.commit()
+    assert kept == report_rows()
+
+
+def test_reports_follow_every_kind_of_write(client):
+    populate(30, courses=8, instructors=3)
+    assert_reports_current()
+    rng = random.Random(7)
+    ids = lambda model: db.session.scalars(db.select(model.id)).all()
+
+    for step in range(60):
+        action = rng.choice(['enroll', 'unenroll', 'grade', 'move', 'course', 'instructor', 'student', 'new'])
+        if action == 'enroll':
+            client.post('/enrollment', json={"student_id": rng.choice(ids(Student)), "course_id": rng.choice(ids(Course))})
+        elif action == 'unenroll':
+            client.delete(f'/enrollment/{rng.choice(ids(Enrollment))}')
+        elif action == 'grade':
+            updates = [{"id": id, "grade": rng.choice("ABCDF")} for id in rng.sample(ids(Enrollment), 5)]
+            client.post('/enrollment/grades', json=updates)
+        elif action == 'move':
+            enrollment = db.session.get(Enrollment, rng.choice(ids(Enrollment)))
+            enrollment.course_id = rng.choice(ids(Course))
+            try:
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+        elif action == 'course':
+            client.patch(f'/course/{rng.choice(ids(Course))}', json={"instructor_id": rng.choice(ids(Instructor)), "title": f"Course {step}"})
+        elif action == 'instructor':
+            client.patch(f'/instructor/{rng.choice(ids(Instructor))}', json={"name": f"Instructor {step}"})
+        elif action == 'student':
+            client.delete('/student', json=[rng.choice(ids(Student))])
+        else:
+            instructor = Instructor(name=f"Instructor {step}")
+            db.session.add(Course(title=f"Course {step}", instructor=instructor))
+            db.session.commit()
+        assert_reports_current()
+
+    client.delete(f'/course/{ids(Course)[0]}')
+    assert_reports_current()
+    client.delete(f'/instructor/{ids(Instructor)[0]}')
+    assert_reports_current()
+
+
+# Enrolling adjusts the counts of one course and its instructor instead of
+# aggregating their enrollments again
+def test_enrolling_does_not_aggregate_enrollments(client):
+    populate(30)
+    statements = []
+    event.listen(db.engine, 'before_cursor_execute', lambda conn, cursor, statement, *args: statements.append(statement))
+    assert client.post('/enrollment', json={"student_id": 1, "course_id": 10}).status_code == 201
+    assert not [statement for statement in statements if 'count(DISTINCT' in statement or 'GROUP BY courses.id' in statement]
+    assert_reports_current()
@@ -0,0 +1,83 @@
+import random
+
+from werkzeug.http import http_date
+
+from conftest import populate
+from models import db, Student, Course, Instructor, Enrollment, StudentSchedule
+
+
+# Each student's enrollments as the join of enrollments, courses and
+# instructors gives them right now
+def live_schedules():
+    schedules = {}
+    for student in db.session.scalars(db.select(Student)):
+        schedules[student.id] = [
+            {
+                "id": enrollment.id,
+                "student_id": enrollment.student_id,
+                "course_id": enrollment.course_id,
+                "date_enrolled": http_date(enrollment.date_enrolled),
+                "grade": enrollment.grade,
+                "course": None if enrollment.course is None else {
+                    "id": enrollment.course.id,
+                    "title": enrollment.course.title,
+                    "instructor_id": enrollment.course.instructor_id,
+                    "instructor": None if enrollment.course.instructor is None else {
+                        "id": enrollment.course.instructor.id,
+                        "name": enrollment.course.instructor.name,
+                    },
+                },
+            }
+            for enrollment in sorted(student.enrollments, key=lambda enrollment: enrollment.id)
+        ]
+    return schedules
+
+
+def assert_schedules_current():
+    db.session.expire_all()
+    kept = {row.id: row.enrollments for row in db.session.scalars(db.select(StudentSchedule))}
+    assert kept == live_schedules()
+
+
+def test_schedules_follow_every_kind_of_write(client):
+    populate(30, courses=8, instructors=3)
+    assert_schedules_current()
+    rng = random.Random(11)
+    ids = lambda model: db.session.scalars(db.select(model.id)).all()
+
+    for step in range(60):
+        action = rng.choice(['enroll', 'bulk', 'unenroll', 'grade', 'move', 'course', 'instructor',
+                             'student', 'new student', 'new course', 'delete course'])
+        if action == 'enroll':
+            client.post('/enrollment', json={"student_id": rng.choice(ids(Student)), "course_id": rng.choice(ids(Course))})
+        elif action == 'bulk':
+            items = [{"student_id": rng.choice(ids(Student)), "course_id": rng.choice(ids(Course))} for _ in range(4)]
+            client.post('/enrollment/bulk', json=items)
+        elif action == 'unenroll':
+            client.delete(f'/enrollment/{rng.choice(ids(Enrollment))}')
+        elif action == 'grade':
+            updates = [{"id": id, "grade": rng.choice("ABCDF")} for id in rng.sample(ids(Enrollment), 5)]
+            client.post('/enrollment/grades', json=updates)
+        elif action == 'move':
+            enrollment = db.session.get(Enrollment, rng.choice(ids(Enrollment)))
+            enrollment.course_id = rng.choice(ids(Course))
+            try:
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+        elif action == 'course':
+            client.patch(f'/course/{rng.choice(ids(Course))}', json={"instructor_id": rng.choice(ids(Instructor)), "title": f"Course {step}"})
+        elif action == 'instructor':
+            client.patch(f'/instructor/{rng.choice(ids(Instructor))}', json={"name": f"Instructor {step}"})
+        elif action == 'student':
+            client.delete('/student', json=[rng.choice(ids(Student))])
+        elif action == 'new student':
+            client.post('/student', json={"name": f"Student {step}", "email": f"new{step}@example.com"})
+        elif action == 'new course':
+            client.post('/course', json={"title": f"Course {step}", "instructor_id": rng.choice(ids(Instructor))})
+        else:
+            client.delete(f'/course/{rng.choice(ids(Course))}')
+        assert_schedules_current()
+
+    client.delete(f'/instructor/{ids(Instructor)[0]}')
+    assert_schedules_current()
@@ -0,0 +1,148 @@
+import threading
+
+import pytest
+from sqlalchemy import func, select
+
+import seats
+from app import create_app, cache
+from config import TestingConfig
+from conftest import populate
+from models import db, Course, Enrollment, WaitlistEntry
+
+
+# App on a SQLite file, so that requests on several threads each get a
+# connection of their own and really do race for the seats
+@pytest.fixture
+def file_app(tmp_path):
+    class FileConfig(TestingConfig):
+        SQLALCHEMY_DATABASE_URI = f"sqlite:///{tmp_path / 'seats.db'}"
+        SQLALCHEMY_ENGINE_OPTIONS = {'pool_size': 20, 'max_overflow': 20}
+
+    cache.backend = None
+    app = create_app(FileConfig)
+    cache.backend.max_entries = 0
+    with app.app_context():
+        db.create_all(bind_key=None)
+        yield app
+        db.session.remove()
+        db.drop_all(bind_key=None)
+        db.engine.dispose()
+
+
+def small_course(capacity):
+    course = Course(title="Small", capacity=capacity)
+    db.session.add(course)
+    db.session.commit()
+    return course.id
+
+
+def enrolled(course_id):
+    db.session.expire_all()
+    return db.session.scalar(select(func.count(Enrollment.id)).where(Enrollment.course_id == course_id))
+
+
+def assert_seats_counted():
+    db.session.expire_all()
+    rows = db.session.execute(
+        select(Course.id, Course.seats_taken, func.count(Enrollment.id))
+        .outerjoin(Enrollment, Enrollment.course_id == Course.id)
+        .group_by(Course.id)
+    )
+    assert all(taken == count for _, taken, count in rows)
+
+
+# Runs call(n) for each n on its own thread, all started together
+def race(calls, call):
+    start = threading.Barrier(len(calls))
+    results = [None] * len(calls)
+
+    def run(index):
+        start.wait()
+        results[index] = call(calls[index])
+
+    threads = [threading.Thread(target=run, args=(index,)) for index in range(len(calls))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def test_concurrent_enrollments_fill_exactly_the_capacity(file_app):
+    populate(30)
+    course_id = small_course(5)
+    client = file_app.test_client()
+
+    responses = race(range(1, 31), lambda student_id: client.post(
+        '/enrollment', json={"student_id": student_id, "course_id": course_id}
+    ).status_code)
+
+    assert responses.count(201) == 5
+    assert responses.count(202) == 25
+    assert enrolled(course_id) == 5
+    assert db.session.get(Course, course_id).seats_taken == 5
+    assert db.session.scalar(select(func.count(WaitlistEntry.id)).where(WaitlistEntry.course_id == course_id)) == 25
+    assert_seats_counted()
+
+
+def test_concurrent_take_seats_never_oversubscribe(file_app):
+    populate(3)
+    course_ids = [small_course(4), small_course(None)]
+
+    def take(_):
+        with file_app.app_context():
+            granted = seats.take_seats(db.session, {course_ids[0]: 1, course_ids[1]: 2})
+            db.session.commit()
+            return granted
+
+    granted = race(range(10), take)
+    assert sum(result[course_ids[0]] for result in granted) == 4
+    assert sum(result[course_ids[1]] for result in granted) == 20
+    db.session.expire_all()
+    assert [db.session.get(Course, id).seats_taken for id in course_ids] == [4, 20]
+
+
+def test_take_seat_stops_at_the_capacity(app):
+    populate(1)
+    course_id = small_course(2)
+    assert [seats.take_seat(db.session, course_id) for _ in range(3)] == [True, True, False]
+    db.session.rollback()
+
+
+# Freeing a seat enrolls the oldest waitlisted student in the same commit
+@pytest.mark.parametrize('free', ['enrollment', 'student', 'capacity'])
+def test_freed_seats_go_to_the_waitlist(client, free):
+    populate(6)
+    course_id = small_course(2)
+    statuses = [client.post('/enrollment', json={"student_id": student_id, "course_id": course_id}).status_code
+                for student_id in range(1, 6)]
+    assert statuses == [201, 201, 202, 202, 202]
+
+    if free == 'enrollment':
+        first = db.session.scalar(select(Enrollment.id).where(Enrollment.course_id == course_id, Enrollment.student_id == 1))
+        assert client.delete(f'/enrollment/{first}').status_code == 200
+    elif free == 'student':
+        assert client.delete('/student', json=[1]).status_code == 200
+    else:
+        assert client.patch(f'/course/{course_id}', json={"capacity": 3}).status_code == 200
+
+    students = set(db.session.scalars(select(Enrollment.student_id).where(Enrollment.course_id == course_id)))
+    assert students == ({2, 3} if free != 'capacity' else {1, 2, 3})
+    waitlist = client.get(f'/course/{course_id}/waitlist').get_json()
+    assert [entry["student_id"] for entry in waitlist] == [4, 5]
+    assert_seats_counted()
+
+
+def test_promote_fills_free_seats_oldest_first(app):
+    populate(6)
+    course_id = small_course(1)
+    for student_id in (4, 2, 5):
+        seats.join_waitlist(db.session, student_id, course_id)
+    db.session.get(Course, course_id).capacity = 2
+    db.session.flush()
+
+    assert seats.promote(db.session, [course_id]) == 2
+    db.session.commit()
+    assert set(db.session.scalars(select(Enrollment.student_id).where(Enrollment.course_id == course_id))) == {4, 2}
+    assert db.session.scalars(select(WaitlistEntry.student_id)).all() == [5]
+    assert_seats_counted()
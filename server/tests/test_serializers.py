@@ -0,0 +1,42 @@
+import pytest
+
+from conftest import populate
+from serializers import RowShape
+
+
+@pytest.mark.parametrize('url', ['/student', '/student/1', '/course', '/enrollment/1'])
+def test_msgpack_matches_json(client, url):
+    msgpack = pytest.importorskip('msgpack')
+    populate(3)
+    expected = client.get(url).get_json()
+
+    response = client.get(url, headers={'Accept': 'application/msgpack'})
+    assert response.status_code == 200
+    assert response.headers['Content-Type'] == 'application/msgpack'
+    assert 'Accept' in response.vary
+    assert msgpack.unpackb(response.data) == expected
+
+
+def test_json_is_the_default(client):
+    populate(1)
+    response = client.get('/student/1', headers={'Accept': '*/*'})
+    assert response.headers['Content-Type'] == 'application/json'
+    assert response.get_json()["id"] == 1
+
+
+# Nested dicts keep their place among the keys and are None when their
+# first column is NULL
+def test_row_shape_builds_nested_dicts_in_key_order():
+    shape = RowShape({"id": "c0", "inner": {"id": "c1", "deeper": {"id": "c2"}, "name": "c3"}, "last": "c4"})
+    assert shape.columns == ["c0", "c1", "c2", "c3", "c4"]
+
+    rows = [(1, 10, 100, "x", "a"), (2, 20, None, "y", "b"), (3, None, None, None, "c")]
+    items = shape.build(rows)
+    assert items == [
+        {"id": 1, "inner": {"id": 10, "deeper": {"id": 100}, "name": "x"}, "last": "a"},
+        {"id": 2, "inner": {"id": 20, "deeper": None, "name": "y"}, "last": "b"},
+        {"id": 3, "inner": None, "last": "c"},
+    ]
+    assert [list(item) for item in items] == [["id", "inner", "last"]] * 3
+    assert list(items[0]["inner"]) == ["id", "deeper", "name"]
+    assert shape.build([]) == []
@@ -0,0 +1,35 @@
+import os
+import subprocess
+import sys
+
+from benchmarks.startup import CLI_ONLY_MODULES
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+# A serving worker imports wsgi without the modules only the flask
+# command needs. Runs in a fresh interpreter, as pytest has imported them.
+def test_wsgi_does_not_import_cli_modules(tmp_path):
+    env = {**os.environ, 'APP_ENV': 'production', 'DATABASE_URL': f"sqlite:///{tmp_path / 'app.db'}"}
+    script = 'import sys, wsgi; print(" ".join(name for name in sys.argv[1:] if name in sys.modules))'
+    output = subprocess.run([sys.executable, '-c', script, *CLI_ONLY_MODULES], cwd=SERVER_DIR,
+                            env=env, check=True, capture_output=True, text=True).stdout
+    assert output.split() == []
+
+
+# A loose bound on a cold import of wsgi, about five times what it takes
+# now (see benchmarks.startup for the budget against a real workload).
+# The best of three runs, so that one slow start on a busy machine
+# doesn't fail it.
+IMPORT_BOUND_S = 3.0
+
+
+def test_wsgi_imports_within_the_bound(tmp_path):
+    env = {**os.environ, 'APP_ENV': 'production', 'DATABASE_URL': f"sqlite:///{tmp_path / 'app.db'}"}
+    script = 'import time; started = time.perf_counter(); import wsgi; print(time.perf_counter() - started)'
+    times = [
+        float(subprocess.run([sys.executable, '-c', script], cwd=SERVER_DIR,
+                             env=env, check=True, capture_output=True, text=True).stdout)
+        for _ in range(3)
+    ]
+    assert min(times) < IMPORT_BOUND_S
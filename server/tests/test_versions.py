@@ -0,0 +1,27 @@
+from conftest import populate
+from models import db, TableVersion
+
+
+def versions():
+    return dict(db.session.query(TableVersion.table_name, TableVersion.version).all())
+
+
+def test_each_written_table_moves_once_per_transaction(client):
+    populate(5)
+    before = versions()
+    assert client.patch('/student/1', json={"name": "Renamed"}).status_code == 200
+    after = versions()
+
+    assert after['students'] == before['students'] + 1
+    assert after['courses'] == before['courses']
+    assert after['enrollments'] == before['enrollments']
+
+
+def test_etag_of_unwritten_tables_stays(client):
+    populate(5)
+    course_etag = client.get('/course/1').headers['ETag']
+    profile_etag = client.get('/profile/1').headers['ETag']
+
+    assert client.patch('/course/1', json={"title": "Renamed"}).status_code == 200
+    assert client.get('/course/1').headers['ETag'] != course_etag
+    assert client.get('/profile/1', headers={'If-None-Match': profile_etag}).status_code == 304